@@ -0,0 +1,527 @@
+# The archiver daemon, which archives the logs that Zeek rotates on a host.
+#
+# Without the daemon, Zeek runs the archive-log script for every rotated log,
+# and each run forks a dozen short-lived processes.  If the ArchiverDaemon
+# option is set, archive-log instead hands the log over to a daemon running on
+# the host, by sending its arguments along with an open file descriptor of
+# the node's working directory through a unix socket (see enqueue()).  The
+# daemon computes the archive names in-process, and archives the logs with a
+# bounded pool of worker threads.
+#
+# For each log queued, the daemon creates the file
+# ".archive-log.queued.<n>.tmp" in the node's working directory, containing
+# the daemon's PID, and removes it once the log has been archived, so that
+# post-terminate waits for it just like for an archive-log process.  All
+# file operations use the directory's file descriptor, because post-terminate
+# moves the working directory when the node stops.
+
+from __future__ import print_function
+import os
+import re
+import sys
+import json
+import time
+import array
+import errno
+import queue
+import importlib
+import importlib.util
+import signal
+import socket
+import logging
+import threading
+import subprocess
+
+from ZeekControl import compress
+from ZeekControl import iothrottle
+from ZeekControl import logcatalog
+from ZeekControl import postproc
+
+_TimestampPattern = re.compile(r"^[0-9][0-9]-[0-1][0-9]-[0-3][0-9]_[0-2][0-9][.][0-5][0-9][.][0-5][0-9]$")
+
+# Reads the variables from zeekctl-config.sh into a dict.
+def read_config(path):
+    cfg = {}
+
+    with open(path, "r") as f:
+        for line in f:
+            key, sep, val = line.rstrip("\n").partition("=")
+            if not sep:
+                continue
+
+            if len(val) >= 2 and val[0] == '"' and val[-1] == '"':
+                val = val[1:-1].replace('\\"', '"')
+
+            cfg[key] = val
+
+    return cfg
+
+# Converts a timestamp from the format YY-MM-DD_HH.MM.SS used by Zeek to the
+# format YYYY-MM-DD-HH-MM-SS used by make-archive-name.
+def expand_timestamp(ts):
+    century = time.localtime().tm_year // 100
+    return "%d%s" % (century, ts.replace("_", "-").replace(".", "-"))
+
+# Returns the archive name of a log as the default make-archive-name script
+# does, for the file name "<name>.<ext>", and timestamps in the format
+# YYYY-MM-DD-HH-MM-SS.  This is also an example of a function for the
+# ArchiveNameFunction option.
+def default_archive_name(fname, writer, start, end):
+    name, _, ext = fname.rpartition(".")
+    day = start[:10]
+    tfrom = start[11:].replace("-", ":")
+
+    if end:
+        return "%s/%s.%s-%s.%s" % (day, name, tfrom, end[11:].replace("-", ":"), ext)
+
+    return "%s/%s.%s-current.%s" % (day, name, tfrom, ext)
+
+# The functions loaded for the ArchiveNameFunction option.
+_NameFunctions = {}
+
+# Returns the function given by "spec", which is either
+# "<file>.py:<function>" or "<module>:<function>", loading it on first use.
+# Raises ArchiveError if that fails.
+def name_function(spec):
+    func = _NameFunctions.get(spec)
+    if func:
+        return func
+
+    source, sep, funcname = spec.rpartition(":")
+    if not sep or not source or not funcname:
+        raise ArchiveError("invalid archive name function (must be <file or module>:<function>): %s" % spec)
+
+    try:
+        if source.endswith(".py"):
+            modspec = importlib.util.spec_from_file_location("_archivename%d" % len(_NameFunctions), source)
+            module = importlib.util.module_from_spec(modspec)
+            modspec.loader.exec_module(module)
+        else:
+            module = importlib.import_module(source)
+
+        func = getattr(module, funcname)
+    except Exception as err:
+        raise ArchiveError("failed to load archive name function %s: %s" % (spec, err))
+
+    if not callable(func):
+        raise ArchiveError("archive name function is not callable: %s" % spec)
+
+    _NameFunctions[spec] = func
+    return func
+
+# Returns the archive name of a log, or raises ArchiveError.  The name is
+# computed in-process by the ArchiveNameFunction if that option is set, or
+# if the MakeArchiveName option refers to the default script, and otherwise
+# by running the script.
+def archive_name(cfg, fname, writer, start, end):
+    spec = cfg.get("archivenamefunction")
+    if spec:
+        func = name_function(spec)
+
+        try:
+            dest = func(fname, writer, start, end)
+        except Exception as err:
+            raise ArchiveError("%s failed: %s" % (spec, err))
+
+        if not dest:
+            raise ArchiveError("%s did not return a file name" % spec)
+
+        return dest
+
+    script = cfg.get("makearchivename", "")
+
+    if script == os.path.join(cfg.get("scriptsdir", ""), "make-archive-name"):
+        return default_archive_name(fname, writer, start, end)
+
+    if not os.path.isfile(script):
+        raise ArchiveError("zeekctl option makearchivename is not set correctly")
+
+    try:
+        dest = subprocess.check_output([script, fname, writer, start, end]).decode().strip()
+    except (OSError, subprocess.CalledProcessError) as err:
+        raise ArchiveError("%s failed: %s" % (script, err))
+
+    if not dest:
+        raise ArchiveError("%s did not return a file name" % script)
+
+    return dest
+
+class ArchiveError(Exception):
+    pass
+
+def _getint(cfg, key, default=0):
+    try:
+        return int(cfg.get(key, default))
+    except ValueError:
+        return default
+
+# Checks the arguments of archive-log.  Returns an error message, or None.
+def check_args(args):
+    if len(args) != 6:
+        return "incorrect number of arguments provided"
+
+    for (what, ts) in (("start", args[2]), ("end", args[3])):
+        if not _TimestampPattern.match(ts):
+            return "%s time must be in format YY-MM-DD_HH.MM.SS: %s" % (what, ts)
+
+    return None
+
+# Archives a log like archive-log does.  "dirfd" is a file descriptor of the
+# node's working directory, "args" are the arguments of archive-log, and
+# "throttle" an optional iothrottle.Throttle for compressing or copying the
+# log.  Raises ArchiveError if the log could not be archived.
+def archive(cfg, dirfd, args, throttle=None):
+    (file_name, base_name, start, end, terminating, writer) = args
+
+    now = time.time()
+    start = expand_timestamp(start)
+    end = expand_timestamp(end)
+
+    gzipped = False
+    ext = file_name.rpartition(".")[2]
+    if ext == "gz":
+        gzipped = True
+        ext = file_name[:-3].rpartition(".")[2]
+
+    dest = archive_name(cfg, "%s.%s" % (base_name, ext), writer, start, end)
+
+    if gzipped:
+        dest += ".gz"
+
+    if not dest.startswith("/"):
+        if not cfg.get("logdir"):
+            raise ArchiveError("zeekctl option logdir is not set")
+        dest = os.path.join(cfg["logdir"], dest)
+
+    try:
+        if not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+    except OSError as err:
+        raise ArchiveError("failed to create log archive directory: %s" % err)
+
+    # Record time of last rotation (for post-terminate).
+    fd = os.open(".rotated.%s" % base_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644, dir_fd=dirfd)
+    os.write(fd, (time.strftime("%y-%m-%d_%H.%M.%S", time.localtime(now)) + "\n").encode())
+    os.close(fd)
+
+    # Run the other postprocessors that must run before the log is moved.
+    pps = postproc.load(cfg.get("postprocdir"))
+    _run_postprocessors(cfg, dirfd, pps, postproc.BeforeMove, args)
+
+    # Test if the log still exists in case one of the postprocessors archived it.
+    try:
+        src = os.open(file_name, os.O_RDONLY, dir_fd=dirfd)
+    except OSError:
+        return
+
+    compression = "gz" if gzipped else "none"
+
+    compress_logs = cfg.get("compresslogsinflight") == "0" and cfg.get("compresslogs") == "1" and not gzipped
+    compress_ext = cfg.get("compressextension")
+    compress_threads = _getint(cfg, "compressthreads")
+
+    try:
+        if compress_logs and compress_threads > 0 and compress_ext in compress.Codecs:
+            dest = "%s.%s" % (dest, compress_ext)
+            compression = compress_ext
+
+            result = compress.compress_file(file_name, dest, compress_ext, compress_threads, cfg.get("tmpdir"), dir_fd=dirfd, throttle=throttle)
+            os.unlink(file_name, dir_fd=dirfd)
+
+            if cfg.get("statsdir"):
+                compress.log_throughput(cfg["statsdir"], base_name, compress_ext, result)
+
+        elif compress_logs and cfg.get("compresscmd"):
+            dest = "%s.%s" % (dest, cfg.get("compressextension"))
+            compression = cfg.get("compressextension")
+
+            with open(dest, "wb") as out:
+                if throttle:
+                    proc = subprocess.Popen("nice %s" % cfg["compresscmd"], shell=True, stdin=subprocess.PIPE, stdout=out)
+                    with os.fdopen(os.dup(src), "rb") as f:
+                        iothrottle.copy(f, proc.stdin, throttle)
+                    proc.stdin.close()
+                    rc = proc.wait()
+                else:
+                    rc = subprocess.call("nice %s" % cfg["compresscmd"], shell=True, stdin=src, stdout=out)
+
+            if rc != 0:
+                raise ArchiveError("possibly failed to archive log file %s to %s" % (file_name, dest))
+
+            os.unlink(file_name, dir_fd=dirfd)
+        else:
+            try:
+                os.rename(file_name, dest, src_dir_fd=dirfd)
+            except OSError as err:
+                if err.errno != errno.EXDEV:
+                    raise
+
+                with os.fdopen(os.dup(src), "rb") as f, open(dest, "wb") as out:
+                    iothrottle.copy(f, out, throttle)
+                os.unlink(file_name, dir_fd=dirfd)
+
+    except (IOError, OSError, subprocess.CalledProcessError) as err:
+        raise ArchiveError("possibly failed to archive log file %s to %s: %s" % (file_name, dest, err))
+
+    finally:
+        os.close(src)
+
+    if cfg.get("archivecatalogdir"):
+        entry = logcatalog.Entry(now, start, end, os.path.getsize(dest), compression, base_name, dest)
+        try:
+            logcatalog.add(cfg["archivecatalogdir"], entry)
+        except (IOError, OSError) as err:
+            raise ArchiveError("failed to add %s to the archive catalog: %s" % (dest, err))
+
+    # Run the postprocessors that run once the log has been archived.
+    _run_postprocessors(cfg, dirfd, pps, postproc.AfterMove, [dest] + list(args[1:]))
+
+# Runs the postprocessors of a stage in the node's directory, and records
+# their run times in the stats log.
+def _run_postprocessors(cfg, dirfd, pps, stage, args):
+    results = postproc.run(pps, stage, args, cfg.get("tmpdir"), preexec_fn=lambda: os.fchdir(dirfd))
+
+    if results and postproc.timing_enabled(cfg):
+        try:
+            # The node's name is that of its directory.
+            node = os.path.basename(os.readlink("/proc/self/fd/%d" % dirfd))
+        except OSError:
+            node = "-"
+
+        try:
+            postproc.log_timing(cfg["statslog"], node, results)
+        except (IOError, OSError) as err:
+            logging.warning("failed to write stats log: %s", err)
+
+def _send(sock, data, fd):
+    sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", [fd]))])
+
+def _recv(sock):
+    fds = array.array("i")
+    data, ancdata, _, _ = sock.recvmsg(65536, socket.CMSG_LEN(fds.itemsize))
+
+    for (level, ctype, cdata) in ancdata:
+        if level == socket.SOL_SOCKET and ctype == socket.SCM_RIGHTS:
+            fds.frombytes(cdata[:len(cdata) - (len(cdata) % fds.itemsize)])
+
+    return data, list(fds)
+
+# Hands a log over to the archiver daemon listening on "sockpath", with the
+# current directory being the node's working directory.  Returns None once
+# the log is queued, or an error message if the daemon rejected it.  Raises
+# socket.error if the daemon is not reachable.
+def enqueue(sockpath, args, timeout=30):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+
+    dirfd = os.open(".", os.O_RDONLY)
+
+    try:
+        sock.connect(sockpath)
+        _send(sock, json.dumps({"args": list(args)}).encode() + b"\n", dirfd)
+        reply = sock.makefile("r").readline().strip()
+    finally:
+        os.close(dirfd)
+        sock.close()
+
+    if reply == "ok":
+        return None
+
+    if not reply:
+        raise socket.error("no reply from archiver")
+
+    return reply
+
+class Archiver:
+    def __init__(self, configfile, sockpath, workers):
+        self.configfile = configfile
+        self.sockpath = sockpath
+        self.workers = max(1, workers)
+        self.queue = queue.Queue()
+        self.threads = []
+        self.count = 0
+        self.running = True
+        self.cfg = None
+        self.cfgmtime = None
+        self.throttle = None
+        self.lock = threading.Lock()
+
+    # Returns the configuration, and the throttle shared by all workers,
+    # reloading both when zeekctl-config.sh changes.
+    def config(self):
+        with self.lock:
+            mtime = os.stat(self.configfile).st_mtime
+            if mtime != self.cfgmtime:
+                self.cfg = read_config(self.configfile)
+                self.cfgmtime = mtime
+                self.throttle = iothrottle.from_config(self.cfg)
+
+            return (self.cfg, self.throttle)
+
+    def serve(self):
+        if os.path.exists(self.sockpath):
+            os.unlink(self.sockpath)
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.sockpath)
+        self.sock.listen(128)
+        self.sock.settimeout(1)
+
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+        logging.info("archiver listening on %s with %d workers", self.sockpath, self.workers)
+
+        try:
+            while self.running:
+                try:
+                    conn, _ = self.sock.accept()
+                except socket.timeout:
+                    continue
+                except socket.error as err:
+                    if err.errno == errno.EINTR:
+                        continue
+                    raise
+
+                try:
+                    self._handle(conn)
+                except Exception as err:
+                    logging.error("failed to queue log: %s", err)
+                finally:
+                    conn.close()
+        finally:
+            self.sock.close()
+            os.unlink(self.sockpath)
+
+        # Finish the queued logs.
+        for t in self.threads:
+            self.queue.put(None)
+
+        for t in self.threads:
+            t.join()
+
+    def stop(self):
+        self.running = False
+
+    def _handle(self, conn):
+        conn.settimeout(10)
+        data, fds = _recv(conn)
+
+        if len(fds) != 1:
+            for fd in fds:
+                os.close(fd)
+            conn.sendall(b"error: no directory received\n")
+            return
+
+        dirfd = fds[0]
+
+        try:
+            args = json.loads(data.decode())["args"]
+        except (ValueError, KeyError, TypeError):
+            os.close(dirfd)
+            conn.sendall(b"error: bad request\n")
+            return
+
+        err = check_args(args)
+        if err:
+            os.close(dirfd)
+            conn.sendall(("error: %s\n" % err).encode())
+            return
+
+        self.count += 1
+        tmpname = ".archive-log.queued.%d.tmp" % self.count
+        fd = os.open(tmpname, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644, dir_fd=dirfd)
+        os.write(fd, ("%d\n" % os.getpid()).encode())
+        os.close(fd)
+
+        self.queue.put((dirfd, tmpname, args))
+        conn.sendall(b"ok\n")
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+
+            (dirfd, tmpname, args) = job
+
+            try:
+                (cfg, throttle) = self.config()
+                archive(cfg, dirfd, args, throttle)
+                logging.info("archived %s", args[0])
+            except ArchiveError as err:
+                logging.error("archive-log: %s", err)
+            except Exception as err:
+                logging.error("archive-log: failed to archive %s: %s", args[0], err)
+            finally:
+                try:
+                    os.unlink(tmpname, dir_fd=dirfd)
+                except OSError:
+                    pass
+                os.close(dirfd)
+
+# Returns the PID of the running daemon, or None.
+def running_pid(pidfile):
+    try:
+        with open(pidfile, "r") as f:
+            pid = int(f.read())
+        os.kill(pid, 0)
+        return pid
+    except (IOError, OSError, ValueError):
+        return None
+
+# Starts the daemon in the background unless it's running already.  Returns
+# once it accepts requests, or raises ArchiveError.
+def start(configfile, sockpath, pidfile, logfile, workers):
+    if running_pid(pidfile):
+        return
+
+    pid = os.fork()
+    if pid == 0:
+        os.setsid()
+        if os.fork() != 0:
+            os._exit(0)
+
+        try:
+            devnull = os.open(os.devnull, os.O_RDWR)
+            os.dup2(devnull, 0)
+            out = os.open(logfile, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            os.dup2(out, 1)
+            os.dup2(out, 2)
+
+            with open(pidfile, "w") as f:
+                f.write("%d\n" % os.getpid())
+
+            run(configfile, sockpath, workers)
+        finally:
+            try:
+                os.unlink(pidfile)
+            except OSError:
+                pass
+            os._exit(0)
+
+    os.waitpid(pid, 0)
+
+    for i in range(100):
+        if os.path.exists(sockpath) and running_pid(pidfile):
+            return
+        time.sleep(0.1)
+
+    raise ArchiveError("the archiver did not start (see %s)" % logfile)
+
+# Runs the daemon in the foreground until it receives SIGTERM.
+def run(configfile, sockpath, workers):
+    logging.basicConfig(format="%(asctime)s %(message)s", level=logging.INFO, stream=sys.stderr)
+
+    # Lower the I/O priority before starting the worker threads, which
+    # inherit it.
+    ioclass = read_config(configfile).get("archiveioclass")
+    if ioclass and not iothrottle.set_ioclass(ioclass):
+        logging.error("failed to set the I/O scheduling class to %s", ioclass)
+
+    archiver = Archiver(configfile, sockpath, workers)
+    signal.signal(signal.SIGTERM, lambda signum, frame: archiver.stop())
+    archiver.serve()
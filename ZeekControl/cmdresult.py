@@ -27,9 +27,11 @@ class CmdResult:
 
     def to_dict(self):
         return {
+            "ok": self.ok,
             "success_count": self.success_count,
             "fail_count": self.fail_count,
             "nodes": self.get_node_data(),
+            "keyval": self.keyval,
         }
 
     def get_node_counts(self):
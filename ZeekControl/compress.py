@@ -0,0 +1,167 @@
+# Parallel compression of archived log files.
+#
+# If the CompressThreads option is set, archived logs are compressed in blocks
+# of BlockSize bytes in parallel, rather than by running CompressCmd.  The
+# format is selected by CompressExtension: with "gz", each block becomes a
+# separate gzip member, and with "zst", a separate zstd frame.  Both formats
+# allow concatenating members or frames, so the result reads as a whole with
+# the standard tools (gunzip, zcat, zstdcat, etc.).  zstd compression uses the
+# zstandard Python module if it's installed, or the zstd command otherwise.
+#
+# CompressThreads caps the number of blocks compressed at the same time on a
+# host, across all logs being archived: while compressing a block, a thread
+# holds a lock on one of CompressThreads slot files in the lock directory.
+#
+# The throughput of each compressed log is appended to <statsdir>/compress.log
+# (see log_throughput()).
+
+from __future__ import print_function
+import os
+import time
+import zlib
+import fcntl
+import errno
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from ZeekControl import iothrottle
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BlockSize = 16 * 1024 * 1024
+
+Codecs = ("gz", "zst")
+
+GzipLevel = 6
+ZstdLevel = 3
+
+# A host-wide cap on concurrent work: each of "count" slots is a lock file
+# <prefix>.<n>.lock in "lockdir".
+class Slots:
+    def __init__(self, lockdir, count, prefix="compress"):
+        self.paths = [os.path.join(lockdir, "%s.%d.lock" % (prefix, i)) for i in range(max(1, count))]
+
+        if not os.path.isdir(lockdir):
+            os.makedirs(lockdir)
+
+    # Blocks until a slot is free, and returns a file descriptor holding it.
+    def acquire(self):
+        while True:
+            for path in self.paths:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except (IOError, OSError) as err:
+                    os.close(fd)
+                    if err.errno not in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                        raise
+
+            time.sleep(0.05)
+
+    def release(self, fd):
+        os.close(fd)
+
+def _gzip_member(data):
+    # wbits 31 writes a gzip header and trailer around the deflate stream.
+    c = zlib.compressobj(GzipLevel, zlib.DEFLATED, 31)
+    return c.compress(data) + c.flush()
+
+def _zstd_frame(data):
+    return zstandard.ZstdCompressor(level=ZstdLevel).compress(data)
+
+# Compresses the file object "src" to the file object "out" in the format of
+# "ext", using up to "threads" threads (and slots), and reading at the pace
+# of the optional iothrottle.Throttle.  Returns the number of bytes read.
+def compress(src, out, ext, threads, slots, throttle=None):
+    if ext == "zst" and not zstandard:
+        return _compress_zstd_cmd(src, out, threads, slots, throttle)
+
+    threads = max(1, threads)
+    compressor = _gzip_member if ext == "gz" else _zstd_frame
+
+    def compress_block(data):
+        fd = slots.acquire()
+        try:
+            return compressor(data)
+        finally:
+            slots.release(fd)
+
+    size = 0
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        while True:
+            data = src.read(BlockSize)
+            if not data:
+                break
+
+            if throttle:
+                throttle.consume(len(data))
+
+            size += len(data)
+            pending.append(executor.submit(compress_block, data))
+
+            # Write blocks in order, and keep a bounded number in memory.
+            while len(pending) > 2 * threads or (pending and pending[0].done()):
+                out.write(pending.popleft().result())
+
+        while pending:
+            out.write(pending.popleft().result())
+
+    return size
+
+def _compress_zstd_cmd(src, out, threads, slots, throttle):
+    cmd = ["zstd", "-q", "-%d" % ZstdLevel, "-T%d" % max(1, threads), "-c"]
+
+    fd = slots.acquire()
+    try:
+        # The zstd command runs its own threads, but holds a single slot.
+        start = src.tell()
+
+        if throttle:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=out)
+            iothrottle.copy(src, proc.stdin, throttle)
+            proc.stdin.close()
+            if proc.wait() != 0:
+                raise subprocess.CalledProcessError(proc.returncode, cmd)
+        else:
+            subprocess.check_call(cmd, stdin=src, stdout=out)
+
+        return os.fstat(src.fileno()).st_size - start
+    finally:
+        slots.release(fd)
+
+# Compresses the file "srcpath" to "destpath", and returns a tuple (bytes
+# read, bytes written, seconds).  Raises an exception if compression fails.
+def compress_file(srcpath, destpath, ext, threads, lockdir, dir_fd=None, throttle=None):
+    if ext not in Codecs:
+        raise ValueError("unsupported compression: %s" % ext)
+
+    slots = Slots(lockdir, threads)
+    start = time.time()
+
+    fd = os.open(srcpath, os.O_RDONLY, dir_fd=dir_fd)
+    with os.fdopen(fd, "rb") as src:
+        with open(destpath, "wb") as out:
+            size = compress(src, out, ext, threads, slots, throttle)
+
+    return (size, os.path.getsize(destpath), time.time() - start)
+
+# Appends the throughput of compressing a log of the stream "base" to
+# <statsdir>/compress.log, one line per log:
+#
+#   <time> <stream> <codec> <bytes read> <bytes written> <seconds> <MB/s>
+def log_throughput(statsdir, base, ext, result):
+    (size, csize, secs) = result
+    mbps = size / 1e6 / secs if secs > 0 else 0.0
+
+    if not os.path.isdir(statsdir):
+        os.makedirs(statsdir)
+
+    with open(os.path.join(statsdir, "compress.log"), "a") as f:
+        f.write("%.6f %s %s %d %d %.3f %.2f\n" % (time.time(), base, ext, size, csize, secs, mbps))
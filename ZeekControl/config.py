@@ -7,6 +7,7 @@ import subprocess
 import re
 import sys
 import configparser
+import threading
 
 from ZeekControl import node as node_mod
 from ZeekControl import options
@@ -26,9 +27,26 @@ from .version import VERSION
 Config = None # Globally accessible instance of Configuration.
 
 class NodeStore:
+    """Stores all configured nodes, indexed by name (not case-sensitive),
+    type, host, and IP address.  Sorted views of the nodes are computed on
+    first use and cached until another node is added, so that lookups stay
+    cheap even for clusters with thousands of worker processes."""
+
     def __init__(self):
-        self.nodestore = {}
-        self.nodenameslower = []
+        self._byname = {}
+        self._bytype = {}
+        self._byhost = {}
+        self._byaddr = {}
+        self._views = {}
+
+    def __len__(self):
+        return len(self._byname)
+
+    def __contains__(self, name):
+        return name.lower() in self._byname
+
+    def values(self):
+        return self._byname.values()
 
     def add_node(self, node):
         # Add a node to the nodestore, but first check for duplicate node
@@ -40,20 +58,102 @@ class NodeStore:
         # if a user defines a node name that conflicts with an auto-generated
         # one (e.g. "worker-1" with lb_procs=2 and "worker-1-2").
         namelower = node.name.lower()
-        if namelower in self.nodenameslower:
-            matchname = ""
-            for nn in self.nodestore:
-                if nn.lower() == namelower:
-                    matchname = nn
-                    break
+        if namelower in self._byname:
+            matchname = self._byname[namelower].name
             raise ConfigurationError('node name "%s" is a duplicate of "%s"' % (node.name, matchname))
 
-        self.nodestore[node.name] = node
-        self.nodenameslower.append(namelower)
+        self._byname[namelower] = node
+        self._bytype.setdefault(node.type, []).append(node)
+        self._byhost.setdefault(node.host, []).append(node)
+        self._byaddr.setdefault(node.addr, []).append(node)
+
+        # Any cached views are now out of date.
+        self._views = {}
+
+    def get(self, name):
+        """Returns the node with the given name (not case-sensitive), or None
+        if there is no such node."""
+        return self._byname.get(name.lower())
+
+    def by_type(self, nodetype):
+        """Returns a sorted list of all nodes of the given type."""
+        return list(self._view("type", nodetype))
+
+    def by_host(self, host):
+        """Returns a sorted list of all nodes on the given host."""
+        return list(self._view("host", host))
+
+    def by_addr(self, addr):
+        """Returns a sorted list of all nodes with the given IP address."""
+        return list(self._view("addr", addr))
+
+    def nodes(self, tag=None):
+        """Returns a new sorted list of nodes matching the given tag (see
+        Configuration.nodes for the meaning of "tag")."""
+        return list(self._view("tag", tag))
+
+    def hosts(self, tag=None, exclude_addrs=()):
+        """Returns a new sorted list of nodes matching the given tag, such
+        that each host appears only once.  Nodes having an address in
+        "exclude_addrs" are skipped."""
+        return list(self._view("hosts", (tag, tuple(exclude_addrs))))
+
+    # Returns the cached sorted list of nodes for the given kind of view and
+    # value (callers must not modify the returned list).
+    def _view(self, kind, val):
+        try:
+            return self._views[(kind, val)]
+        except KeyError:
+            pass
+
+        if kind == "type":
+            view = sorted(self._bytype.get(val, []), key=node_mod.sortnode)
+        elif kind == "host":
+            view = sorted(self._byhost.get(val, []), key=node_mod.sortnode)
+        elif kind == "addr":
+            view = sorted(self._byaddr.get(val, []), key=node_mod.sortnode)
+        elif kind == "tag":
+            view = self._select(val)
+        elif kind == "hosts":
+            tag, exclude = val
+            seen = set()
+            view = []
+            for n in self._view("tag", tag):
+                if n.host in seen or n.addr in exclude:
+                    continue
+                seen.add(n.host)
+                view.append(n)
+        else:
+            raise ValueError("unknown node view: %s" % kind)
+
+        self._views[(kind, val)] = view
+        return view
+
+    def _select(self, tag):
+        nodetype = node_mod.group_type(tag)
+        if tag is None or nodetype == "_ALL_":
+            return sorted(self._byname.values(), key=node_mod.sortnode)
+
+        if nodetype:
+            view = self._view("type", nodetype)
+        else:
+            view = []
+
+        # A tag can also be the name of a node (this comparison is
+        # case-sensitive).
+        n = self._byname.get(tag.lower())
+        if n is not None and n.name == tag and n.type != nodetype:
+            view = sorted(view + [n], key=node_mod.sortnode)
+
+        return view
 
 
 class Configuration:
     def __init__(self, basedir, libdir, libdirinternal, cfgfile, zeekscriptdir, ui, state=None):
+        # Must come first, as __getattr__ depends on it (via self.state).
+        self._local = threading.local()
+        self._state = {}
+
         self.ui = ui
         self.basedir = basedir
         self.libdir = libdir
@@ -64,8 +164,7 @@ class Configuration:
         Config = self
 
         self.config = {}
-        self.state = {}
-        self.nodestore = {}
+        self.nodestore = NodeStore()
 
         self.localaddrs = self._get_local_addrs()
 
@@ -186,6 +285,14 @@ class Configuration:
             if not os.path.isfile(v):
                 raise ConfigurationError('zeekctl option "%s" file not found: %s' % (f, v))
 
+        v = self.config["archivenamefunction"]
+        if v:
+            source, sep, func = v.rpartition(":")
+            if not sep or not source or not re.match(r"^[A-Za-z_][A-Za-z0-9_]*$", func):
+                raise ConfigurationError('zeekctl option "archivenamefunction" must be of the form <file or module>:<function>: %s' % v)
+            if source.endswith(".py") and not os.path.isfile(source):
+                raise ConfigurationError('zeekctl option "archivenamefunction" file not found: %s' % source)
+
         # Verify that logs don't expire more quickly than the rotation interval
         logexpireseconds = 60 * self.config["logexpireminutes"]
         if 0 < logexpireseconds < self.config["logrotationinterval"]:
@@ -271,18 +378,7 @@ class Configuration:
     #   that group are returned.
     # - If tag is the name of a node, then that node is returned.
     def nodes(self, tag=None):
-        nodetype = node_mod.group_type(tag)
-        if nodetype == "_ALL_":
-            tag = None
-
-        nodes = []
-        for n in self.nodestore.values():
-            if nodetype == n.type or tag == n.name or tag is None:
-                nodes += [n]
-
-        nodes.sort(key=node_mod.sortnode)
-
-        return nodes
+        return self.nodestore.nodes(tag)
 
     # Returns the manager Node (cluster config) or standalone Node (standalone
     # config).  Returns None if neither are available.
@@ -311,19 +407,8 @@ class Configuration:
     # If "exclude_local" is True, then the returned list will not include
     # nodes that are on the local host.
     def hosts(self, tag=None, exclude_local=False):
-        hosts = {}
-        nodelist = []
-        for node in self.nodes(tag):
-            if node.host in hosts:
-                continue
-
-            if exclude_local and node.addr in self.localaddrs:
-                continue
-
-            hosts[node.host] = 1
-            nodelist.append(node)
-
-        return nodelist
+        exclude = self.localaddrs if exclude_local else ()
+        return self.nodestore.hosts(tag, exclude)
 
     # Replace all occurences of "${option}", with option being either
     # zeekctl.cfg option or a dynamic variable, with the corresponding value.
@@ -409,16 +494,16 @@ class Configuration:
                     self.ui.warn("ignoring unrecognized node config option '%s' given for node '%s'" % (key, sec))
                     continue
 
-                node.__dict__[key] = val
+                setattr(node, key, val)
 
             # Perform a sanity check on the node, and update nodestore.
             self._check_node(node, nodestore, counts)
 
         # Perform a sanity check on the nodestore (make sure we have a valid
         # cluster config, etc.).
-        self._check_nodestore(nodestore.nodestore)
+        self._check_nodestore(nodestore)
 
-        return nodestore.nodestore
+        return nodestore
 
     def _check_node(self, node, nodestore, counts):
         if not node.type:
@@ -651,6 +736,35 @@ class Configuration:
         # Convert key to lowercase because keys are stored in lowercase.
         return self.config.get(key.lower())
 
+    # The dynamic state variables.  A thread running a read-only command sees
+    # the snapshot taken by snapshot_state() instead, so that it's not
+    # affected by a command modifying the state at the same time.
+    @property
+    def state(self):
+        snapshot = getattr(self._local, "snapshot", None)
+        return self._state if snapshot is None else snapshot
+
+    @state.setter
+    def state(self, val):
+        self._state = val
+
+    # Make the current thread use a copy of the state database until the
+    # matching release_state() is called.  Changes made by set_state() in the
+    # meantime are only written back to the database if persist() returns true.
+    def snapshot_state(self, persist):
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            self._local.snapshot = dict(self.state_store.items())
+            self._local.persist = persist
+
+        self._local.depth = depth + 1
+
+    def release_state(self):
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            self._local.snapshot = None
+            self._local.persist = None
+
     # Set a dynamic state variable.
     def set_state(self, key, val):
         key = key.lower()
@@ -658,6 +772,11 @@ class Configuration:
             return
 
         self.state[key] = val
+
+        persist = getattr(self._local, "persist", None)
+        if persist and not persist():
+            return
+
         self.state_store.set(key, val)
 
     # Returns value of state variable, or the specified default value if the
@@ -938,6 +1057,10 @@ class Configuration:
         hh.update(data)
         return hh.hexdigest()
 
+    # Returns a string that changes whenever any option or node changes.
+    def cfg_key(self):
+        return "%s-%s" % (self._get_zeekctlcfg_hash(), self._get_nodecfg_hash())
+
     # Update the stored hash value of the current zeekctl config.
     def update_cfg_hash(self):
         cfghash = self._get_zeekctlcfg_hash()
@@ -0,0 +1,301 @@
+# A streaming summarizer for conn.log, which produces the connection summary
+# reports that the summarize-connections postprocessor mails and archives.
+#
+# The log may be in Zeek's ASCII (TSV) or JSON format, and gzipped or not.
+# It's read in chunks of ChunkLines lines, each of which is split into the
+# columns needed and aggregated as a whole before being merged into the
+# totals.  The top sources, destinations and services are tracked with
+# heavy-hitter sketches of a bounded size (see TopSketch), so memory use does
+# not grow with the number of distinct hosts, and no sampling is needed.
+#
+# The report has a "Total" section and, if local networks are given,
+# "Incoming", "Outgoing" and "Local" sections for connections between
+# remote and local hosts, like the reports of trace-summary.
+
+from __future__ import print_function
+import io
+import gzip
+import json
+import time
+import codecs
+import socket
+import ipaddress
+import itertools
+
+ChunkLines = 50000
+
+# The number of entries each sketch keeps; the reported top entries are
+# exact unless there are more distinct values than that.
+SketchSize = 2000
+
+_Columns = ("ts", "id.orig_h", "id.resp_h", "id.resp_p", "proto", "orig_bytes", "resp_bytes")
+
+# Approximate counts of the heaviest values of a stream, in bounded memory.
+#
+# This is a mergeable summary: the counts of each chunk are added, and then
+# only the SketchSize heaviest values are kept.  The count of a value that
+# was dropped and comes back later is underestimated by at most "error",
+# the largest count dropped so far.
+class TopSketch:
+    def __init__(self, size=SketchSize):
+        self.size = size
+        self.weights = {}
+        self.counts = {}
+        self.error = 0
+
+    # Adds the dicts {value: weight} and {value: count} of a chunk.
+    def merge(self, weights, counts):
+        w = self.weights
+        c = self.counts
+
+        for (key, val) in weights.items():
+            w[key] = w.get(key, 0) + val
+
+        for (key, val) in counts.items():
+            c[key] = c.get(key, 0) + val
+
+        if len(w) > self.size:
+            ranked = sorted(w.items(), key=lambda kv: kv[1], reverse=True)
+            self.error = max(self.error, ranked[self.size][1])
+            self.weights = dict(ranked[:self.size])
+            self.counts = dict((key, c.get(key, 0)) for key in self.weights)
+
+    # Returns a list of (value, weight, count) of the "n" heaviest values.
+    def top(self, n):
+        ranked = sorted(self.weights.items(), key=lambda kv: (-kv[1], str(kv[0])))
+        return [(key, val, self.counts.get(key, 0)) for (key, val) in ranked[:n]]
+
+class Section:
+    def __init__(self, name):
+        self.name = name
+        self.conns = 0
+        self.bytes = 0
+        self.sources = TopSketch()
+        self.destinations = TopSketch()
+        self.services = TopSketch()
+
+    # Adds the connections of a chunk, given as columns.
+    def add(self, src, dst, svc, nbytes):
+        self.conns += len(nbytes)
+        self.bytes += sum(nbytes)
+
+        for (sketch, column) in ((self.sources, src), (self.destinations, dst), (self.services, svc)):
+            weights = {}
+            counts = {}
+            for (key, b) in zip(column, nbytes):
+                weights[key] = weights.get(key, 0) + b
+                counts[key] = counts.get(key, 0) + 1
+            sketch.merge(weights, counts)
+
+# Matches addresses against a list of networks.  The networks are kept as
+# (address, netmask) integers per address family, since parsing each address
+# with the ipaddress module would dominate the run time.
+class LocalNets:
+    def __init__(self, nets):
+        self.nets = nets
+        self.masks = {socket.AF_INET: [], socket.AF_INET6: []}
+        self.cache = {}
+
+        for net in nets:
+            family = socket.AF_INET if net.version == 4 else socket.AF_INET6
+            self.masks[family].append((int(net.network_address), int(net.netmask)))
+
+    def is_local(self, addr):
+        local = self.cache.get(addr)
+        if local is None:
+            try:
+                family = socket.AF_INET6 if ":" in addr else socket.AF_INET
+                ip = int(codecs.encode(socket.inet_pton(family, addr), "hex"), 16)
+                local = any(ip & mask == net for (net, mask) in self.masks[family])
+            except (socket.error, ValueError, TypeError):
+                local = False
+
+            # Keep the cache bounded.
+            if len(self.cache) > 100000:
+                self.cache.clear()
+
+            self.cache[addr] = local
+
+        return local
+
+# Reads the local networks from a file in the format of networks.cfg.
+def read_localnets(fname):
+    nets = []
+
+    with open(fname, "r") as f:
+        for line in f:
+            fields = line.split("#", 1)[0].split()
+            if fields:
+                nets.append(ipaddress.ip_network(fields[0], strict=False))
+
+    return LocalNets(nets)
+
+# Opens a log for reading, whether it's gzipped or not.
+def open_log(fname):
+    with open(fname, "rb") as f:
+        magic = f.read(2)
+
+    if magic == b"\x1f\x8b":
+        return io.TextIOWrapper(gzip.open(fname, "rb"), encoding="utf-8", errors="replace")
+
+    return io.open(fname, "r", encoding="utf-8", errors="replace")
+
+def _int(val):
+    try:
+        return int(val)
+    except (TypeError, ValueError):
+        return 0
+
+def _float(val):
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return None
+
+class Summary:
+    def __init__(self, localnets=None):
+        self.localnets = localnets
+        self.total = Section("Total")
+        self.sections = [self.total]
+        self.first = None
+        self.last = None
+
+        if localnets:
+            self.incoming = Section("Incoming")
+            self.outgoing = Section("Outgoing")
+            self.local = Section("Local")
+            self.sections += [self.incoming, self.outgoing, self.local]
+
+    # Adds a chunk of connections, given as the columns in _Columns.
+    def add_columns(self, ts, src, dst, port, proto, obytes, rbytes):
+        if not ts:
+            return
+
+        svc = ["%s/%s" % (p, t) for (p, t) in zip(port, proto)]
+        nbytes = [_int(o) + _int(r) for (o, r) in zip(obytes, rbytes)]
+
+        times = [t for t in map(_float, ts) if t is not None]
+        if times:
+            lo = min(times)
+            hi = max(times)
+            self.first = lo if self.first is None else min(self.first, lo)
+            self.last = hi if self.last is None else max(self.last, hi)
+
+        self.total.add(src, dst, svc, nbytes)
+
+        if not self.localnets:
+            return
+
+        is_local = self.localnets.is_local
+        slocal = [is_local(a) for a in src]
+        dlocal = [is_local(a) for a in dst]
+
+        for (section, want) in ((self.incoming, (False, True)), (self.outgoing, (True, False)), (self.local, (True, True))):
+            idx = [i for (i, pair) in enumerate(zip(slocal, dlocal)) if pair == want]
+            if idx:
+                section.add([src[i] for i in idx], [dst[i] for i in idx], [svc[i] for i in idx], [nbytes[i] for i in idx])
+
+    def read(self, f):
+        first = f.readline()
+        if not first:
+            return
+
+        if first.lstrip().startswith("{"):
+            self._read_json(itertools.chain([first], f))
+        else:
+            self._read_ascii(itertools.chain([first], f))
+
+    def _read_ascii(self, lines):
+        sep = "\t"
+        idx = None
+
+        while True:
+            chunk = list(itertools.islice(lines, ChunkLines))
+            if not chunk:
+                break
+
+            rows = []
+            for line in chunk:
+                if line.startswith("#"):
+                    if line.startswith("#separator "):
+                        sep = codecs.decode(line[11:].strip(), "unicode_escape")
+                    elif line.startswith("#fields"):
+                        fields = line.rstrip("\n").split(sep)[1:]
+                        idx = [fields.index(c) if c in fields else None for c in _Columns]
+                    continue
+
+                if idx:
+                    rows.append(line.rstrip("\n").split(sep))
+
+            if not rows or idx is None:
+                continue
+
+            width = max(i for i in idx if i is not None) + 1
+            rows = [row for row in rows if len(row) >= width]
+            self.add_columns(*[[row[i] for row in rows] if i is not None else ["-"] * len(rows) for i in idx])
+
+    def _read_json(self, lines):
+        while True:
+            chunk = list(itertools.islice(lines, ChunkLines))
+            if not chunk:
+                break
+
+            recs = []
+            for line in chunk:
+                try:
+                    recs.append(json.loads(line))
+                except ValueError:
+                    pass
+
+            self.add_columns(*[[rec.get(c) for rec in recs] for c in _Columns])
+
+def fmt_count(n):
+    for unit in ("", "k", "m", "g"):
+        if n < 1000:
+            return ("%d%s" if unit == "" else "%.1f%s") % (n, unit)
+        n /= 1000.0
+
+    return "%.1ft" % n
+
+def _pct(part, whole):
+    return 100.0 * part / whole if whole else 0.0
+
+def _fmt_time(t):
+    return time.strftime("%Y-%m-%d-%H-%M-%S", time.localtime(t)) if t is not None else "-"
+
+# Returns the report as a string.
+def report(summary, top=10):
+    out = []
+
+    for section in summary.sections:
+        out.append(">== %s === %s - %s" % (section.name, _fmt_time(summary.first), _fmt_time(summary.last)))
+
+        if section is summary.total:
+            out.append("   - Connections %s - Bytes %s" % (fmt_count(section.conns), fmt_count(section.bytes)))
+
+            if summary.localnets:
+                out.append("   - %s" % " - ".join("%s %s (%.1f%%)" % (s.name, fmt_count(s.conns), _pct(s.conns, section.conns)) for s in summary.sections[1:]))
+        else:
+            out.append("   - Connections %s (%.1f%%) - Bytes %s (%.1f%%)" % (
+                fmt_count(section.conns), _pct(section.conns, summary.total.conns),
+                fmt_count(section.bytes), _pct(section.bytes, summary.total.bytes)))
+
+        for (title, sketch) in (("Sources", section.sources), ("Destinations", section.destinations), ("Services", section.services)):
+            out.append("")
+            out.append("   Top %d %s" % (top, title))
+
+            for (i, (key, nbytes, conns)) in enumerate(sketch.top(top)):
+                out.append("   %2d  %-40s %8s %5.1f%%  %8s conns" % (i + 1, key, fmt_count(nbytes), _pct(nbytes, section.bytes), fmt_count(conns)))
+
+        out.append("")
+
+    return "\n".join(out) + "\n"
+
+# Summarizes the log "fname" and returns the report.
+def summarize(fname, localnets=None, top=10):
+    summary = Summary(localnets)
+
+    with open_log(fname) as f:
+        summary.read(f)
+
+    return report(summary, top)
@@ -1,10 +1,12 @@
 # Functions to control the nodes' operations.
 
 from collections import namedtuple
-import glob
 import os
+import json
+import hashlib
 import shutil
 import time
+import signal
 import logging
 
 from ZeekControl import execute
@@ -13,9 +15,13 @@ from ZeekControl import util
 from ZeekControl import config
 from ZeekControl import install
 from ZeekControl import cron
+from ZeekControl import tsdb
 from ZeekControl import node as node_mod
 from ZeekControl import cmdresult
 
+# Maximum number of results kept in the check cache.
+_CheckCacheSize = 100
+
 
 # Waits for the nodes' Zeek processes to reach the given status.
 # Build the Zeek parameters for the given node. Include
@@ -78,6 +84,26 @@ def _make_zeek_params(node, live):
 
     return args
 
+# Returns the Zeek parameters without the "-p <name>" pair that
+# _make_zeek_params() adds for the node's name (which comes after all other
+# prefixes, while a script of the same name may follow it).
+def _remove_node_prefix(params, node):
+    for i in range(len(params) - 2, -1, -1):
+        if params[i] == "-p" and params[i + 1] == node.name:
+            return params[:i] + params[i + 2:]
+
+    return params
+
+# Returns true if the script at "path" refers to Cluster::node (or
+# Cluster::nodes), on whose value, the node's name, a script may depend
+# already while it's parsed (e.g., in an "@if").
+def _uses_cluster_node(path):
+    try:
+        with open(path, "rb") as f:
+            return b"Cluster::node" in f.read()
+    except (IOError, OSError):
+        return False
+
 # Build the environment variables for the given node.
 def _make_env_params(node, returnlist=False):
     envs = []
@@ -186,7 +212,7 @@ class Controller:
                 pin_cpu = -1
 
             envs = _make_env_params(node, True)
-            cmds += [(node, "start", envs + [node.cwd(), str(pin_cpu)] + _make_zeek_params(node, True))]
+            cmds += [(node, "start", envs + ["-t", node.type, node.cwd(), str(pin_cpu)] + _make_zeek_params(node, True))]
 
         nodes = []
         # Note: the shell is used to interpret the command because zeekargs
@@ -255,7 +281,7 @@ class Controller:
                 results += [(node, False)]
                 continue
 
-            cmds += [(node, "check-pid", [str(pid)])]
+            cmds += [(node, "check-pid", [str(pid), node.cwd()])]
 
         for (node, success, output) in self.executor.run_helper(cmds):
             # If we cannot run the helper script, then we ignore this node
@@ -264,7 +290,16 @@ class Controller:
                 self.ui.error("failed to run check-pid on node %s" % node.name)
                 continue
 
-            running = output.strip() == "running"
+            output = output.strip()
+
+            # With the "supervise" option, a supervisor restarts a node that
+            # terminated unexpectedly (and it has already done the crash
+            # report), so we only need to keep track of the new PID.
+            if output.startswith("restarted "):
+                self._supervisor_restarted(node, output.split()[1])
+                output = "running"
+
+            running = output in ("running", "restarting")
 
             results += [(node, running)]
 
@@ -276,6 +311,18 @@ class Controller:
 
         return results
 
+    def _supervisor_restarted(self, node, pidstr):
+        try:
+            pid = int(pidstr)
+        except ValueError:
+            self.ui.error("invalid PID for %s: %s" % (node.name, pidstr))
+            return
+
+        self.pluginregistry.zeekProcessDied(node)
+        node.setPID(pid)
+        node.clearCrashed()
+        self._log_action(node, "restarted")
+
     def _waitforzeeks(self, nodes, status, timeout, ensurerunning):
         # If ensurerunning is true, process must still be running.
         if ensurerunning:
@@ -458,7 +505,7 @@ class Controller:
         def stop(nodes, signal):
             cmds = []
             for node in nodes:
-                cmds += [(node, "stop", [str(node.getPID()), str(signal)])]
+                cmds += [(node, "stop", [str(node.getPID()), str(signal), node.cwd()])]
 
             return self.executor.run_helper(cmds)
 
@@ -589,6 +636,13 @@ class Controller:
 
             startups[n.name] = val
 
+        # Stopped nodes may still be archiving their logs (see post-terminate).
+        archiving = set()
+        cmds = [(node, "first-line", ["%s/.archiving" % node.cwd()]) for (node, isrunning) in nodestatus if not isrunning and not node.hasCrashed()]
+        for (n, success, output) in self.executor.run_helper(cmds):
+            if success and output.strip():
+                archiving.add(n.name)
+
         if showall:
             self.ui.info("Getting peer status ...")
             peers = {}
@@ -620,6 +674,8 @@ class Controller:
                 node_info["status"] = statuses[node.name]
             elif node.hasCrashed():
                 node_info["status"] = "crashed"
+            elif node.name in archiving:
+                node_info["status"] = "archiving"
 
             if isrunning:
                 node_info["pid"] = node.getPID()
@@ -640,6 +696,11 @@ class Controller:
     def check(self, nodes):
         return self._check_config(nodes, False, False)
 
+    # Same as check(), but returns without waiting for the checks to finish.
+    # Returns a function which waits for them and then returns the results.
+    def start_check(self, nodes):
+        return self._start_check_config(nodes, False, False)
+
     # Print the loaded_scripts.log for either the installed scripts
     # (if "check" is false), or the original scripts (if "check" is true).
     def scripts(self, nodes, check):
@@ -647,11 +708,18 @@ class Controller:
 
 
     def _check_config(self, nodes, installed, list_scripts):
+        return self._start_check_config(nodes, installed, list_scripts)()
+
+    def _start_check_config(self, nodes, installed, list_scripts):
         results = cmdresult.CmdResult()
 
-        nodetmpdirs = [(node, os.path.join(self.config.tmpdir, "check-config-%s" % node.name)) for node in nodes]
+        # Each group of equivalent nodes is checked only once, using the
+        # first node of the group.
+        groups = self._check_groups(nodes)
 
-        nodes = []
+        nodetmpdirs = [(members[0], os.path.join(self.config.tmpdir, "check-config-%s" % members[0].name)) for (key, members) in groups]
+
+        checknodes = []
         for (node, cwd) in nodetmpdirs:
             if os.path.isdir(cwd):
                 try:
@@ -659,19 +727,25 @@ class Controller:
                 except OSError as err:
                     self.ui.error("cannot remove directory %s: %s" % (cwd, err))
                     results.ok = False
-                    return results
+                    return lambda: results
 
             try:
                 os.makedirs(cwd)
             except OSError as err:
                 self.ui.error("cannot create temporary directory: %s" % err)
                 results.ok = False
-                return results
+                return lambda: results
+
+            checknodes += [(node, cwd)]
 
-            nodes += [(node, cwd)]
+        scriptsdigest = self._check_scripts_digest(installed)
+        cachefile = os.path.join(self.config.spooldir, "check-cache.json")
+        cache = install.load_json(cachefile) or {}
 
+        checked = {}
+        cached = []
         cmds = []
-        for (node, cwd) in nodes:
+        for ((node, cwd), (key, members)) in zip(checknodes, groups):
 
             env = _make_env_params(node)
 
@@ -680,30 +754,130 @@ class Controller:
 
             if not install.make_layout(cwd, self.ui, True):
                 results.ok = False
-                return results
+                return lambda: results
             if not install.make_local_networks(cwd, self.ui):
                 results.ok = False
-                return results
+                return lambda: results
 
             if not install.make_zeekctl_config_policy(cwd, self.ui, self.pluginregistry):
                 results.ok = False
-                return results
+                return lambda: results
+
+            # Zeek's result only depends on the scripts it reads, including
+            # the generated ones, and on its parameters.
+            data = json.dumps([scriptsdigest, install.make_manifest(cwd), key, installed, list_scripts], sort_keys=True)
+            digest = hashlib.sha1(data.encode()).hexdigest()
+
+            if digest in cache:
+                cache[digest]["time"] = time.time()
+                checked[node.name] = (True, cache[digest]["output"])
+                cached += members
+                shutil.rmtree(cwd, ignore_errors=True)
+                continue
 
             cmd = os.path.join(self.config.scriptsdir, "check-config") + " %s %s %s %s" % (installed_policies, print_scripts, cwd, " ".join(_make_zeek_params(node, False)))
             cmd += " zeekctl/check"
 
-            cmds += [((node, cwd), cmd, env, None)]
+            cmds += [((node, cwd, digest), cmd, env, None)]
+
+        if cached:
+            self.ui.info("using cached check results for %s" % ", ".join(n.name for n in nodes if n in cached))
+
+        running = execute.start_localcmds(cmds)
+
+        return lambda: self._finish_check_config(nodes, groups, running, checked, cache, cached, cachefile)
+
+    # Waits for the checks started by _start_check_config() and returns the
+    # results.
+    def _finish_check_config(self, nodes, groups, running, checked, cache, cached, cachefile):
+        results = cmdresult.CmdResult()
+
+        for ((node, cwd, digest), success, output) in execute.wait_localcmds(running):
+            checked[node.name] = (success, output)
+
+            # Only successful checks are cached, as failures might be caused
+            # by something other than the scripts.
+            if success:
+                cache[digest] = {"time": time.time(), "output": output}
 
-        for ((node, cwd), success, output) in execute.run_localcmds(cmds):
-            results.set_node_output(node, success, output)
             try:
                 shutil.rmtree(cwd)
             except OSError as err:
                 # Don't bother reporting an error now.
                 pass
 
+        if running or cached:
+            # Keep only the most recently used results.
+            recent = sorted(cache, key=lambda d: cache[d]["time"])[-_CheckCacheSize:]
+            cache = dict((d, cache[d]) for d in recent)
+            install.write_file(cachefile, json.dumps(cache), self.ui)
+
+        for (key, members) in groups:
+            logging.debug("check result of %s used for %s", members[0].name, ", ".join(n.name for n in members))
+
+        # Report results in the original order of the nodes.
+        check_node = dict((n.name, members[0]) for (key, members) in groups for n in members)
+        for n in nodes:
+            success, output = checked[check_node[n.name].name]
+            results.set_node_output(n, success, output)
+
         return results
 
+    # Groups nodes whose configuration differs only in their name and
+    # interface.  The name is passed in CLUSTER_NODE, which sets
+    # Cluster::node, and as a script prefix.  So nodes are not grouped if a
+    # site policy script refers to Cluster::node (as scripts may branch on it
+    # while they're parsed), or if a site policy script with the node's
+    # prefix exists.  Returns a list of (key, nodes) tuples, where the key
+    # describes all parameters relevant to a check of the nodes.
+    def _check_groups(self, nodes):
+        pernode = self.config.checkpernode
+        sitescripts = set()
+        for dir in self.config.sitepolicypath.split(":"):
+            for root, dirs, files in os.walk(self.config.subst(dir)):
+                sitescripts.update(files)
+                if not pernode:
+                    pernode = any(_uses_cluster_node(os.path.join(root, f)) for f in files)
+
+        groups = []
+        keys = {}
+        for node in nodes:
+            params = _make_zeek_params(node, False)
+
+            if pernode:
+                params.append(node.name)
+            elif not any(f.endswith(".%s.zeek" % node.name) for f in sitescripts):
+                params = _remove_node_prefix(params, node)
+
+            key = (node.type, tuple(params), tuple(sorted(node.env_vars.items())))
+
+            if key in keys:
+                keys[key].append(node)
+            else:
+                keys[key] = [node]
+                groups.append((key, keys[key]))
+
+        return groups
+
+    # Returns a digest of the Zeek binary and all scripts a check might read
+    # (a superset of the scripts actually loaded).
+    def _check_scripts_digest(self, installed):
+        if installed:
+            paths = [self.config.policydirsiteinstall]
+        else:
+            paths = [self.config.subst(dir) for dir in self.config.sitepolicypath.split(":")]
+
+        paths += [self.config.policydirsiteinstallauto, self.config.policydir,
+                  self.config.pluginzeekdir, self.config.zeek]
+
+        # File digests are cached so that only modified files need to be read.
+        cachefile = os.path.join(self.config.spooldir, "check-digests.json")
+        cache = install.load_json(cachefile) or {}
+        digest = install.manifest_digest(install.make_sync_manifest(paths, cache))
+        install.write_file(cachefile, json.dumps(cache), self.ui)
+
+        return digest
+
     def _query_peerstatus(self, nodes):
         running = self._isrunning(nodes)
 
@@ -978,6 +1152,35 @@ class Controller:
 
         return results
 
+    # Queries the time-series store for the statistics recorded for "nodes"
+    # in the time range [start, end).  For each node, the data is a dict
+    # mapping metric names to the aggregates of the values in the range
+    # (see tsdb.aggregate()), plus, if "series" is true, the list of
+    # records at resolution "resname" under the key "series".  If "metric"
+    # is None, all metrics are reported.
+    def stats(self, nodes, metric, start, end, resname, series):
+        results = cmdresult.CmdResult()
+        db = tsdb.TimeSeriesDB(self.config.statsdbdir)
+
+        for node in nodes:
+            data = {}
+            metrics = [metric] if metric else db.metrics(node.name)
+
+            for m in metrics:
+                records = db.query(node.name, m, start, end, resname)
+                agg = tsdb.aggregate(records)
+                if not agg:
+                    continue
+
+                if series:
+                    agg["series"] = records
+
+                data[m] = agg
+
+            results.set_node_data(node, True, data)
+
+        return results
+
     # Returns a list of tuples of the form (node, error, vals) where 'error' is
     # an error message string, or None if there was no error.  'vals' is a
     # dict which maps tags to their values.  Tags are "pid", "vsize",
@@ -1217,64 +1420,106 @@ class Controller:
         return results
 
     def install(self, local_only):
+        results, staged = self.stage_install(local_only)
+        if not results.ok:
+            return results
+
+        results, staged = self.distribute_install(staged)
+        if not results.ok:
+            return results
+
+        return self.activate_install(staged)
+
+    # Installs the policy scripts into a new install generation on the local
+    # host, without touching anything outside of that generation's directory
+    # (so that this can be done while the configuration is still being
+    # checked).  Returns a tuple (results, staged), where "staged" is to be
+    # passed to distribute_install().
+    def stage_install(self, local_only):
         results = cmdresult.CmdResult()
 
-        try:
-            self.config.record_zeek_version()
-        except config.ConfigurationError as err:
-            self.ui.error("%s" % err)
+        # The policy scripts are installed into a new install generation,
+        # which starts out as a copy of the active one (with files
+        # hard-linked), and only files which changed are rewritten (so that
+        # unchanged files keep their mtime).
+        link = self._generation_link()
+        if not link:
             results.ok = False
-            return results
+            return (results, None)
 
-        manager = self.config.manager()
+        gendir = self.config.installgenerationsdir
+        active = install.active_generation(link, gendir)
+        src = os.path.join(gendir, str(active)) if active is not None else link
 
-        # Delete previously installed policy files to not mix things up.
-        policies = [self.config.policydirsiteinstall, self.config.policydirsiteinstallauto]
+        gen = install.new_generation(gendir, src, self.ui)
+        if gen is None:
+            results.ok = False
+            return (results, None)
 
-        for dirpath in policies:
-            if os.path.isdir(dirpath):
-                self.ui.info("removing old policies in %s ..." % dirpath)
-                try:
-                    shutil.rmtree(dirpath)
-                except OSError as err:
-                    self.ui.error("failed to remove directory %s: %s" % (dirpath, err))
-                    results.ok = False
-                    return results
+        sitedir = os.path.join(gendir, str(gen), os.path.basename(self.config.policydirsiteinstall))
+        autodir = os.path.join(gendir, str(gen), os.path.basename(self.config.policydirsiteinstallauto))
 
         self.ui.info("creating policy directories ...")
-        for dirpath in policies:
+        for dirpath in (sitedir, autodir):
             try:
-                os.makedirs(dirpath)
+                if not os.path.isdir(dirpath):
+                    os.makedirs(dirpath)
             except OSError as err:
                 self.ui.error("failed to create directory: %s" % err)
                 results.ok = False
-                return results
+                return (results, None)
 
         # Install local site policy.
 
+        srcdirs = []
         if self.config.sitepolicypath:
             self.ui.info("installing site policies ...")
-            dst = self.config.policydirsiteinstall
-            for dir in self.config.sitepolicypath.split(":"):
-                dirpath = self.config.subst(dir)
-                for pathname in glob.glob(os.path.join(dirpath, "*")):
-                    if not execute.install(pathname, dst, self.ui):
-                        results.ok = False
-                        return results
-
-        if not install.make_layout(self.config.policydirsiteinstallauto, self.ui):
+            srcdirs = [self.config.subst(dir) for dir in self.config.sitepolicypath.split(":")]
+
+        if not install.install_site_policies(srcdirs, sitedir, self.ui):
             results.ok = False
-            return results
+            return (results, None)
+
+        # Remove auto-generated files that are not generated anymore (e.g.,
+        # the layout file after switching between standalone and cluster).
+        layout = "standalone-layout.zeek" if self.config.standalone else "cluster-layout.zeek"
+        if not install.remove_stale(autodir, [layout, "local-networks.zeek", "zeekctl-config.zeek"], self.ui):
+            results.ok = False
+            return (results, None)
+
+        if not install.make_layout(autodir, self.ui):
+            results.ok = False
+            return (results, None)
 
         self.ui.info("generating local-networks.zeek ...")
-        if not install.make_local_networks(self.config.policydirsiteinstallauto, self.ui):
+        if not install.make_local_networks(autodir, self.ui):
             results.ok = False
-            return results
+            return (results, None)
 
         self.ui.info("generating zeekctl-config.zeek ...")
-        if not install.make_zeekctl_config_policy(self.config.policydirsiteinstallauto, self.ui, self.pluginregistry):
+        if not install.make_zeekctl_config_policy(autodir, self.ui, self.pluginregistry):
             results.ok = False
-            return results
+            return (results, None)
+
+        return (results, (gen, local_only))
+
+    # Updates everything outside of the install generation staged by
+    # stage_install() (e.g., zeekctl-config.sh), and copies it all to the
+    # remote hosts (unless "local_only" was given), without activating the
+    # generation yet.  Returns a tuple (results, staged), where "staged" is
+    # to be passed to activate_install().
+    def distribute_install(self, staged):
+        results = cmdresult.CmdResult()
+        (gen, local_only) = staged
+
+        try:
+            self.config.record_zeek_version()
+        except config.ConfigurationError as err:
+            self.ui.error("%s" % err)
+            results.ok = False
+            return (results, None)
+
+        manager = self.config.manager()
 
         loggers = self.config.loggers()
         if loggers:
@@ -1289,24 +1534,22 @@ class Controller:
         except (IOError, OSError) as err:
             results.ok = False
             self.ui.error("failed to update symlink '%s': %s" % (current, err))
-            return results
+            return (results, None)
 
         self.ui.info("generating zeekctl-config.sh ...")
         if not install.make_zeekctl_config_sh(self.ui):
             results.ok = False
-            return results
+            return (results, None)
 
         if local_only:
-            return results
+            return (results, (gen, [], False))
 
         # Make sure we install each remote host only once.
         nodes = self.config.hosts(exclude_local=True)
 
         # If there are no remote hosts, then we're done.
         if not nodes:
-            # Save current configuration state.
-            self.config.update_cfg_hash()
-            return results
+            return (results, (gen, [], True))
 
         # Sync to clients.
         self.ui.info("updating nodes ...")
@@ -1337,29 +1580,240 @@ class Controller:
                 if output:
                     self.ui.error(output)
                 results.ok = False
-                return results
+                return (results, None)
 
         paths = [self.config.subst(dir) for (dir, mirror) in syncs if mirror]
-        if not execute.sync(nodes, paths, self.ui):
+        if not self._sync(nodes, paths):
+            results.ok = False
+            return (results, None)
+
+        return (results, (gen, nodes, True))
+
+    # Activates the install generation staged by stage_install() and
+    # distributed by distribute_install() on all hosts at once.
+    def activate_install(self, staged):
+        results = cmdresult.CmdResult()
+        (gen, nodes, update_hash) = staged
+
+        if not self._activate_generation(gen, nodes):
             results.ok = False
             return results
 
-        # Save current configuration state.
-        self.config.update_cfg_hash()
+        if update_hash:
+            # Save current configuration state.
+            self.config.update_cfg_hash()
 
         return results
 
+    # Returns the symlink pointing to the active install generation (i.e.,
+    # the parent directory of the installed policy directories), or None if
+    # the policy directories don't share a parent directory.
+    def _generation_link(self):
+        link = os.path.dirname(self.config.policydirsiteinstall)
+        if os.path.dirname(self.config.policydirsiteinstallauto) != link:
+            self.ui.error("PolicyDirSiteInstall and PolicyDirSiteInstallAuto must be in the same directory")
+            return None
+
+        return link
+
+    # Activates install generation "gen" on the given remote hosts "nodes"
+    # and then locally, and removes generations no longer needed.  If that
+    # fails anywhere, the hosts already switched are switched back to the
+    # previously active generation.
+    def _activate_generation(self, gen, nodes):
+        link = self._generation_link()
+        if not link:
+            return False
+
+        gendir = self.config.installgenerationsdir
+        target = os.path.join(gendir, str(gen))
+        previous = install.active_generation(link, gendir)
+
+        activated = []
+        ok = True
+
+        cmds = [(n, "activate-generation", [link, target]) for n in nodes]
+        for (node, success, output) in self.executor.run_helper(cmds):
+            if success:
+                activated.append(node)
+            else:
+                self.ui.error("failed to activate install generation %d on host %s" % (gen, node.host))
+                if output:
+                    self.ui.error(output)
+                ok = False
 
-    # Triggers all activity which is to be done regularly via cron.
-    def cron(self, watch):
-        if not self.config.cronenabled:
-            logging.debug("cron is disabled")
+        if ok and not install.activate_generation(link, target, self.ui):
+            ok = False
+
+        if not ok:
+            self._reactivate_generation(previous, activated)
+            return False
+
+        return install.expire_generations(gendir, self.config.installgenerationskeep, gen, self.ui)
+
+    # Switches the remote hosts "nodes" back to install generation "gen"
+    # after a failed activation.
+    def _reactivate_generation(self, gen, nodes):
+        if not nodes:
             return
 
-        # Check if "zeekctl install" has been run.
-        if not self.config.is_zeekctl_installed():
-            # Don't output anything here, otherwise the cron job may generate
-            # emails before the user has a chance to do "zeekctl install".
+        if gen is None:
+            self.ui.error("cannot switch hosts %s back, as there was no previous install generation" % ", ".join(n.host for n in nodes))
+            return
+
+        self.ui.info("switching hosts back to install generation %d ..." % gen)
+
+        link = self._generation_link()
+        target = os.path.join(self.config.installgenerationsdir, str(gen))
+
+        cmds = [(n, "activate-generation", [link, target]) for n in nodes]
+        for (node, success, output) in self.executor.run_helper(cmds):
+            if not success:
+                self.ui.error("failed to switch host %s back to install generation %d" % (node.host, gen))
+                if output:
+                    self.ui.error(output)
+
+    def rollback(self):
+        results = cmdresult.CmdResult()
+
+        link = self._generation_link()
+        if not link:
+            results.ok = False
+            return results
+
+        gendir = self.config.installgenerationsdir
+        active = install.active_generation(link, gendir)
+        older = [gen for gen in install.generations(gendir) if active is not None and gen < active]
+
+        if not older:
+            self.ui.error("no previous install generation found")
+            results.ok = False
+            return results
+
+        gen = older[-1]
+        self.ui.info("rolling back to install generation %d ..." % gen)
+
+        nodes = self.config.hosts(exclude_local=True)
+        if not self._activate_generation(gen, nodes):
+            results.ok = False
+            return results
+
+        return results
+
+    # Syncs "paths" to "nodes" (one per host).  For each host, the manifest
+    # of the paths as of its last successful sync is recorded, so that
+    # only the files which changed since then need to be sent.  The delta is
+    # computed and packed only once for all hosts with the same manifest.
+    # Hosts without a known manifest are synced with rsync.
+    def _sync(self, nodes, paths):
+        manifestdir = os.path.join(self.config.spooldir, "sync-manifests")
+
+        # File digests are cached so that only files modified since the
+        # last install need to be read.
+        cachefile = os.path.join(self.config.spooldir, "sync-digests.json")
+        cache = install.load_json(cachefile) or {}
+
+        manifest = install.make_sync_manifest(paths, cache)
+        digest = install.manifest_digest(manifest)
+
+        if not install.write_file(cachefile, json.dumps(cache), self.ui):
+            return False
+
+        if not install.save_manifest(manifestdir, digest, manifest, self.ui):
+            return False
+
+        # Copy the dict so that set_state below notices the changes.
+        synced = dict(self.config.get_state("install-manifests", {}))
+
+        groups = {}
+        for n in nodes:
+            groups.setdefault(synced.get(n.addr), []).append(n)
+
+        fullsync = []
+        results = []
+
+        for (last, group) in groups.items():
+            if last == digest:
+                continue
+
+            old = install.load_manifest(manifestdir, last) if last else None
+            if old is None:
+                fullsync += group
+                continue
+
+            changed, removed = install.manifest_delta(old, manifest)
+            results += self._push_delta(group, changed, removed, digest)
+
+        if fullsync:
+            push = lambda nodes: execute.sync(nodes, paths, self.ui)
+            relay = lambda pairs: execute.relay_sync(pairs, paths, self.ui)
+            results += execute.fanout(fullsync, self.config.syncfanout, push, relay, self.ui)
+
+        for (n, success) in results:
+            if success:
+                synced[n.addr] = digest
+            else:
+                # Don't rely on whatever state the host is in now.
+                synced.pop(n.addr, None)
+
+        self.config.set_state("install-manifests", synced)
+        install.expire_manifests(manifestdir, set(synced.values()) | {digest})
+
+        return all(success for (n, success) in results)
+
+    # Packs the "changed" files and the list of "removed" files into a
+    # single archive which is then sent to, and applied on, all "nodes".
+    # Returns a list of (node, success) tuples.
+    def _push_delta(self, nodes, changed, removed, digest):
+        logging.debug("sending %d changed and %d removed files to %s", len(changed), len(removed), ", ".join(n.host for n in nodes))
+
+        tmpdir = os.path.join(self.config.tmpdir, "delta-%s" % digest)
+        filelist = os.path.join(tmpdir, "files")
+        archive = os.path.join(tmpdir, "delta.tar.gz")
+
+        try:
+            if not os.path.isdir(tmpdir):
+                os.makedirs(tmpdir)
+
+            with open(filelist, "w") as f:
+                f.write("".join("%s\n" % path for path in changed))
+
+            # The name of this file is known to the apply-delta helper.
+            with open(os.path.join(tmpdir, ".zeekctl-removed"), "w") as f:
+                f.write("".join("%s\n" % path for path in removed))
+        except (IOError, OSError) as err:
+            self.ui.error("failed to write delta file list: %s" % err)
+            return [(n, False) for n in nodes]
+
+        cmd = "tar -czf %s --no-recursion -C / -T %s -C %s .zeekctl-removed" % (archive, filelist, tmpdir)
+        success, output = execute.run_localcmd(cmd)
+
+        if success:
+            stagedir = os.path.join(self.config.tmpdir, "delta-stage-%s" % digest)
+            helperdir = self.config.helperdir
+
+            # Hosts relaying the archive keep a copy of it until all are done.
+            keep = os.path.join(self.config.tmpdir, "delta-%s.tar.gz" % digest)
+            relays = execute.fanout_relays(nodes, self.config.syncfanout)
+
+            push = lambda nodes: execute.push_delta(nodes, archive, stagedir, helperdir, self.ui, keep, relays)
+            relay = lambda pairs: execute.relay_delta(pairs, keep, stagedir, helperdir, self.ui, relays)
+            results = execute.fanout(nodes, self.config.syncfanout, push, relay, self.ui)
+
+            if relays:
+                self.executor.run_cmds([(n, "rm", ["-f", keep]) for n in relays])
+        else:
+            self.ui.error("failed to create archive %s: %s" % (archive, output))
+            results = [(n, False) for n in nodes]
+
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+        return results
+
+
+    # Triggers all activity which is to be done regularly via cron.
+    def cron(self, watch):
+        if not self._cron_enabled():
             return
 
         cronui = cron.CronUI()
@@ -1368,22 +1822,7 @@ class Controller:
         cronui.buffer_output()
 
         if watch:
-            # Check if node state matches expected state, and start/stop if
-            # necessary.
-            startlist = []
-            stoplist = []
-            for (node, isrunning) in self._isrunning(self.config.nodes()):
-                expectrunning = node.getExpectRunning()
-
-                if not isrunning and expectrunning:
-                    startlist.append(node)
-                elif isrunning and not expectrunning:
-                    stoplist.append(node)
-
-            if startlist:
-                results = self.start(startlist)
-            if stoplist:
-                results = self.stop(stoplist)
+            self._cron_watch()
 
         # Check for dead hosts.
         tasks.check_hosts()
@@ -1406,7 +1845,88 @@ class Controller:
         # Run external command if we have one.
         tasks.run_cron_cmd()
 
-        # Mail potential output.
+        self._cron_mail(cronui)
+
+        logging.debug("cron done")
+
+    # Runs only the cron task "name" (see cron.DefaultSchedule).
+    def cron_task(self, name):
+        if not self._cron_enabled():
+            return
+
+        cronui = cron.CronUI()
+        tasks = cron.CronTasks(cronui, self.config, self, self.executor, self.pluginregistry)
+
+        cronui.buffer_output()
+
+        if name == "watch":
+            self._cron_watch()
+        elif name == "log_stats":
+            tasks.log_stats(5)
+        else:
+            getattr(tasks, name)()
+
+        self._cron_mail(cronui)
+
+        logging.debug("cron task %s done", name)
+
+    # Runs the cron tasks according to the CronSchedule option until
+    # terminated, each task as the command "cmd" with the task name appended.
+    def cron_daemon(self, cmd):
+        results = cmdresult.CmdResult()
+
+        try:
+            schedule = cron.make_schedule(self.config.cronschedule)
+        except config.ConfigurationError as err:
+            self.ui.error("%s" % err)
+            results.ok = False
+            return results
+
+        statsfile = os.path.join(self.config.spooldir, "cron-tasks.json")
+        scheduler = cron.CronScheduler(self.ui, schedule, cmd, statsfile)
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            scheduler.stop()
+
+        return results
+
+    def _cron_enabled(self):
+        if not self.config.cronenabled:
+            logging.debug("cron is disabled")
+            return False
+
+        # Check if "zeekctl install" has been run.
+        if not self.config.is_zeekctl_installed():
+            # Don't output anything here, otherwise the cron job may generate
+            # emails before the user has a chance to do "zeekctl install".
+            return False
+
+        return True
+
+    # Check if node state matches expected state, and start/stop if
+    # necessary.
+    def _cron_watch(self):
+        startlist = []
+        stoplist = []
+        for (node, isrunning) in self._isrunning(self.config.nodes()):
+            expectrunning = node.getExpectRunning()
+
+            if not isrunning and expectrunning:
+                startlist.append(node)
+            elif isrunning and not expectrunning:
+                stoplist.append(node)
+
+        if startlist:
+            self.start(startlist)
+        if stoplist:
+            self.stop(stoplist)
+
+    # Mail potential output.
+    def _cron_mail(self, cronui):
         output = cronui.get_buffered_output()
         if output:
             success, out = self._sendmail("cron: " + output.splitlines()[0], output)
@@ -1414,5 +1934,3 @@ class Controller:
                 self.ui.error("zeekctl cron failed to send mail: %s" % out)
                 self.ui.info("Output of zeekctl cron:\n%s" % output)
 
-        logging.debug("cron done")
-
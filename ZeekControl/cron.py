@@ -2,11 +2,74 @@
 from __future__ import print_function
 import io
 import os
+import json
 import time
+import random
+import signal
 import shutil
+import logging
+import subprocess
 
 from ZeekControl import execute
+from ZeekControl import install
 from ZeekControl import node as node_mod
+from ZeekControl import tsdb
+from ZeekControl.exceptions import ConfigurationError
+
+# The tasks run by "cron --daemon", each as (name, interval, jitter,
+# timeout, mutating), with times in seconds.  A task is started again
+# "interval" plus a random delay of up to "jitter" after it was last started,
+# and it's killed if it runs longer than "timeout".  Mutating tasks modify
+# state shared with other zeekctl commands, so they run with the lock held
+# (and one at a time), while the others may run concurrently with anything.
+DefaultSchedule = [
+    ("watch", 30, 5, 600, True),
+    ("check_hosts", 60, 10, 300, True),
+    ("log_stats", 300, 10, 300, True),
+    ("check_disk_space", 300, 30, 300, True),
+    ("update_http_stats", 300, 30, 300, True),
+    ("run_cron_cmd", 300, 0, 3600, True),
+    ("plugins", 300, 0, 3600, True),
+    ("expire_logs", 3600, 300, 3600, False),
+    ("expire_crash", 3600, 300, 600, False),
+]
+
+# The size at which the stats.log in spool is rotated (once stats-to-csv has
+# processed all of it).
+StatsLogRotateSize = 10 * 1024 * 1024
+
+# Seconds a task that is stopped gets to exit after SIGTERM before it's
+# killed with SIGKILL.
+KillDelay = 5
+
+def task_names():
+    return [task[0] for task in DefaultSchedule]
+
+def is_mutating(name):
+    return any(task[4] for task in DefaultSchedule if task[0] == name)
+
+# Returns the schedule with the defaults overridden by "spec" (the value of
+# the CronSchedule option), a list of "<task>:<interval>[:<jitter>[:<timeout>]]"
+# separated by whitespace.
+def make_schedule(spec):
+    schedule = dict((task[0], list(task)) for task in DefaultSchedule)
+
+    for entry in spec.split():
+        fields = entry.split(":")
+        if fields[0] not in schedule or not 2 <= len(fields) <= 4:
+            raise ConfigurationError("invalid CronSchedule entry: %s" % entry)
+
+        try:
+            values = [int(val) for val in fields[1:]]
+        except ValueError:
+            raise ConfigurationError("invalid CronSchedule entry: %s" % entry)
+
+        if values[0] <= 0 or min(values) < 0:
+            raise ConfigurationError("invalid CronSchedule entry: %s" % entry)
+
+        schedule[fields[0]][1:1 + len(values)] = values
+
+    return [tuple(schedule[task[0]]) for task in DefaultSchedule]
 
 class CronUI:
     def __init__(self):
@@ -52,6 +115,7 @@ class CronTasks:
             capstats = self.controller.get_capstats_output(nodes, interval)
 
         t = time.time()
+        samples = []
 
         try:
             with open(self.config.statslog, "a") as out:
@@ -59,6 +123,7 @@ class CronTasks:
                     if not error:
                         for (val, key) in sorted(vals.items()):
                             out.write("%s %s parent %s %s\n" % (t, node, val, key))
+                            samples.append((str(node), "parent-%s" % val, key))
                     else:
                         out.write("%s %s error error %s\n" % (t, node, error))
 
@@ -69,6 +134,7 @@ class CronTasks:
 
                     for (key, val) in sorted(vals.items()):
                         out.write("%s %s interface %s %s\n" % (t, node, key, val))
+                        samples.append((str(node), "interface-%s" % key, val))
 
                         if key == "pkts" and str(node) != "$total":
                             # Report if we don't see packets on an interface.
@@ -89,6 +155,26 @@ class CronTasks:
             self.ui.error("failed to append to file: %s" % err)
             return
 
+        self._store_stats(t, samples)
+
+    # Records the numeric values of the samples in the time-series store
+    # queried by the "stats" command.
+    def _store_stats(self, t, samples):
+        numeric = []
+        for (node, metric, val) in samples:
+            try:
+                numeric.append((node, metric, float(val)))
+            except (TypeError, ValueError):
+                continue
+
+        db = tsdb.TimeSeriesDB(self.config.statsdbdir)
+
+        try:
+            db.add(t, numeric)
+            db.expire(t)
+        except (IOError, OSError) as err:
+            self.ui.error("failed to update statistics store: %s" % err)
+
     def check_disk_space(self):
         minspace = self.config.mindiskspace
         if minspace == 0:
@@ -119,7 +205,7 @@ class CronTasks:
                 self.config.set_state(key, perc)
 
     def expire_logs(self):
-        if self.config.logexpireminutes == 0 and self.config.statslogexpireinterval == 0:
+        if self.config.logexpireminutes == 0 and self.config.logexpiresize == 0 and self.config.statslogexpireinterval == 0:
             return
 
         if self.config.standalone:
@@ -220,27 +306,36 @@ class CronTasks:
                 self.ui.error("failed to create directory: %s" % err)
                 return
 
-        # Update the WWW data
+        # Update the WWW data, and append the lines added to the stats.log in
+        # spool since the last run to the one in ${statsdir}, in a single
+        # pass.  The offset file records how far stats-to-csv got.  The
+        # stats.log in spool is rotated only once it has grown large, and
+        # the rotated file is finished first in the next run (to pick up
+        # lines that were still being appended to it) before it's removed.
         statstocsv = os.path.join(self.config.scriptsdir, "stats-to-csv")
+        dst = os.path.join(self.config.statsdir, os.path.basename(self.config.statslog))
+        offsetfile = "%s.offset" % self.config.statslog
+        rotated = "%s.1" % self.config.statslog
 
-        success, output = execute.run_localcmd("%s %s %s %s" % (statstocsv, self.config.statslog, metadat, wwwdir))
-        if success:
-            shutil.copy(metadat, wwwdir)
-        else:
-            self.ui.error("error reported by stats-to-csv\n%s" % output)
+        for statslog in (rotated, self.config.statslog):
+            if not os.path.exists(statslog):
+                continue
 
-        # Append the current stats.log in spool to the one in ${statsdir}
-        dst = os.path.join(self.config.statsdir, os.path.basename(self.config.statslog))
-        try:
-            with open(self.config.statslog, "r") as fsrc:
-                with open(dst, "a") as fdst:
-                    shutil.copyfileobj(fsrc, fdst)
-        except IOError as err:
-            self.ui.error("failed to append file: %s" % err)
-            return
+            success, output = execute.run_localcmd("%s -a %s -o %s %s %s %s" % (statstocsv, dst, offsetfile, statslog, metadat, wwwdir))
+            if not success:
+                self.ui.error("error reported by stats-to-csv\n%s" % output)
+                return
+
+        shutil.copy(metadat, wwwdir)
 
-        os.unlink(self.config.statslog)
+        try:
+            if os.path.exists(rotated):
+                os.unlink(rotated)
 
+            if os.path.getsize(self.config.statslog) >= StatsLogRotateSize:
+                os.rename(self.config.statslog, rotated)
+        except OSError:
+            pass
 
     def run_cron_cmd(self):
         # Run external command if we have one.
@@ -248,3 +343,139 @@ class CronTasks:
             success, output = execute.run_localcmd(self.config.croncmd)
             if not success:
                 self.ui.error("failure running croncmd: %s" % self.config.croncmd)
+
+
+# Runs the cron tasks as separate processes (the command "cmd" with the task
+# name appended) according to a schedule (see DefaultSchedule).  For each
+# task, the number of runs, skipped runs (because the previous one was still
+# running), timeouts and failures as well as the duration of the last run
+# are recorded in the JSON file "statsfile".
+class CronScheduler:
+    def __init__(self, ui, schedule, cmd, statsfile):
+        self.ui = ui
+        self.schedule = schedule
+        self.cmd = cmd
+        self.statsfile = statsfile
+        self.stopping = False
+        self.due = {}
+        self.running = {}
+        self.stats = install.load_json(statsfile) or {}
+
+        for task in schedule:
+            self.stats.setdefault(task[0], {"runs": 0, "skips": 0, "timeouts": 0, "failures": 0})
+
+    def stop(self):
+        self.stopping = True
+
+    # Runs tasks until stop() is called, or for "duration" seconds.
+    def run(self, duration=None):
+        now = time.time()
+        end = now + duration if duration is not None else None
+
+        for (name, interval, jitter, timeout, mutating) in self.schedule:
+            self.due[name] = now + random.uniform(0, jitter)
+
+        try:
+            while not self.stopping and (end is None or now < end):
+                changed = self._reap(now)
+
+                for (name, interval, jitter, timeout, mutating) in self.schedule:
+                    if self.due[name] > now:
+                        continue
+
+                    if name in self.running:
+                        logging.debug("cron task %s still running, skipping it", name)
+                        self.stats[name]["skips"] += 1
+                        self.due[name] = now + interval + random.uniform(0, jitter)
+                        changed = True
+                        continue
+
+                    # Mutating tasks are postponed until no other one runs.
+                    if mutating and any(task[3] for task in self.running.values()):
+                        continue
+
+                    self._start(name, now, timeout, mutating)
+                    self.due[name] = now + interval + random.uniform(0, jitter)
+                    changed = True
+
+                if changed:
+                    self._save()
+
+                # Wake up when the next task is due, but check for finished
+                # tasks at least once a second.
+                wakeup = min(list(self.due.values()) + [now + 1.0])
+                if end is not None:
+                    wakeup = min(wakeup, end)
+
+                time.sleep(max(wakeup - time.time(), 0.1))
+                now = time.time()
+        finally:
+            for (proc, start, deadline, mutating) in self.running.values():
+                self._kill(proc)
+
+            self.running = {}
+            self._save()
+
+    def _start(self, name, now, timeout, mutating):
+        logging.debug("starting cron task %s", name)
+
+        try:
+            proc = subprocess.Popen(self.cmd + [name], close_fds=True, start_new_session=True)
+        except OSError as err:
+            self.ui.error("failed to run cron task %s: %s" % (name, err))
+            self.stats[name]["failures"] += 1
+            return
+
+        self.stats[name]["runs"] += 1
+        self.stats[name]["last_start"] = now
+        self.running[name] = (proc, now, now + timeout, mutating)
+
+    # Records tasks which have finished, and kills those running for too
+    # long.  Returns true if any task finished.
+    def _reap(self, now):
+        changed = False
+
+        for name in list(self.running):
+            (proc, start, deadline, mutating) = self.running[name]
+
+            if proc.poll() is None:
+                if now < deadline:
+                    continue
+
+                self.ui.error("cron task %s timed out after %d seconds" % (name, now - start))
+                self.stats[name]["timeouts"] += 1
+                self._kill(proc)
+            elif proc.returncode != 0:
+                self.stats[name]["failures"] += 1
+
+            duration = time.time() - start
+            logging.debug("cron task %s finished after %.2f seconds", name, duration)
+            self.stats[name]["last_duration"] = duration
+            del self.running[name]
+            changed = True
+
+        return changed
+
+    # Stops a task along with the processes it started (e.g., ssh or helper
+    # scripts), which run in the task's own process group: first with
+    # SIGTERM, so that the task can release the lock, and then with SIGKILL.
+    def _kill(self, proc):
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+        try:
+            proc.wait(timeout=KillDelay)
+        except subprocess.TimeoutExpired:
+            pass
+
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+        proc.wait()
+
+    def _save(self):
+        install.write_file(self.statsfile, json.dumps(self.stats, sort_keys=True), self.ui)
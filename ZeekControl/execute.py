@@ -46,12 +46,15 @@ def install(src, dstdir, cmdout):
 
     return True
 
-# rsyncs paths from localhost to destination hosts.
+_SshCmd = "ssh -o BatchMode=yes -o LogLevel=error -o ConnectTimeout=30"
+
+# rsyncs paths from localhost to destination hosts.  Returns a list of
+# (node, success) tuples.
 def sync(nodes, paths, cmdout):
-    result = True
+    results = []
     cmds = []
     for n in nodes:
-        args = ['-rRl', '--delete', '--rsh="ssh -o BatchMode=yes -o LogLevel=error -o ConnectTimeout=30"']
+        args = ['-rRl', '--delete', '--rsh="%s"' % _SshCmd]
         dst = ["%s:/" % util.format_rsync_addr(n.addr)]
         args += paths + dst
         cmdline = "rsync %s" % " ".join(args)
@@ -60,9 +63,130 @@ def sync(nodes, paths, cmdout):
     for (id, success, output) in run_localcmds(cmds):
         if not success:
             cmdout.error("rsync to %s failed: %s" % (id.addr, output))
-            result = False
+        results += [(id, success)]
+
+    return results
+
+# Same as sync(), but for each (node, relay) tuple in "pairs" the rsync is
+# run on the relay host (which must have been synced already).
+def relay_sync(pairs, paths, cmdout):
+    results = []
+    cmds = []
+    for (n, relay) in pairs:
+        rsync = "rsync -rRl --delete --rsh='%s' %s %s:/" % (_SshCmd, " ".join(paths), util.format_rsync_addr(n.addr))
+        cmdline = '%s -A %s "%s"' % (_SshCmd, relay.addr, rsync)
+        cmds += [(n, cmdline, "", None)]
+
+    for ((id, success, output), (n, relay)) in zip(run_localcmds(cmds), pairs):
+        if not success:
+            cmdout.error("rsync to %s via %s failed: %s" % (id.addr, relay.addr, output))
+        results += [(id, success)]
+
+    return results
+
+# Sends the gzip'ed tar archive "archive" via ssh to each of "nodes" and
+# applies it there using the apply-delta helper, which unpacks it to
+# "stagedir" first.  On the nodes named in "relays", a copy of the archive
+# is kept at pathname "keep" so that they can relay it further (see
+# relay_delta).  Returns a list of (node, success) tuples.
+def push_delta(nodes, archive, stagedir, helperdir, cmdout, keep=None, relays=()):
+    cmds = []
+    for n in nodes:
+        helper = _apply_delta_cmdline(n, stagedir, helperdir, keep, relays)
+        cmdline = '%s %s "%s" < %s' % (_SshCmd, n.addr, helper, archive)
+        cmds += [(n, cmdline, "", None)]
+
+    results = []
+    for (id, success, output) in run_localcmds(cmds):
+        if not success:
+            cmdout.error("sending changed files to %s failed: %s" % (id.addr, output))
+        results += [(id, success)]
+
+    return results
+
+# Same as push_delta(), but for each (node, relay) tuple in "pairs" the
+# archive kept at pathname "keep" on the relay host is sent from there.
+def relay_delta(pairs, keep, stagedir, helperdir, cmdout, relays=()):
+    cmds = []
+    for (n, relay) in pairs:
+        helper = _apply_delta_cmdline(n, stagedir, helperdir, keep, relays)
+        cmdline = "%s %s '%s' < %s" % (_SshCmd, n.addr, helper, keep)
+        cmdline = '%s -A %s "%s"' % (_SshCmd, relay.addr, cmdline)
+        cmds += [(n, cmdline, "", None)]
 
-    return result
+    results = []
+    for ((id, success, output), (n, relay)) in zip(run_localcmds(cmds), pairs):
+        if not success:
+            cmdout.error("sending changed files to %s via %s failed: %s" % (id.addr, relay.addr, output))
+        results += [(id, success)]
+
+    return results
+
+def _apply_delta_cmdline(node, stagedir, helperdir, keep, relays):
+    cmdline = "%s %s" % (os.path.join(helperdir, "apply-delta"), stagedir)
+    if node.name in [r.name for r in relays]:
+        cmdline += " %s" % keep
+    return cmdline
+
+# Distributes files to "nodes" in a tree: the manager sends to the first
+# "degree" nodes directly, and each node relays to up to "degree" further
+# nodes.  This proceeds one tier of the tree at a time: all transfers of a
+# tier run in parallel, and the next tier starts once all of them have
+# finished (so a host waits for the slowest host of its parent's tier,
+# not just for its parent).  "push" is called with a
+# list of nodes to send to directly, and "relay" with a list of
+# (node, relay) tuples; both return a list of (node, success) tuples.  If
+# a relay fails, the manager sends to the affected nodes directly.  A
+# "degree" of zero sends to all nodes directly.
+def fanout(nodes, degree, push, relay, cmdout):
+    if degree <= 0:
+        return push(nodes)
+
+    def parent(i):
+        return nodes[i // degree - 1] if i >= degree else None
+
+    # Group node indices by their depth in the tree.
+    depth = {}
+    tiers = []
+    for i in range(len(nodes)):
+        d = depth[i // degree - 1] + 1 if i >= degree else 0
+        depth[i] = d
+        if d == len(tiers):
+            tiers.append([])
+        tiers[d].append(i)
+
+    results = {}
+
+    for tier in tiers:
+        direct = []
+        relayed = []
+        for i in tier:
+            p = parent(i)
+            if p and results[p.name]:
+                relayed.append((nodes[i], p))
+            else:
+                direct.append(nodes[i])
+
+        if relayed:
+            for (n, success) in relay(relayed):
+                if success:
+                    results[n.name] = True
+                else:
+                    cmdout.info("sending to %s directly ..." % n.host)
+                    direct.append(n)
+
+        if direct:
+            for (n, success) in push(direct):
+                results[n.name] = success
+
+    return [(n, results[n.name]) for n in nodes]
+
+# Returns the nodes which relay to further nodes in fanout().
+def fanout_relays(nodes, degree):
+    if degree <= 0:
+        return []
+
+    return [n for (i, n) in enumerate(nodes) if degree * (i + 1) < len(nodes)]
 
 
 # Runs command locally and returns tuple (success, output)
@@ -80,13 +204,23 @@ def run_localcmd(cmd, env=None, inputtext=None):
 # an arbitrary cookie identifying each command.
 # Returns a list of (id, success, output) tuples.
 def run_localcmds(cmds):
-    results = []
+    return wait_localcmds(start_localcmds(cmds))
+
+# Starts the commands as run_localcmds() does, but returns without waiting
+# for them.  The returned list is to be passed to wait_localcmds(), which
+# returns the results as run_localcmds() does.
+def start_localcmds(cmds):
     running = []
 
     for (id, cmd, envs, inputtext) in cmds:
         proc = _run_localcmd_init(id, cmd, envs)
         running += [(id, proc, inputtext)]
 
+    return running
+
+def wait_localcmds(running):
+    results = []
+
     for (id, proc, inputtext) in running:
         success, output = _run_localcmd_wait(proc, inputtext)
         results += [(id, success, output)]
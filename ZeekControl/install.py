@@ -1,6 +1,11 @@
 # Functions to install files on all nodes.
 
 import os
+import glob
+import json
+import stat
+import shutil
+import hashlib
 import binascii
 
 from ZeekControl import util
@@ -23,8 +28,7 @@ def get_syncs():
     ("${libdir}", True, True),
     ("${libdir64}", True, True),
     ("${bindir}", True, False),
-    ("${policydirsiteinstall}", True, False),
-    ("${policydirsiteinstallauto}", True, False),
+    ("${installgenerationsdir}", True, False),
     # ("${policydir}", True, False),
     # ("${staticdir}", True, False),
     ("${logdir}", False, False),
@@ -40,8 +44,7 @@ def get_nfssyncs():
     nfssyncs = [
     ("${spooldir}", False, False),
     ("${tmpdir}", False, False),
-    ("${policydirsiteinstall}", True, False),
-    ("${policydirsiteinstallauto}", True, False),
+    ("${installgenerationsdir}", True, False),
     ("${zeekctlconfigdir}/zeekctl-config.sh", True, False)
     ]
 
@@ -73,6 +76,364 @@ def relpath(src, dst):
     relparts = (len(dstparts) - 1) * ['..'] + srcparts
     return os.path.join(*relparts)
 
+# Write the string "ostr" to "filename", unless the file already has exactly
+# this content (so that its mtime only changes when the content does).  The
+# new content goes to a tmp file first which is then renamed, so that readers
+# never see a partially written file.
+def write_file(filename, ostr, cmdout):
+    try:
+        with open(filename, "r") as f:
+            if f.read() == ostr:
+                return True
+    except (IOError, UnicodeDecodeError):
+        pass
+
+    tmp_path = os.path.join(os.path.dirname(filename), ".%s.tmp" % os.path.basename(filename))
+
+    try:
+        with open(tmp_path, "w") as out:
+            out.write(ostr)
+    except IOError as e:
+        cmdout.error("failed to write file: %s" % e)
+        return False
+
+    try:
+        os.rename(tmp_path, filename)
+    except OSError as e:
+        cmdout.error("failed to rename file %s: %s" % (tmp_path, e))
+        return False
+
+    return True
+
+# Return a string identifying the content and permission bits of a file.
+# If a dict "cache" is given, it is used to look up (and record) the digest
+# of a file which has not been modified since it was last computed.
+def _file_digest(path, cache=None):
+    st = os.stat(path)
+    key = [st.st_mtime, st.st_size, st.st_ino, st.st_mode]
+
+    if cache is not None:
+        cached = cache.get(path)
+        if cached and cached[:-1] == key:
+            return cached[-1]
+
+    hh = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            hh.update(block)
+
+    digest = "%s:%o" % (hh.hexdigest(), stat.S_IMODE(st.st_mode))
+
+    if cache is not None:
+        cache[path] = key + [digest]
+
+    return digest
+
+# Return a manifest of the directory tree at "path", i.e. a dict mapping the
+# relative pathname of each entry to "dir", to "link:<target>" for a symlink,
+# or to the content digest of a file.  Symlinks are not followed.
+def make_manifest(path, cache=None):
+    manifest = {}
+
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            fullpath = os.path.join(root, name)
+            relpath = os.path.relpath(fullpath, path)
+
+            if os.path.islink(fullpath):
+                manifest[relpath] = "link:%s" % os.readlink(fullpath)
+            elif os.path.isdir(fullpath):
+                manifest[relpath] = "dir"
+            elif os.path.isfile(fullpath):
+                manifest[relpath] = _file_digest(fullpath, cache)
+
+    return manifest
+
+# Return a manifest (see make_manifest) of all "paths" (files or directory
+# trees), with each entry keyed by its absolute pathname without the
+# leading "/".  See _file_digest for "cache", from which entries for files
+# no longer found are removed.
+def make_sync_manifest(paths, cache=None):
+    manifest = {}
+
+    for path in paths:
+        root = path.lstrip("/")
+
+        if os.path.islink(path):
+            manifest[root] = "link:%s" % os.readlink(path)
+        elif os.path.isdir(path):
+            manifest[root] = "dir"
+            for (relpath, entry) in make_manifest(path, cache).items():
+                manifest[os.path.join(root, relpath)] = entry
+        elif os.path.isfile(path):
+            manifest[root] = _file_digest(path, cache)
+
+    if cache is not None:
+        for path in list(cache):
+            if path.lstrip("/") not in manifest:
+                del cache[path]
+
+    return manifest
+
+def manifest_digest(manifest):
+    data = json.dumps(manifest, sort_keys=True).encode()
+    return hashlib.sha1(data).hexdigest()
+
+# Return a tuple (changed, removed) of the pathnames which need to be copied
+# and removed, respectively, to turn a tree described by manifest "old" into
+# one described by manifest "new".  The removed pathnames are ordered such
+# that the contents of a directory come before the directory itself.
+def manifest_delta(old, new):
+    changed = sorted(p for (p, entry) in new.items() if old.get(p) != entry)
+    removed = sorted((p for (p, entry) in old.items()
+                      if p not in new or (entry == "dir") != (new[p] == "dir")),
+                     reverse=True)
+    return (changed, removed)
+
+# Manifests are stored as files "<digest>.json" in directory "path".
+def save_manifest(path, digest, manifest, cmdout):
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+    except OSError as err:
+        cmdout.error("failed to create directory: %s" % err)
+        return False
+
+    filename = os.path.join(path, "%s.json" % digest)
+    if os.path.exists(filename):
+        return True
+
+    return write_file(filename, json.dumps(manifest, sort_keys=True), cmdout)
+
+# Returns None if the manifest is not available.
+def load_manifest(path, digest):
+    return load_json(os.path.join(path, "%s.json" % digest))
+
+# Returns None if the file cannot be read or parsed.
+def load_json(filename):
+    try:
+        with open(filename, "r") as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+# Remove all stored manifests except for those with the given digests.
+def expire_manifests(path, keep):
+    keep = ["%s.json" % digest for digest in keep]
+
+    for name in os.listdir(path):
+        if name.endswith(".json") and name not in keep:
+            try:
+                os.unlink(os.path.join(path, name))
+            except OSError:
+                pass
+
+# Install the contents of the directories "srcdirs" into "dstdir".  If the
+# same file or subdirectory is found in more than one source directory, then
+# only the first one is used.  Only entries whose content differs from what
+# is already installed are rewritten (each via a tmp file that is renamed),
+# and only entries that are no longer found in any source are removed.
+def install_site_policies(srcdirs, dstdir, cmdout):
+    sources = {}
+
+    for dirpath in srcdirs:
+        for src in glob.glob(os.path.join(dirpath, "*")):
+            name = os.path.basename(src)
+            if name in sources:
+                continue
+
+            if os.path.islink(src):
+                sources[name] = (src, "link:%s" % os.readlink(src))
+            elif os.path.isfile(src):
+                sources[name] = (src, _file_digest(src))
+            elif os.path.isdir(src):
+                sources[name] = (src, "dir")
+                for (relpath, entry) in make_manifest(src).items():
+                    sources[os.path.join(name, relpath)] = (os.path.join(src, relpath), entry)
+            else:
+                cmdout.error("failed to copy %s: not a file, dir, or symlink" % src)
+                return False
+
+    installed = make_manifest(dstdir)
+
+    # Entries are visited in reverse order so that the contents of a
+    # directory are removed before the directory itself.
+    obsolete = [relpath for relpath in sorted(installed, reverse=True)
+                if relpath not in sources or (installed[relpath] == "dir") != (sources[relpath][1] == "dir")]
+
+    if obsolete:
+        cmdout.info("removing %d obsolete site policy files ..." % len(obsolete))
+
+    try:
+        for relpath in obsolete:
+            dst = os.path.join(dstdir, relpath)
+            if installed[relpath] == "dir":
+                os.rmdir(dst)
+            else:
+                os.unlink(dst)
+            del installed[relpath]
+    except OSError as err:
+        cmdout.error("failed to remove %s: %s" % (dst, err))
+        return False
+
+    # Sorting makes sure a directory is created before its contents.
+    for relpath in sorted(sources):
+        src, entry = sources[relpath]
+        if installed.get(relpath) == entry:
+            continue
+
+        dst = os.path.join(dstdir, relpath)
+        tmp = os.path.join(os.path.dirname(dst), ".%s.tmp" % os.path.basename(dst))
+
+        try:
+            if entry == "dir":
+                if not os.path.isdir(dst):
+                    os.mkdir(dst)
+                continue
+
+            if os.path.lexists(tmp):
+                os.unlink(tmp)
+
+            if entry.startswith("link:"):
+                os.symlink(os.readlink(src), tmp)
+            else:
+                shutil.copy2(src, tmp)
+
+            os.rename(tmp, dst)
+        except (IOError, OSError) as err:
+            cmdout.error("failed to copy %s: %s" % (src, err))
+            return False
+
+    return True
+
+# Remove all entries of directory "path" whose name is not in "keep".
+def remove_stale(path, keep, cmdout):
+    for name in os.listdir(path):
+        if name in keep:
+            continue
+
+        fullpath = os.path.join(path, name)
+        try:
+            if os.path.isdir(fullpath) and not os.path.islink(fullpath):
+                shutil.rmtree(fullpath)
+            else:
+                os.unlink(fullpath)
+        except OSError as err:
+            cmdout.error("failed to remove %s: %s" % (fullpath, err))
+            return False
+
+    return True
+
+# Install generations: each install writes the policy scripts into a new
+# numbered subdirectory of a generations directory, and then activates it by
+# atomically replacing a symlink to point to it.  Older generations are kept
+# (up to some limit) so that we can switch back to them.
+
+# Returns the sorted list of generation numbers found in "gendir".
+def generations(gendir):
+    try:
+        names = os.listdir(gendir)
+    except OSError:
+        return []
+
+    return sorted([int(name) for name in names if name.isdigit()])
+
+# Returns the number of the generation that "link" currently points to, or
+# None if it's not a symlink to a generation in "gendir".
+def active_generation(link, gendir):
+    if not os.path.islink(link):
+        return None
+
+    target = os.path.join(os.path.dirname(link), os.readlink(link))
+    name = os.path.basename(os.path.normpath(target))
+    if not name.isdigit():
+        return None
+
+    # Either path may be relative or contain symlinks.
+    if os.path.realpath(os.path.dirname(os.path.normpath(target))) != os.path.realpath(gendir):
+        return None
+
+    return int(name)
+
+# Copy the tree "src" to "dst", hard-linking regular files instead of copying
+# them (or copying, if that fails).  As installed files are never modified in
+# place but replaced by renaming a new file over them, the files of "src"
+# can't be changed through "dst".
+def clone_tree(src, dst):
+    os.mkdir(dst)
+    for (relpath, entry) in sorted(make_manifest(src).items()):
+        srcpath = os.path.join(src, relpath)
+        dstpath = os.path.join(dst, relpath)
+
+        if entry == "dir":
+            os.mkdir(dstpath)
+        elif entry.startswith("link:"):
+            os.symlink(os.readlink(srcpath), dstpath)
+        else:
+            try:
+                os.link(srcpath, dstpath)
+            except OSError:
+                shutil.copy2(srcpath, dstpath)
+
+# Create the directory for a new generation in "gendir", starting with a
+# clone of the directory "src" (if it exists).  Returns the new generation
+# number, or None on error.
+def new_generation(gendir, src, cmdout):
+    gens = generations(gendir)
+    gen = gens[-1] + 1 if gens else 1
+    dst = os.path.join(gendir, str(gen))
+
+    try:
+        if not os.path.isdir(gendir):
+            os.makedirs(gendir)
+
+        if src and os.path.isdir(src):
+            clone_tree(src, dst)
+        else:
+            os.mkdir(dst)
+    except (IOError, OSError) as err:
+        cmdout.error("failed to create install generation %s: %s" % (dst, err))
+        return None
+
+    return gen
+
+# Make "link" point to "target" by renaming a new symlink over it, so that
+# readers either see the old or the new target.  If "link" is still a
+# directory (i.e., from an install before generations were used), it is
+# removed first.
+def activate_generation(link, target, cmdout):
+    tmp = os.path.join(os.path.dirname(link), ".%s.tmp" % os.path.basename(link))
+
+    try:
+        if os.path.isdir(link) and not os.path.islink(link):
+            shutil.rmtree(link)
+
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+
+        os.symlink(target, tmp)
+        os.rename(tmp, link)
+    except OSError as err:
+        cmdout.error("failed to activate %s: %s" % (target, err))
+        return False
+
+    return True
+
+# Remove all generations in "gendir" except for the "keep" newest ones and
+# the "active" one.
+def expire_generations(gendir, keep, active, cmdout):
+    gens = generations(gendir)
+    obsolete = [gen for gen in gens[:-keep] if gen != active] if keep > 0 else []
+
+    for gen in obsolete:
+        try:
+            shutil.rmtree(os.path.join(gendir, str(gen)))
+        except OSError as err:
+            cmdout.error("failed to remove install generation %d: %s" % (gen, err))
+            return False
+
+    return True
+
 # Generate a shell script "zeekctl-config.sh" that sets env. vars. that
 # correspond to zeekctl config options.
 def make_zeekctl_config_sh(cmdout):
@@ -89,24 +450,13 @@ def make_zeekctl_config_sh(cmdout):
         # are escaped.
         ostr += '%s="%s"\n' % (varname.replace(".", "_"), value.replace('"', '\\"'))
 
-    # Rather than just overwriting the file, we first write out a tmp file,
-    # and then rename it to avoid a race condition where a process outside of
-    # zeekctl (such as archive-log) is trying to read the file while it is
-    # being written.
+    # Rather than just overwriting the file, write_file first writes out a
+    # tmp file, and then renames it to avoid a race condition where a process
+    # outside of zeekctl (such as archive-log) is trying to read the file
+    # while it is being written.
     cfg_path = os.path.join(config.Config.zeekctlconfigdir, "zeekctl-config.sh")
-    tmp_path = os.path.join(config.Config.zeekctlconfigdir, ".zeekctl-config.sh.tmp")
-
-    try:
-        with open(tmp_path, "w") as out:
-            out.write(ostr)
-    except IOError as e:
-        cmdout.error("failed to write file: %s" % e)
-        return False
 
-    try:
-        os.rename(tmp_path, cfg_path)
-    except OSError as e:
-        cmdout.error("failed to rename file %s: %s" % (tmp_path, e))
+    if not write_file(cfg_path, ostr, cmdout):
         return False
 
     symlink = os.path.join(config.Config.scriptsdir, "zeekctl-config.sh")
@@ -212,14 +562,7 @@ def make_layout(path, cmdout, silent=False):
 
         ostr += "};\n"
 
-    try:
-        with open(filename, "w") as out:
-            out.write(ostr)
-    except IOError as e:
-        cmdout.error("failed to write file: %s" % e)
-        return False
-
-    return True
+    return write_file(filename, ostr, cmdout)
 
 
 # Reads in a list of networks from file.
@@ -267,14 +610,7 @@ def make_local_networks(path, cmdout):
         ostr += "\n"
     ostr += "};\n\n"
 
-    try:
-        with open(os.path.join(path, "local-networks.zeek"), "w") as out:
-            out.write(ostr)
-    except IOError as e:
-        cmdout.error("failed to write file: %s" % e)
-        return False
-
-    return True
+    return write_file(os.path.join(path, "local-networks.zeek"), ostr, cmdout)
 
 
 def make_zeekctl_config_policy(path, cmdout, plugin_reg):
@@ -311,14 +647,7 @@ def make_zeekctl_config_policy(path, cmdout, plugin_reg):
         ostr += 'redef LogAscii::gzip_file_extension = "%s";\n' % config.Config.compressextension
 
     filename = os.path.join(path, "zeekctl-config.zeek")
-    try:
-        with open(filename, "w") as out:
-            out.write(ostr)
-    except IOError as e:
-        cmdout.error("failed to write file: %s" % e)
-        return False
-
-    return True
+    return write_file(filename, ostr, cmdout)
 
 
 # Create a new random seed value if one is not found in the state database (this
@@ -0,0 +1,145 @@
+# I/O throttling for the background jobs that archive and expire log files,
+# so that they interfere less with Zeek writing the live logs.
+#
+# The ArchiveIOClass option lowers the I/O scheduling class of those jobs
+# (with ionice).  A Throttle further limits the rate at which a job reads or
+# removes data to ArchiveIORate, and, if ArchiveIOMaxUtil is set, pauses the
+# job while the utilization of the disk holding the log directory (as
+# measured from the I/O time in /proc/diskstats) is above that percentage.
+
+from __future__ import print_function
+import os
+import time
+import threading
+import subprocess
+
+DiskStats = "/proc/diskstats"
+
+# The longest time a job pauses for a busy disk, so that archiving makes
+# progress even if the disk never becomes idle.
+MaxPause = 60.0
+
+# The arguments of ionice for each value of ArchiveIOClass.
+_IOClasses = {
+    "idle": ["-c", "3"],
+    "best-effort": ["-c", "2", "-n", "7"],
+}
+
+def ionice_args(ioclass):
+    return _IOClasses.get(ioclass)
+
+# Sets the I/O scheduling class of this process (and of threads and processes
+# it starts later).  Returns False if that's not possible.
+def set_ioclass(ioclass):
+    args = ionice_args(ioclass)
+    if not args:
+        return False
+
+    try:
+        return subprocess.call(["ionice"] + args + ["-p", str(os.getpid())]) == 0
+    except OSError:
+        return False
+
+# Returns the name of the device holding "path" as it appears in diskstats,
+# or None.
+def device_of(path, diskstats=DiskStats):
+    try:
+        dev = os.stat(path).st_dev
+        with open(diskstats, "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 12 and int(fields[0]) == os.major(dev) and int(fields[1]) == os.minor(dev):
+                    return fields[2]
+    except (IOError, OSError, ValueError):
+        pass
+
+    return None
+
+# Returns the milliseconds that "device" has spent doing I/O, or None.
+def io_ticks(device, diskstats=DiskStats):
+    try:
+        with open(diskstats, "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 12 and fields[2] == device:
+                    return int(fields[12])
+    except (IOError, OSError, ValueError):
+        pass
+
+    return None
+
+class Throttle:
+    def __init__(self, rate=0, maxutil=0, path=None, interval=1.0, diskstats=DiskStats):
+        self.rate = rate
+        self.maxutil = maxutil
+        self.interval = interval
+        self.diskstats = diskstats
+        self.device = device_of(path, diskstats) if maxutil and path else None
+        self.lock = threading.Lock()
+        self.due = 0.0
+        self.sample = None
+        self.util = 0.0
+
+    # Returns the utilization (in percent) of the device over the last
+    # interval, sampling it at most once per interval.
+    def utilization(self):
+        now = time.time()
+
+        with self.lock:
+            if self.sample and now - self.sample[0] < self.interval:
+                return self.util
+
+            ticks = io_ticks(self.device, self.diskstats)
+            if ticks is None:
+                return 0.0
+
+            if self.sample:
+                elapsed = (now - self.sample[0]) * 1000.0
+                self.util = min(100.0, 100.0 * (ticks - self.sample[1]) / elapsed)
+
+            self.sample = (now, ticks)
+            return self.util
+
+    # Waits as long as needed before the job reads or removes "size" more
+    # bytes.
+    def consume(self, size):
+        if self.device:
+            paused = 0.0
+            while paused < MaxPause and self.utilization() > self.maxutil:
+                time.sleep(self.interval)
+                paused += self.interval
+
+        if self.rate:
+            with self.lock:
+                now = time.time()
+                start = max(self.due, now)
+                self.due = start + float(size) / self.rate
+
+            if start > now:
+                time.sleep(start - now)
+
+# Returns a Throttle configured by the options in "cfg" (a dict of
+# zeekctl-config.sh variables), or None if there are no limits.
+def from_config(cfg):
+    try:
+        rate = int(cfg.get("archiveiorate", 0)) * 1024 * 1024
+        maxutil = int(cfg.get("archiveiomaxutil", 0))
+    except ValueError:
+        return None
+
+    if not rate and not maxutil:
+        return None
+
+    return Throttle(rate, maxutil, cfg.get("logdir"))
+
+# Copies the file object "src" to "out" at the pace of "throttle".
+def copy(src, out, throttle, blocksize=1024 * 1024):
+    while True:
+        data = src.read(blocksize)
+        if not data:
+            break
+
+        if throttle:
+            throttle.consume(len(data))
+
+        out.write(data)
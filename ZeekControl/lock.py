@@ -1,25 +1,59 @@
+# The lock comes in two modes.  An exclusive lock is held by a single process
+# (the lock file contains its PID).  A shared lock may be held by any number
+# of processes at the same time, each of which creates a file named
+# "<lockfile>.shared.<pid>"; it excludes exclusive locks of other processes
+# only, so that zeekctld can run read-only commands while it's running a
+# command that modifies the installation.
+#
+# Within a process, the threads running read-only commands register as
+# readers (see reading()), so that a command changing what they read (such
+# as reloading the configuration) can wait for them (see exclude_readers()).
+
+import glob
 import os
+import threading
 import time
+import contextlib
+import collections
 
 from ZeekControl import config
 
-lockCount = 0
+# Number of times each mode is held by the current process, and whether a
+# thread is acquiring it.  The threads don't hold lockCond while waiting for
+# another process, so that the others can still release their locks.
+lockCount = {"shared": 0, "exclusive": 0}
+lockAcquiring = {"shared": False, "exclusive": False}
+lockCond = threading.Condition()
 
-# Return: 0 if no lock, >0 for PID of lock, or -1 on error
-def _break_lock(cmdout):
+# Number of times each thread of the current process is registered as a
+# reader, and the thread that keeps the others from reading (if any).
+readers = collections.Counter()
+readersCond = threading.Condition()
+excludingThread = None
+
+# Returns true if the process with the given PID (a string) is running.
+def _is_running(pid):
     from ZeekControl import execute
 
+    success, output = execute.run_localcmd("%s %s" % (os.path.join(config.Config.helperdir, "check-pid"), pid))
+    return success and output.strip() == "running"
+
+# Return: 0 if no lock, >0 for PID of lock, or -1 on error
+def _break_lock(cmdout):
     try:
         # Check whether lock is stale.
         with open(config.Config.lockfile, "r") as f:
             pid = f.readline().strip()
 
+    except FileNotFoundError:
+        # Lock has been released meanwhile.
+        return 0
+
     except (OSError, IOError) as err:
         cmdout.error("failed to read lock file: %s" % err)
         return -1
 
-    success, output = execute.run_localcmd("%s %s" % (os.path.join(config.Config.helperdir, "check-pid"), pid))
-    if success and output.strip() == "running":
+    if _is_running(pid):
         # Process still exists.
         try:
             return int(pid)
@@ -90,15 +124,70 @@ def _release_lock(cmdout):
     except OSError as e:
         cmdout.error("cannot remove lock file: %s" % e)
 
-def lock(cmdout, showwait=True):
-    global lockCount
+def _shared_file(pid):
+    return "%s.shared.%s" % (config.Config.lockfile, pid)
+
+# Return: 0 if shared lock is acquired, or if failed to acquire lock return
+# >0 for PID of exclusive lock, or -1 on error
+def _acquire_shared_lock(cmdout):
+    pid = os.getpid()
+    sharedfile = _shared_file(pid)
+
+    lockdir = os.path.dirname(config.Config.lockfile)
+    if not os.path.exists(lockdir):
+        cmdout.info("creating directory for lock file: %s" % lockdir)
+        os.makedirs(lockdir)
+
+    try:
+        with open(sharedfile, "w") as f:
+            f.write("%s\n" % pid)
+    except IOError as e:
+        cmdout.error("cannot acquire lock: %s" % e)
+        return -1
+
+    # A process taking the exclusive lock waits for the shared lock files
+    # after creating the lock file, so check for it only now.
+    if not os.path.exists(config.Config.lockfile):
+        return 0
+
+    lockpid = _break_lock(cmdout)
+    if lockpid in (0, pid):
+        return 0
+
+    _release_shared_lock(cmdout)
+    return lockpid
+
+def _release_shared_lock(cmdout):
+    try:
+        os.unlink(_shared_file(os.getpid()))
+    except OSError as e:
+        cmdout.error("cannot remove lock file: %s" % e)
+
+# Returns the PIDs of other processes holding a shared lock, after removing
+# the files of those that no longer exist.
+def _shared_lock_holders(cmdout):
+    pids = []
+    for sharedfile in glob.glob(_shared_file("*")):
+        pid = sharedfile.rsplit(".", 1)[1]
+        if pid == str(os.getpid()):
+            continue
+
+        if _is_running(pid):
+            pids.append(pid)
+            continue
+
+        cmdout.info("removing stale shared lock")
+        try:
+            os.unlink(sharedfile)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            cmdout.error("failed to remove lock file: %s" % e)
 
-    if lockCount > 0:
-        # Already locked.
-        lockCount += 1
-        return True
+    return pids
 
-    lockpid = _acquire_lock(cmdout)
+def _wait(cmdout, acquire, showwait):
+    lockpid = acquire(cmdout)
     if lockpid < 0:
         return False
 
@@ -107,28 +196,162 @@ def lock(cmdout, showwait=True):
             cmdout.info("waiting for lock (owned by PID %d) ..." % lockpid)
 
         count = 0
-        while _acquire_lock(cmdout) != 0:
+        while acquire(cmdout) != 0:
             time.sleep(1)
 
             count += 1
             if count > 30:
                 return False
 
-    lockCount = 1
     return True
 
-def unlock(cmdout):
-    global lockCount
+def _lock_exclusive(cmdout, showwait):
+    if not _wait(cmdout, _acquire_lock, showwait):
+        return False
+
+    # Wait for the shared locks of other processes to go away.
+    pids = _shared_lock_holders(cmdout)
+    if pids and showwait:
+        cmdout.info("waiting for shared lock (owned by PID %s) ..." % ", ".join(pids))
 
-    if lockCount == 0:
-        cmdout.error("mismatched lock/unlock")
-        return
+    count = 0
+    while pids:
+        time.sleep(1)
 
-    if lockCount > 1:
-        # Still locked.
-        lockCount -= 1
-        return
+        count += 1
+        if count > 30:
+            _release_lock(cmdout)
+            return False
 
-    _release_lock(cmdout)
+        pids = _shared_lock_holders(cmdout)
+
+    return True
 
-    lockCount = 0
+# Returns the PID of another process waiting for or holding the exclusive
+# lock, or 0 if there is none.
+def _exclusive_locker(cmdout):
+    if not os.path.exists(config.Config.lockfile):
+        return 0
+
+    lockpid = _break_lock(cmdout)
+    if lockpid in (-1, os.getpid()):
+        return 0
+
+    return lockpid
+
+# Acquires the lock, in shared mode if "shared" is true.  Locks can be nested,
+# and a shared lock is granted right away if the current process holds the
+# exclusive one.  However, while another process waits for the exclusive
+# lock, a nested shared lock is granted only after it got and released it, or
+# else the threads of the current process could keep the shared lock forever.
+def lock(cmdout, showwait=True, shared=False):
+    mode = "shared" if shared else "exclusive"
+
+    count = 0
+    while True:
+        with lockCond:
+            while lockAcquiring[mode]:
+                lockCond.wait()
+
+            if lockCount[mode] == 0:
+                lockAcquiring[mode] = True
+                break
+
+            lockpid = _exclusive_locker(cmdout) if shared else 0
+            if not lockpid:
+                # Already locked.
+                lockCount[mode] += 1
+                return True
+
+        if count == 0 and showwait:
+            cmdout.info("waiting for lock (owned by PID %d) ..." % lockpid)
+
+        time.sleep(1)
+
+        count += 1
+        if count > 30:
+            return False
+
+    success = False
+    try:
+        if shared:
+            success = _wait(cmdout, _acquire_shared_lock, showwait)
+        else:
+            success = _lock_exclusive(cmdout, showwait)
+    finally:
+        with lockCond:
+            lockAcquiring[mode] = False
+            if success:
+                lockCount[mode] = 1
+
+            lockCond.notify_all()
+
+    return success
+
+def unlock(cmdout, shared=False):
+    mode = "shared" if shared else "exclusive"
+
+    with lockCond:
+        if lockCount[mode] == 0:
+            cmdout.error("mismatched lock/unlock")
+            return
+
+        lockCount[mode] -= 1
+        if lockCount[mode] > 0:
+            # Still locked.
+            return
+
+        if shared:
+            _release_shared_lock(cmdout)
+        else:
+            _release_lock(cmdout)
+
+# Returns true if the current process holds the exclusive lock.
+def holds_exclusive():
+    return lockCount["exclusive"] > 0
+
+# Registers the current thread as a reader for the duration of the context,
+# waiting while another thread excludes readers.
+@contextlib.contextmanager
+def reading():
+    me = threading.get_ident()
+
+    with readersCond:
+        while excludingThread not in (None, me):
+            readersCond.wait()
+
+        readers[me] += 1
+
+    try:
+        yield
+    finally:
+        with readersCond:
+            readers[me] -= 1
+            if not readers[me]:
+                del readers[me]
+
+            readersCond.notify_all()
+
+# Waits until no other thread of the current process is a reader, and keeps
+# them from becoming one for the duration of the context.
+@contextlib.contextmanager
+def exclude_readers():
+    global excludingThread
+    me = threading.get_ident()
+
+    with readersCond:
+        while excludingThread not in (None, me):
+            readersCond.wait()
+
+        previous = excludingThread
+        excludingThread = me
+
+        while any(thread != me for thread in readers):
+            readersCond.wait()
+
+    try:
+        yield
+    finally:
+        with readersCond:
+            excludingThread = previous
+            readersCond.notify_all()
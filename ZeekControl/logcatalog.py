@@ -0,0 +1,272 @@
+# A catalog of the log files archived by archive-log, used to expire archived
+# logs without walking the log directory.
+#
+# The catalog is a directory with one file per day (named YYYY-MM-DD after the
+# day on which the logs were archived), to which archive-log appends a line
+# for each archived file:
+#
+#   <time archived> <start> <end> <size> <compression> <base name> <path>
+#
+# with the fields separated by tabs.  The start and end times are those of the
+# log (in the format YYYY-MM-DD-HH-MM-SS), and the compression is the
+# extension of the compressed file, or "none".  Lines are appended in the
+# order the logs are archived, so the catalog is an index of all archived
+# logs ordered by age.
+#
+# Appending to the catalog and changing it otherwise is serialized by an
+# flock on the file "<catalog>.lock" next to the catalog directory (so that
+# it stays the same when build() replaces the directory).  archive-log takes
+# it with flock(1) where that's available.
+
+from __future__ import print_function
+import os
+import re
+import time
+import fcntl
+import shutil
+import fnmatch
+import contextlib
+from collections import namedtuple
+
+Entry = namedtuple("Entry", ("time", "start", "end", "size", "compression", "base", "path"))
+
+_DayPattern = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+# Marks a catalog that includes the logs archived before it existed.
+_BuiltMarker = ".built"
+
+# Seconds after which the catalog is rebuilt from the log directory, to pick
+# up logs that were archived without being added to it (e.g., by a
+# postprocessor, or when archive-log failed to add them).
+RebuildInterval = 86400
+
+def parse_entry(line):
+    fields = line.rstrip("\n").split("\t")
+    if len(fields) != 7:
+        return None
+
+    try:
+        return Entry(float(fields[0]), fields[1], fields[2], int(fields[3]), fields[4], fields[5], fields[6])
+    except ValueError:
+        return None
+
+def format_entry(entry):
+    return "%d\t%s\t%s\t%d\t%s\t%s\t%s\n" % entry
+
+def day_of(t):
+    return time.strftime("%Y-%m-%d", time.localtime(t))
+
+# Holds the lock of the catalog for the duration of the context.
+@contextlib.contextmanager
+def _locked(catalogdir):
+    parent = os.path.dirname(os.path.abspath(catalogdir))
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+
+    with open(catalogdir + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _append(catalogdir, entry):
+    if not os.path.isdir(catalogdir):
+        os.makedirs(catalogdir)
+
+    with open(os.path.join(catalogdir, day_of(entry.time)), "a") as f:
+        f.write(format_entry(entry))
+
+def add(catalogdir, entry):
+    with _locked(catalogdir):
+        _append(catalogdir, entry)
+
+# Returns the days for which the catalog has entries, oldest first.
+def days(catalogdir):
+    try:
+        return sorted(name for name in os.listdir(catalogdir) if _DayPattern.match(name))
+    except OSError:
+        return []
+
+def read_day(catalogdir, day):
+    entries = []
+
+    try:
+        with open(os.path.join(catalogdir, day), "r") as f:
+            for line in f:
+                entry = parse_entry(line)
+                if entry:
+                    entries.append(entry)
+    except IOError:
+        pass
+
+    return entries
+
+# Rebuilds the catalog from the archived logs found in "logdir", to include
+# logs archived before the catalog existed, or by postprocessors that bypass
+# archive-log.  This assumes the directory layout of the default
+# make-archive-name script, as expire-logs did before there was a catalog.
+def build(catalogdir, logdir):
+    with _locked(catalogdir):
+        return _build(catalogdir, logdir)
+
+def _build(catalogdir, logdir):
+    found = []
+
+    for name in os.listdir(logdir):
+        archivedir = os.path.join(logdir, name)
+        if not _DayPattern.match(name) or not os.path.isdir(archivedir):
+            continue
+
+        for fname in os.listdir(archivedir):
+            path = os.path.join(archivedir, fname)
+
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            if not os.path.isfile(path):
+                continue
+
+            compression = "none"
+            parts = fname.split(".")
+            if len(parts) > 2 and parts[-2] == "log":
+                compression = parts[-1]
+
+            found.append(Entry(st.st_mtime, "-", "-", st.st_size, compression, parts[0], path))
+
+    # Keep the entries added by archive-log, which have more information.
+    cataloged = {}
+    for day in days(catalogdir):
+        for entry in read_day(catalogdir, day):
+            cataloged[entry.path] = entry
+
+    entries = list(cataloged.values())
+    entries += [entry for entry in found if entry.path not in cataloged]
+
+    tmpdir = catalogdir + ".tmp"
+    if os.path.isdir(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.makedirs(tmpdir)
+
+    for entry in sorted(entries):
+        _append(tmpdir, entry)
+
+    open(os.path.join(tmpdir, _BuiltMarker), "w").close()
+
+    if os.path.isdir(catalogdir):
+        shutil.rmtree(catalogdir)
+
+    os.rename(tmpdir, catalogdir)
+
+    return len(entries)
+
+# Rewrites the file of one day without the entries of the removed "paths".
+# The remaining lines, including those appended since the entries were
+# read, are written in their order to a temporary file that then replaces
+# the day's file, all while holding the lock so that no appends get lost.
+def _rewrite_day(catalogdir, day, paths):
+    fname = os.path.join(catalogdir, day)
+    tmpname = fname + ".tmp"
+
+    with _locked(catalogdir):
+        with open(fname, "r") as f:
+            with open(tmpname, "w") as out:
+                for line in f:
+                    entry = parse_entry(line)
+                    if entry and entry.path not in paths:
+                        out.write(line)
+
+        os.rename(tmpname, fname)
+
+def _remove(path, logdir):
+    try:
+        os.unlink(path)
+    except OSError:
+        if os.path.lexists(path):
+            return False
+
+    # Remove the archive directory once it's empty.
+    archivedir = os.path.dirname(path)
+    if archivedir != logdir and archivedir.startswith(logdir + os.sep):
+        try:
+            os.rmdir(archivedir)
+        except OSError:
+            pass
+
+    return True
+
+# Removes archived logs that are older than "maxage" seconds, and then, while
+# the total size of the archived logs exceeds "maxsize" bytes, the oldest
+# remaining ones (zero disables either limit).  Logs whose file name matches
+# one of the shell patterns in "keep" are never removed.  The catalog is
+# rebuilt first if it was last built more than RebuildInterval seconds ago.
+# Removals are paced
+# by the optional iothrottle.Throttle.  Returns a tuple (number of files
+# removed, bytes removed).
+def expire(catalogdir, logdir, now, maxage, maxsize, keep, throttle=None):
+    try:
+        built = os.path.getmtime(os.path.join(catalogdir, _BuiltMarker))
+    except OSError:
+        built = None
+
+    if built is None or built < now - RebuildInterval:
+        build(catalogdir, logdir)
+
+    daylist = days(catalogdir)
+    entries = {}
+    total = 0
+
+    if maxsize:
+        for day in daylist:
+            entries[day] = read_day(catalogdir, day)
+            total += sum(entry.size for entry in entries[day])
+
+    removed = 0
+    removedbytes = 0
+
+    for day in daylist:
+        if day not in entries:
+            entries[day] = read_day(catalogdir, day)
+
+        paths = set()
+        done = False
+
+        for entry in entries[day]:
+            if any(fnmatch.fnmatch(os.path.basename(entry.path), pat) for pat in keep):
+                continue
+
+            expired = maxage and entry.time < now - maxage
+            overquota = maxsize and total > maxsize
+
+            if not expired and not overquota:
+                done = True
+                break
+
+            if throttle:
+                throttle.consume(entry.size)
+
+            if _remove(entry.path, logdir):
+                paths.add(entry.path)
+                total -= entry.size
+                removed += 1
+                removedbytes += entry.size
+
+        if paths:
+            _rewrite_day(catalogdir, day, paths)
+
+        if done:
+            break
+
+    # Remove the files of days without any entries left.
+    with _locked(catalogdir):
+        for day in daylist:
+            fname = os.path.join(catalogdir, day)
+            try:
+                if os.path.getsize(fname) == 0 and day != day_of(now):
+                    os.unlink(fname)
+            except OSError:
+                pass
+
+    return (removed, removedbytes)
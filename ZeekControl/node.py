@@ -107,6 +107,16 @@ class Node:
              "lb_procs": 1, "lb_method": 1, "lb_interfaces": 1,
              "pin_cpus": 1, "env_vars": 1, "count": 1}
 
+    # The built-in keys (plus the attributes every node gets) are stored in
+    # slots, which keeps large clusters (thousands of lb_procs workers)
+    # compact.  Keys added by plugins via addKey() end up in the per-instance
+    # __dict__.  As __init__ sets all keys, every node gets a __dict__ as
+    # soon as any plugin has added a key (as the bundled ones do), so this
+    # saves only the space of the built-in keys.
+    __slots__ = ("name", "_config", "addr", "type", "host", "interface",
+                 "aux_scripts", "zeekbase", "ether", "zone_id", "lb_procs",
+                 "lb_method", "lb_interfaces", "pin_cpus", "env_vars", "count",
+                 "__dict__")
 
     def __init__(self, config, name):
         """Instantiates a new node of the given name."""
@@ -114,15 +124,22 @@ class Node:
         self._config = config
 
         for key in Node._keys:
-            self.__dict__[key] = ""
+            setattr(self, key, "")
 
     def __str__(self):
         return self.name
 
+    def _attrnames(self):
+        # Returns a sorted list of the names of all attributes that are
+        # currently set on this node (both slots and plugin-defined keys).
+        names = [key for key in Node.__slots__ if key != "__dict__" and hasattr(self, key)]
+        names += self.__dict__.keys()
+        return sorted(names)
+
     def copy(self):
         n = Node(self._config, self.name)
 
-        for key in self.__dict__:
+        for key in self._attrnames():
             if key.startswith("_"):
                 # This is to avoid copying _config, which causes problems.
                 setattr(n, key, getattr(self, key))
@@ -142,7 +159,7 @@ class Node:
             else:
                 return str(v)
 
-        return [(k, tostr(self.__dict__[k])) for k in sorted(self.__dict__.keys())]
+        return [(k, tostr(getattr(self, k))) for k in self._attrnames()]
 
     @doc.api
     def describe(self):
@@ -159,7 +176,7 @@ class Node:
 
         # Do not output attributes starting with underscore, because they are
         # for internal use and don't provide useful information to the user.
-        return ("%16s - " % self.name) + " ".join(["%s=%s" % (k, fmt(self.__dict__[k])) for k in sorted(self.__dict__.keys()) if not k.startswith("_")])
+        return ("%16s - " % self.name) + " ".join(["%s=%s" % (k, fmt(getattr(self, k))) for k in self._attrnames() if not k.startswith("_")])
 
     def to_dict(self):
         d = dict(self.items())
@@ -31,6 +31,16 @@ options = [
 
     Option("HaveNFS", 0, "bool", Option.USER, False,
            "True if shared files are mounted across all nodes via NFS (see the FAQ_)."),
+    Option("CheckPerNode", 0, "bool", Option.USER, False,
+           "True to check the configuration of each node separately. By default, nodes which differ only in their name and interface are checked only once, unless a site policy script refers to Cluster::node (or Cluster::nodes) or is specific to a node (i.e., has the node's name as its prefix)."),
+    Option("Supervise", 0, "bool", Option.USER, False,
+           "True to run each node under a supervisor process on its host, which restarts the node as soon as it terminates unexpectedly (after creating and mailing a crash report), instead of waiting for the next 'cron' run to notice the crash.  ZeekControl picks up the PID of the restarted node the next time it checks the node's status."),
+    Option("SuperviseMaxDelay", 300, "int", Option.USER, False,
+           "Maximum delay (in seconds) before a supervisor restarts a node (see Supervise).  The delay starts at one second and doubles with each restart, and it is reset once the node has been running for at least this long."),
+    Option("SyncFanout", 0, "int", Option.USER, False,
+           "If larger than zero, install sends files only to this many remote hosts directly, and each host then relays them to up to this many further hosts, one level of this tree after the other (this requires rsync and SSH agent forwarding to work between hosts).  If relaying to a host fails, files are sent to it directly instead.  Zero means all hosts are sent files directly."),
+    Option("InstallGenerationsKeep", 3, "int", Option.USER, False,
+           "Number of install generations (i.e., sets of installed policy scripts created by 'install') to keep, including the active one.  The rollback command switches back to the newest generation that is older than the active one."),
     Option("SaveTraces", 0, "bool", Option.USER, False,
            "True to let backends capture short-term traces via '-w'. These are not archived but might be helpful for debugging."),
 
@@ -50,6 +60,18 @@ options = [
            "Directory for archived log files."),
     Option("MakeArchiveName", "${ZeekBase}/share/zeekctl/scripts/make-archive-name", "string", Option.USER, False,
            "Script to generate filenames for archived log files."),
+    Option("ArchiveIOClass", "", "string", Option.USER, False,
+           "The I/O scheduling class for archiving and expiring log files, set with ionice: 'idle', or 'best-effort' (with the lowest priority).  By default the class is left unchanged."),
+    Option("ArchiveIOMaxUtil", 0, "int", Option.USER, False,
+           "Set to greater than zero to pause archiving and expiring log files while the utilization (in percent, as measured from /proc/diskstats) of the disk holding LogDir is above this value.  A pause lasts at most a minute, so that archiving still makes progress on a disk that stays busy."),
+    Option("ArchiveIORate", 0, "int", Option.USER, False,
+           "Maximum rate (in MB/s) at which archiving reads log files to compress or copy them, and at which expiring removes archived log files (0 means no limit).  The limit applies to each archive-log process, or to the archiver daemon as a whole."),
+    Option("ArchiveNameFunction", "", "string", Option.USER, False,
+           "Python function to generate file names for archived log files in-process, instead of running the MakeArchiveName script, given as '<file>.py:<function>' or '<module>:<function>'.  The function is called with the same arguments as the script (with an empty string if there is no end time), and must return the file name in the same way.  This is most efficient with ArchiverDaemon, which calls the function for each log without starting any process (the daemon must be restarted after changing the function).  See default_archive_name in ZeekControl/archiver.py for an example."),
+    Option("ArchiverDaemon", 0, "bool", Option.USER, False,
+           "True to archive rotated log files with a resident archiver daemon on each logger, manager, or standalone host, instead of running the archive-log script for each log file.  The daemon is started along with the first of those nodes on a host."),
+    Option("ArchiverWorkers", 4, "int", Option.USER, False,
+           "The maximum number of log files that the archiver daemon archives in parallel (takes effect when the daemon is restarted), and that are archived in parallel when a node stops."),
     Option("CompressLogs", 1, "bool", Option.USER, False,
            "True to compress archived log files."),
     Option("CompressLogsInFlight", 0, "int", Option.USER, False,
@@ -59,6 +81,8 @@ options = [
     Option("CompressExtension", "gz", "string", Option.USER, False,
            "If archived logs will be compressed, the file extension to use on compressed log files. When specifying a file extension, don't include the period character (e.g., specify 'gz' instead of '.gz')."),
 
+    Option("CompressThreads", 0, "int", Option.USER, False,
+           "Set to greater than zero to compress archived log files in parallel blocks instead of running CompressCmd.  The value is the maximum number of threads compressing at the same time on each host, shared by all log files being archived.  CompressExtension selects the format, which must be either 'gz' (the blocks are written as concatenated gzip members, which standard tools read as one file) or 'zst' (zstd, which uses the zstandard Python module if available, or the zstd command).  The throughput of each log file compressed is recorded in the compress.log file in StatsDir."),
     Option("SendMail", "@SENDMAIL@", "string", Option.USER, False,
            "Location of the sendmail binary.  Make this string blank to prevent email from being sent. The default value is configuration-dependent and determined automatically by CMake at configure-time. This overrides the Zeek script variable Notice::sendmail."),
     Option("MailSubjectPrefix", "[Zeek]", "string", Option.USER, False,
@@ -77,7 +101,7 @@ options = [
            "The frequency (in seconds) of sending alarm summary mails (zero to disable). This overrides the Zeek script variable Log::default_mail_alarms_interval."),
 
     Option("MailConnectionSummary", 1, "bool", Option.USER, False,
-           "True to mail connection summary reports each log rotation interval (if false, then connection summary reports will still be generated and archived, but they will not be mailed). However, this option has no effect if the trace-summary script is not available."),
+           "True to mail connection summary reports each log rotation interval (if false, then connection summary reports will still be generated and archived, but they will not be mailed). However, this option has no effect if connection summary reports are disabled (see TraceSummary)."),
     Option("MailHostUpDown", 1, "bool", Option.USER, False,
            "True to enable sending mail when zeekctl cron notices the availability of a host in the cluster to have changed."),
     Option("MailArchiveLogFail", 1, "bool", Option.USER, False,
@@ -90,17 +114,21 @@ options = [
     Option("StatsLogEnable", 1, "bool", Option.USER, False,
            "True to enable ZeekControl to write statistics to the stats.log file."),
     Option("StatsLogExpireInterval", 0, "int", Option.USER, False,
-           "Number of days entries in the stats.log file are kept (zero means never expire)."),
+           "Number of days entries in the stats.log file are kept (zero means never expire).  The entries in StatsDir are kept in one file per day, stats.log.YYYY-MM-DD, with stats.log linking to the current one, and a day's file is removed once all of its entries are older than this."),
     Option("CrashExpireInterval", 0, "int", Option.USER, False,
            "Number of days that crash directories are kept (zero means never expire)."),
     Option("LogExpireInterval", "0", "string", Option.USER, False,
-           "Time interval that archived log files are kept (a value of 0 means log files never expire).  The time interval is expressed as an integer followed by one of the following time units: day, hr, min."),
+           "Time interval that archived log files are kept (a value of 0 means log files never expire).  The time interval is expressed as an integer followed by one of the following time units: day, hr, min.  The log files to expire are found in ArchiveCatalogDir, to which archive-log adds the log files it archives, and which is rebuilt from the log directory once a day (so log files archived otherwise are expired as well, but up to a day late)."),
+    Option("LogExpireSize", 0, "int", Option.USER, False,
+           "Maximum total size (in MB) of the archived log files on each host; when it's exceeded, the oldest archived log files are removed first (0 means no limit).  The log files are found in ArchiveCatalogDir, to which archive-log adds the log files it archives, and which is rebuilt from the log directory once a day (so log files archived otherwise count as well, but up to a day late)."),
     Option("KeepLogs", "", "string", Option.USER, False,
            "A space-separated list of filename shell patterns of expired log files to keep (empty string means don't keep any expired log files). The filename shell patterns are not regular expressions and do not include any directories. For example, specifying 'conn.* dns*' will prevent any expired log files with filenames starting with 'conn.' or 'dns' from being removed. Finally, note that this option is ignored if log files never expire."),
     Option("ZeekArgs", "", "string", Option.USER, False,
            'Additional arguments to pass to Zeek on the command-line (e.g. zeekargs=-f "tcp port 80").', "BroArgs"),
     Option("MemLimit", "unlimited", "string", Option.USER, False,
            "Maximum amount of memory for Zeek processes to use (in KB, or the string 'unlimited')."),
+    Option("UseTraceSummary", 0, "bool", Option.USER, False,
+           "True to generate connection summary reports with the trace-summary script (see TraceSummary), which uses sampling on clusters, rather than with ZeekControl's built-in summarizer."),
     Option("Env_Vars", "", "string", Option.USER, False,
            "A comma-separated list of environment variables (e.g. env_vars=VAR1=123, VAR2=456) to set on all nodes immediately before starting Zeek.  Node-specific values (specified in the node configuration file) override these global values."),
 
@@ -121,6 +149,20 @@ options = [
     Option("CronCmd", "", "string", Option.USER, False,
            "A custom command to run everytime the cron command has finished."),
 
+    Option("CronSchedule", "", "string", Option.USER, False,
+           "Space-separated list of entries <task>:<interval>[:<jitter>[:<timeout>]] (in seconds) overriding the default schedule of the tasks run by 'cron --daemon'.  The tasks are watch (30:5:600), check_hosts (60:10:300), log_stats (300:10:300), check_disk_space (300:30:300), update_http_stats (300:30:300), run_cron_cmd (300:0:3600), plugins (300:0:3600), expire_logs (3600:300:3600), and expire_crash (3600:300:600)."),
+
+    Option("ZeekCtldAddress", "127.0.0.1", "string", Option.USER, False,
+           "Address on which zeekctld serves its HTTP API if ZeekCtldPort is set."),
+    Option("ZeekCtldPort", 0, "int", Option.USER, False,
+           "TCP port on which zeekctld serves its HTTP API (0 means zeekctld only listens on its unix socket, which only the user running it can connect to).  Note that the API does not authenticate clients, so anyone who can connect to the port can run any zeekctl command."),
+    Option("ZeekCtldJobs", 1000, "int", Option.USER, False,
+           "Maximum number of job records that zeekctld keeps, including each job's output and result.  When there are more, the records of the oldest finished jobs are removed."),
+    Option("ZeekCtldJobTTL", 3600, "int", Option.USER, False,
+           "Number of seconds for which zeekctld keeps the record of a finished job."),
+    Option("ZeekCtldReadWorkers", 4, "int", Option.USER, False,
+           "Number of read-only commands (such as status) that zeekctld runs at the same time.  Commands that modify the installation always run one after another."),
+
     Option("PFRINGClusterID", 21, "int", Option.USER, False,
            "If PF_RING flow-based load balancing is desired, this is where the PF_RING cluster id is defined.  In order to use PF_RING, the value of this option must be non-zero."),
     Option("PFRINGClusterType", "4-tuple", "string", Option.USER, False,
@@ -159,7 +201,7 @@ options = [
     Option("ScriptsDir", "${ZeekBase}/share/zeekctl/scripts", "string", Option.AUTOMATIC, False,
            "Directory for executable scripts shipping as part of zeekctl."),
     Option("PostProcDir", "${ZeekBase}/share/zeekctl/scripts/postprocessors", "string", Option.AUTOMATIC, False,
-           "Directory for log postprocessors."),
+           "Directory for log postprocessors, which archive-log runs for each rotated log file (see the FAQ_)."),
     Option("HelperDir", "${ZeekBase}/share/zeekctl/scripts/helpers", "string", Option.AUTOMATIC, False,
            "Directory for zeekctl helper scripts."),
     Option("CfgDir", "${ZeekBase}/etc", "string", Option.AUTOMATIC, False,
@@ -184,15 +226,23 @@ options = [
            "Directory for temporary data."),
     Option("TmpExecDir", "${SpoolDir}/tmp", "string", Option.AUTOMATIC, False,
            "Directory where binaries are copied before execution.  This option is ignored if HaveNFS is 0."),
+    Option("ArchiveCatalogDir", "${LogDir}/.archive-catalog", "string", Option.AUTOMATIC, False,
+           "Directory of the catalog of archived log files, which is used to find the log files to expire (see LogExpireInterval and LogExpireSize)."),
+    Option("ArchiverSocket", "${SpoolDir}/archiver.sock", "string", Option.AUTOMATIC, False,
+           "Unix socket on which the archiver daemon accepts the log files to archive."),
     Option("StatsDir", "${LogDir}/stats", "string", Option.AUTOMATIC, False,
            "Directory where statistics are kept."),
+    Option("StatsDBDir", "${StatsDir}/tsdb", "string", Option.AUTOMATIC, False,
+           "Directory of the time-series store that keeps the statistics recorded in StatsLog at several resolutions for the 'stats' command."),
     Option("PluginDir", "${LibDirInternal}/zeekctl/plugins", "string", Option.AUTOMATIC, False,
            "Directory where standard zeekctl plugins are located."),
+    Option("PluginManifest", "${SpoolDir}/plugin-manifest.json", "string", Option.AUTOMATIC, False,
+           "File caching the names, options, node keys, commands, and hooks of all plugins, and which plugins were not activated for the current configuration, so that a plugin is imported only once one of its hooks or commands is needed.  Plugins are expected to return constant values from these methods, and the init() methods of plugins whose pureInit() returns True to depend only on the options and nodes.  Make this string blank to always import all plugins."),
     Option("PluginZeekDir", "${LibDir}/zeek/plugins", "string", Option.AUTOMATIC, False,
            "Directory where Zeek plugins are located.  ZeekControl will search this directory tree for zeekctl plugins that are provided by any Zeek plugin.", "PluginBroDir"),
 
     Option("TraceSummary", "${bindir}/trace-summary", "string", Option.AUTOMATIC, False,
-           "Path to trace-summary script (empty if not available). Make this string blank to disable the connection summary reports."),
+           "Path to trace-summary script (empty if not available), which is used if UseTraceSummary is set. Make this string blank to disable the connection summary reports."),
     Option("CapstatsPath", "${bindir}/capstats", "string", Option.AUTOMATIC, False,
            "Path to capstats binary; empty if not available."),
 
@@ -209,6 +259,8 @@ options = [
            "Log file for debugging information."),
     Option("StatsLog", "${SpoolDir}/stats.log", "string", Option.AUTOMATIC, False,
            "Log file for statistics."),
+    Option("ZeekCtldSocket", "${SpoolDir}/zeekctld.sock", "string", Option.AUTOMATIC, False,
+           "Unix socket on which zeekctld serves its HTTP API."),
     Option("DefaultStoreDir", "${SpoolDir}/stores", "string", Option.AUTOMATIC, False,
            "Default directory where Broker data stores will be written if user has not provided further customizations on a per-store basis."),
 
@@ -223,6 +275,9 @@ options = [
     Option("PolicyDirSiteInstallAuto", "${SpoolDir}/installed-scripts-do-not-touch/auto", "string", Option.AUTOMATIC, False,
            "Directory where the shell copies auto-generated local policy scripts when installing."),
 
+    Option("InstallGenerationsDir", "${SpoolDir}/installed-generations", "string", Option.AUTOMATIC, False,
+           "Directory where each install creates a new generation of the installed policy scripts.  The parent directory of PolicyDirSiteInstall and PolicyDirSiteInstallAuto is a symlink to the active generation."),
+
     # Internal, not documented.
     Option("ZeekCtlConfigDir", "${SpoolDir}", "string", Option.INTERNAL, False,
            """Directory where the shell copies the zeekctl-config.sh
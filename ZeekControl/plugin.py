@@ -361,6 +361,20 @@ class Plugin(object):
         """
         return True
 
+    @doc.api("override")
+    def pureInit(self):
+        """Returns a boolean, indicating whether the result of init() depends
+        only on the ZeekControl options and the nodes, and init() doesn't
+        report anything when it returns ``False``. If so, ZeekControl records
+        in its PluginManifest that init() returned ``False``, and then doesn't
+        import the plugin or call init() again until the configuration
+        changes.
+
+        This method can be overridden by derived classes. The default
+        implementation returns False.
+        """
+        return False
+
     @doc.api("override")
     def done(self):
         """Called once just before ZeekControl terminates. This method can do
@@ -501,6 +515,25 @@ class Plugin(object):
         """
         pass
 
+    @doc.api("override")
+    def cmd_rollback_pre(self):
+        """Called just before the ``rollback`` command is run. Returns a
+        boolean indicating whether or not the command should run.
+
+        This method can be overridden by derived classes. The default
+        implementation does nothing.
+        """
+        return True
+
+    @doc.api("override")
+    def cmd_rollback_post(self):
+        """Called just after the ``rollback`` command has finished.
+
+        This method can be overridden by derived classes. The default
+        implementation does nothing.
+        """
+        pass
+
     @doc.api("override")
     def cmd_cron_pre(self, arg, watch):
         """Called just before the ``cron`` command is run. *arg* is an empty
@@ -754,6 +787,27 @@ class Plugin(object):
         """
         pass
 
+    @doc.api("override")
+    def cmd_stats_pre(self, nodes):
+        """Called just before the ``stats`` command is run. It receives the
+        list of nodes, and returns the list of nodes that should proceed with
+        the command.
+
+        This method can be overridden by derived classes. The default
+        implementation does nothing.
+        """
+        pass
+
+    @doc.api("override")
+    def cmd_stats_post(self, nodes):
+        """Called just after the ``stats`` command has finished. Arguments
+        are as with the ``pre`` method.
+
+        This method can be overridden by derived classes. The default
+        implementation does nothing.
+        """
+        pass
+
     @doc.api("override")
     def cmd_top_pre(self, nodes):
         """Called just before the ``top`` command is run. It receives the list
@@ -3,7 +3,9 @@
 
 import sys
 import os
+import json
 import logging
+import time
 
 from ZeekControl import cmdresult
 from ZeekControl import node
@@ -12,11 +14,60 @@ from ZeekControl import plugin
 # Note, when changing this, also adapt doc string for Plugin.__init__.
 _CurrentAPIVersion = 1
 
+def _hookNames():
+    # All Plugin methods that ZeekControl calls back into.
+    return sorted(m for m in dir(plugin.Plugin)
+                  if m.startswith("cmd_") or m in ("init", "done",
+                        "hostStatusChanged", "zeekProcessDied",
+                        "broProcessDied", "zeekctl_config", "broctl_config"))
+
+def _overriddenHooks(cls):
+    return [m for m in _hookNames()
+            if getattr(cls, m) is not getattr(plugin.Plugin, m)]
+
+class _LazyPlugin(plugin.Plugin):
+    """Stands in for a plugin whose module has not been imported yet.
+
+    Everything ZeekControl needs at startup comes from the plugin manifest.
+    Hooks the plugin does not override fall through to the no-op defaults
+    of the Plugin base class; for all others, the registry imports the
+    real plugin first (see PluginRegistry._resolve).
+    """
+    def __init__(self, path, info):
+        super(_LazyPlugin, self).__init__(info["api"])
+        self._path = path
+        self._info = info
+        self._hooks = set(info["hooks"])
+        self._real = None
+
+    def name(self):
+        return self._info["name"]
+
+    def pluginVersion(self):
+        return self._info["version"]
+
+    def prefix(self):
+        return self._info["prefix"]
+
+    def options(self):
+        return [tuple(opt) for opt in self._info["options"]]
+
+    def commands(self):
+        return [tuple(cmd) for cmd in self._info["commands"]]
+
+    def nodeKeys(self):
+        return list(self._info["nodekeys"])
+
 class PluginRegistry:
-    def __init__(self):
+    def __init__(self, manifest=None):
         self._plugins = []
         self._dirs = []
         self._cmds = {}
+        self._manifestfile = manifest
+        self._manifest = {}
+        self._infos = {}
+        self._cmdout = None
+        self._executor = None
 
     def _activeplugins(self):
         return filter(lambda p: p.activated, self._plugins)
@@ -27,33 +78,75 @@ class PluginRegistry:
             self._dirs += [dir]
 
     def loadPlugins(self, cmdout, executor):
-        """Loads all plugins found in any of the added directories."""
-        self._loadPlugins(cmdout)
+        """Loads all plugins found in any of the added directories.
+
+        If a manifest file was given, plugins whose file is unchanged since
+        it was last imported are not imported again until one of their hooks
+        or commands is actually needed.
+        """
+        start = time.time()
+        self._cmdout = cmdout
+        self._executor = executor
+
+        cached = self._readManifest()
+        self._manifest = {}
+        self._loadPlugins(cmdout, cached)
 
         for p in self._plugins:
             p.executor = executor
 
+        if self._manifestfile and self._manifest != cached:
+            self._writeManifest()
+
+        logging.debug("loaded %d plugins (%d deferred) in %.3f sec",
+                      len(self._plugins),
+                      len([p for p in self._plugins if isinstance(p, _LazyPlugin)]),
+                      time.time() - start)
+
     def initPluginOptions(self):
         """Initialize options for all loaded plugins."""
         for p in self._plugins:
             p._registerOptions()
 
-    def initPlugins(self, cmdout):
-        """Initialize all loaded plugins."""
-        for p in self._plugins:
+    def initPlugins(self, cmdout, configkey=None):
+        """Initialize all loaded plugins.
+
+        If *configkey* identifies the current configuration, the manifest
+        records which plugins' init() returned False for it, and those are
+        then not imported again just to call init() while the configuration
+        and the plugin stay the same.  This applies only to plugins whose
+        pureInit() returns True.
+        """
+        changed = False
+
+        for p in list(self._plugins):
             p.activated = False
+            info = self._infos.get(p)
+
+            if configkey and info and info.get("pureinit") and info.get("inactive") == configkey and isinstance(p, _LazyPlugin):
+                logging.debug("Plugin '%s' not activated because its init() returned False for this configuration before", p.name())
+                continue
 
             try:
-                init = p.init()
+                init = self._method(p, "init")()
             except Exception as err:
                 cmdout.warn("Plugin '%s' not activated because its init() method raised exception: %s" % (p.name(), err))
                 continue
 
+            if info is not None and info.get("pureinit") and configkey:
+                inactive = None if init else configkey
+                if info.get("inactive") != inactive:
+                    info["inactive"] = inactive
+                    changed = True
+
             if not init:
                 logging.debug("Plugin '%s' not activated because its init() returned False", p.name())
                 continue
 
-            p.activated = True
+            self._resolve(p, "init").activated = True
+
+        if changed and self._manifestfile:
+            self._writeManifest()
 
     def initPluginCmds(self):
         """Initialize commands provided by all activated plugins."""
@@ -66,21 +159,21 @@ class PluginRegistry:
     def finishPlugins(self):
         """Shuts all plugins down."""
         for p in self._activeplugins():
-            p.done()
+            self._method(p, "done")()
 
     def hostStatusChanged(self, host, status):
         """Calls all plugins Plugin.hostStatusChanged_ methods; see there for
         parameter semantics."""
         for p in self._activeplugins():
-            p.hostStatusChanged(host, status)
+            self._method(p, "hostStatusChanged")(host, status)
 
     def zeekProcessDied(self, node):
         """Calls all plugins Plugin.zeekProcessDied_ methods; see there for
         parameter semantics."""
         for p in self._activeplugins():
-            p.zeekProcessDied(node)
+            self._method(p, "zeekProcessDied")(node)
              # TODO: Can we recognize when this is in use to warn about deprecation?
-            p.broProcessDied(node)
+            self._method(p, "broProcessDied")(node)
 
     def cmdPreWithNodes(self, cmd, nodes, *args):
         """Executes the ``cmd_<XXX>_pre`` function for a command taking a list
@@ -91,7 +184,7 @@ class PluginRegistry:
         method = "cmd_%s_pre" % cmd
 
         for p in self._activeplugins():
-            func = getattr(p, method)
+            func = self._method(p, method)
             new_nodes = func(nodes, *args)
             if new_nodes is not None:
                 nodes = new_nodes
@@ -107,7 +200,7 @@ class PluginRegistry:
         result = True
 
         for p in self._activeplugins():
-            func = getattr(p, method)
+            func = self._method(p, method)
             if func(*args) == False:
                 result = False
 
@@ -120,7 +213,7 @@ class PluginRegistry:
         method = "cmd_%s_post" % cmd
 
         for p in self._activeplugins():
-            func = getattr(p, method)
+            func = self._method(p, method)
             func(nodes, *args)
 
     def cmdPostWithResults(self, cmd, results, *args):
@@ -131,7 +224,7 @@ class PluginRegistry:
         method = "cmd_%s_post" % cmd
 
         for p in self._activeplugins():
-            func = getattr(p, method)
+            func = self._method(p, method)
             func(results, *args)
 
     def cmdPost(self, cmd, *args):
@@ -141,7 +234,7 @@ class PluginRegistry:
         method = "cmd_%s_post" % cmd
 
         for p in self._activeplugins():
-            func = getattr(p, method)
+            func = self._method(p, method)
             func(*args)
 
     def runCustomCommand(self, cmd, args, cmdout):
@@ -158,7 +251,7 @@ class PluginRegistry:
         if cmd.startswith("%s." % prefix):
             cmd = cmd[len(prefix)+1:]
 
-        return myplugin.cmd_custom(cmd, args, cmdout)
+        return self._method(myplugin, "cmd_custom")(cmd, args, cmdout)
 
     def getZeekctlConfig(self, cmdout):
         """Call the zeekctl_config method on all plugins in case a plugin
@@ -169,10 +262,10 @@ class PluginRegistry:
         extra_code = []
 
         for p in self._activeplugins():
-            if p.broctl_config():
+            if self._method(p, "broctl_config")():
                 cmdout.error("Plugin '%s' uses discontinued method 'broctl_config'; use 'zeekctl_config' instead" % p.name())
 
-            code = p.zeekctl_config()
+            code = self._method(p, "zeekctl_config")()
             if code:
                 # Make sure first character of returned string is a newline
                 extra_code.append("")
@@ -208,7 +301,80 @@ class PluginRegistry:
                 logging.debug("adding node key %s for plugin %s", key, p.name())
                 node.Node.addKey(key)
 
-    def _loadPlugins(self, cmdout):
+    def _method(self, p, method):
+        return getattr(self._resolve(p, method), method)
+
+    def _resolve(self, p, method):
+        # Returns the plugin object to call "method" on, importing a
+        # deferred plugin if it overrides that method.
+        if not isinstance(p, _LazyPlugin) or method not in p._hooks:
+            return p
+
+        if p._real is None:
+            p._real = self._materialize(p)
+
+        return p._real
+
+    def _materialize(self, stub):
+        module = self._importModule(stub._path, self._cmdout)
+        cls = getattr(module, stub._info["class"], None) if module else None
+
+        try:
+            p = cls()
+        except Exception as e:
+            self._cmdout.warn("cannot load deferred plugin %s from %s: %s" % (stub.name(), stub._path, e))
+            # Fall back to the no-op defaults of the stub.
+            stub._hooks = set()
+            return stub
+
+        logging.debug("Imported deferred plugin %s from %s", p.name(), module.__file__)
+
+        p.executor = self._executor
+        p.activated = stub.activated
+        self._infos[p] = self._infos.get(stub)
+
+        self._plugins = [p if i is stub else i for i in self._plugins]
+
+        for cmd, (i, args, descr) in self._cmds.items():
+            if i is stub:
+                self._cmds[cmd] = (p, args, descr)
+
+        return p
+
+    def _readManifest(self):
+        if not self._manifestfile:
+            return {}
+
+        try:
+            with open(self._manifestfile) as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+        # Hooks may be added to the Plugin API by a ZeekControl upgrade,
+        # which the recorded hook sets would not reflect.
+        if not isinstance(manifest, dict) or manifest.get("hooks") != _hookNames():
+            return {}
+
+        return manifest.get("files", {})
+
+    def _writeManifest(self):
+        manifest = {"hooks": _hookNames(), "files": self._manifest}
+        tmpname = "%s.%d.tmp" % (self._manifestfile, os.getpid())
+
+        try:
+            with open(tmpname, "w") as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+            os.rename(tmpname, self._manifestfile)
+        except (IOError, OSError, TypeError, ValueError) as err:
+            # Not fatal, plugins are just imported again next time.
+            logging.debug("cannot write plugin manifest %s: %s", self._manifestfile, err)
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
+
+    def _loadPlugins(self, cmdout, cached):
         # Don't visit the same dir twice (this also prevents infinite
         # recursion when following symlinks).
         visited_dirs = set()
@@ -231,20 +397,53 @@ class PluginRegistry:
 
                 for name in files:
                     if name.endswith(".py") and not name.startswith("__"):
-                        self._importPlugin(os.path.join(root, name[:-3]), cmdout)
+                        self._loadPlugin(os.path.join(root, name[:-3]), cmdout, cached)
 
-    def _importPlugin(self, path, cmdout):
+    def _loadPlugin(self, path, cmdout, cached):
+        try:
+            stat = os.stat(path + ".py")
+        except OSError:
+            stat = None
+
+        entry = cached.get(path)
+
+        if stat and entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            for info in entry["plugins"]:
+                stub = _LazyPlugin(path, info)
+                self._infos[stub] = info
+                self._addPlugin(stub, cmdout)
+
+            self._manifest[path] = entry
+            return
+
+        infos = self._importPlugin(path, cmdout)
+
+        # Only cache files that loaded without any warnings, so that these
+        # are repeated until the plugin is fixed.
+        if stat and infos is not None:
+            self._manifest[path] = {"mtime": stat.st_mtime, "size": stat.st_size,
+                                    "plugins": infos}
+
+    def _importModule(self, path, cmdout):
         sys.path = [os.path.dirname(path)] + sys.path
 
         try:
-            module = __import__(os.path.basename(path))
+            return __import__(os.path.basename(path))
         except Exception as e:
             cmdout.warn("cannot import plugin %s: %s" % (path, e))
-            return
+            return None
         finally:
             sys.path = sys.path[1:]
 
+    def _importPlugin(self, path, cmdout):
+        # Returns the manifest entries for the plugins found in the module at
+        # "path", or None if the module cannot be cached.
+        module = self._importModule(path, cmdout)
+        if not module:
+            return None
+
         found = False
+        infos = []
 
         for cls in module.__dict__.values():
             try:
@@ -260,7 +459,7 @@ class PluginRegistry:
                     p = cls()
                 except Exception as e:
                     cmdout.warn("plugin class %s __init__ failed: %s" % (cls.__name__, e))
-                    break
+                    return None
 
                 # verify that the plugin overrides all required methods
                 try:
@@ -268,37 +467,64 @@ class PluginRegistry:
                                p.name(), module.__file__, p.pluginVersion(), p.prefix())
                 except NotImplementedError:
                     cmdout.warn("failed to load plugin at %s because it doesn't override required methods" % path)
+                    infos = None
                     continue
 
                 if p.apiVersion() != _CurrentAPIVersion:
                     cmdout.warn("failed to load plugin %s due to incompatible API version (uses %d, but current is %s)"
                                   % (p.name(), p.apiVersion(), _CurrentAPIVersion))
+                    infos = None
                     continue
 
-                if not p.prefix():
-                    cmdout.warn("failed to load plugin %s because prefix is empty" % p.name())
-
-                if "." in p.prefix() or " " in p.prefix():
-                    cmdout.warn("failed to load plugin %s because prefix contains dots or spaces" % p.name())
-
-                # Need to convert prefix to lowercase here, because a plugin
-                # can override the prefix() method and might not return a
-                # lowercase string.  Also, we don't allow two plugins to have
-                # prefixes that differ only by case (due to the fact that
-                # plugin option names include the prefix and are converted
-                # to lowercase).
-                pluginprefix = p.prefix().lower()
-
-                sameprefix = False
-                for i in self._plugins:
-                    if pluginprefix == i.prefix().lower():
-                        sameprefix = True
-                        cmdout.warn("failed to load plugin %s (prefix %s) due to plugin %s (prefix %s) having the same prefix" % (p.name(), p.prefix(), i.name(), i.prefix()))
-                        break
+                if not self._addPlugin(p, cmdout):
+                    infos = None
+                    continue
 
-                if not sameprefix:
-                    self._plugins += [p]
+                if infos is not None:
+                    info = {"class": cls.__name__,
+                            "name": p.name(),
+                            "version": p.pluginVersion(),
+                            "api": p.apiVersion(),
+                            "prefix": p.prefix(),
+                            "options": p.options(),
+                            "commands": p.commands(),
+                            "nodekeys": p.nodeKeys(),
+                            "pureinit": p.pureInit(),
+                            "hooks": _overriddenHooks(cls)}
+                    self._infos[p] = info
+                    infos.append(info)
 
         if not found:
             cmdout.warn("no plugin found in %s" % module.__file__)
-
+            return None
+
+        return infos
+
+    def _addPlugin(self, p, cmdout):
+        # Returns True if the plugin was added to the registry without any
+        # warnings (only then may it be cached in the manifest).
+        ok = True
+
+        if not p.prefix():
+            cmdout.warn("failed to load plugin %s because prefix is empty" % p.name())
+            ok = False
+
+        if "." in p.prefix() or " " in p.prefix():
+            cmdout.warn("failed to load plugin %s because prefix contains dots or spaces" % p.name())
+            ok = False
+
+        # Need to convert prefix to lowercase here, because a plugin
+        # can override the prefix() method and might not return a
+        # lowercase string.  Also, we don't allow two plugins to have
+        # prefixes that differ only by case (due to the fact that
+        # plugin option names include the prefix and are converted
+        # to lowercase).
+        pluginprefix = p.prefix().lower()
+
+        for i in self._plugins:
+            if pluginprefix == i.prefix().lower():
+                cmdout.warn("failed to load plugin %s (prefix %s) due to plugin %s (prefix %s) having the same prefix" % (p.name(), p.prefix(), i.name(), i.prefix()))
+                return False
+
+        self._plugins += [p]
+        return ok
@@ -134,6 +134,13 @@ class TestPlugin(ZeekControl.plugin.Plugin):
     def cmd_install_post(self):
         self.message("TestPlugin: Test post 'install'")
 
+    def cmd_rollback_pre(self):
+        self.message("TestPlugin: Test pre 'rollback'")
+        return True
+
+    def cmd_rollback_post(self):
+        self.message("TestPlugin: Test post 'rollback'")
+
     def cmd_cron_pre(self, arg, watch):
         self.message("TestPlugin: Test pre 'cron':  %s/%s" % (arg, watch))
         return True
@@ -195,6 +202,12 @@ class TestPlugin(ZeekControl.plugin.Plugin):
     def cmd_netstats_post(self, nodes):
         self.message("TestPlugin: Test post 'netstats': %s" % self._nodes(nodes))
 
+    def cmd_stats_pre(self, nodes):
+        self.message("TestPlugin: Test pre 'stats':  %s" % self._nodes(nodes))
+
+    def cmd_stats_post(self, nodes):
+        self.message("TestPlugin: Test post 'stats': %s" % self._nodes(nodes))
+
     def cmd_top_pre(self, nodes):
         self.message("TestPlugin: Test pre 'top':  %s" % self._nodes(nodes))
 
@@ -31,6 +31,9 @@ class LBCustom(ZeekControl.plugin.Plugin):
 
         return useplugin
 
+    def pureInit(self):
+        return True
+
     def options(self):
         custom_options = [
           ("InterfacePrefix", "string", "", "Prefix to prepend to the configured interface name."),
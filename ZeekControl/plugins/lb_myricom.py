@@ -29,3 +29,6 @@ class LBMyricom(ZeekControl.plugin.Plugin):
 
         return useplugin
 
+    def pureInit(self):
+        return True
+
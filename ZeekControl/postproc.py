@@ -0,0 +1,209 @@
+# The pipeline of log postprocessors that archive-log runs for each rotated
+# log (the scripts in PostProcDir).
+#
+# A postprocessor can declare in comment lines near the top of the script
+# how it is to be run:
+#
+#   # postprocessor-streams: conn dns
+#   # postprocessor-stage: after-move
+#   # postprocessor-concurrency: 1
+#   # postprocessor-after: other-postprocessor
+#
+#   streams:      the log streams (base names) it processes; it's not run for
+#                 others (default: all streams).
+#   stage:        "before-move" to run while the rotated log is still in the
+#                 node's directory, before it's archived (the default), or
+#                 "after-move" to run once the log has been archived, without
+#                 delaying that.  An after-move postprocessor gets the path of
+#                 the archived log instead of the rotated file name as its
+#                 first argument.
+#   concurrency:  how many instances may run at the same time on a host, for
+#                 all logs being archived (default: 0, no limit).
+#   after:        postprocessors of the same stage that must finish first.
+#
+# The postprocessors of a stage run in parallel, except as ordered by
+# "after".  Those without any declaration run one after another in order of
+# their names, as they always did.
+#
+# The run time of each postprocessor is recorded in the stats log of the host
+# where zeekctl runs, see log_timing().
+
+from __future__ import print_function
+import os
+import sys
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from ZeekControl import compress
+
+BeforeMove = "before-move"
+AfterMove = "after-move"
+
+# Only this much of the start of a script is searched for declarations.
+_HeaderSize = 4096
+
+_Prefix = "postprocessor-"
+
+class PostprocessorError(Exception):
+    pass
+
+class Postprocessor:
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.declared = False
+        self.streams = None
+        self.stage = BeforeMove
+        self.concurrency = 0
+        self.after = []
+
+    # Parses the declarations in the script's header.  Raises
+    # PostprocessorError if one is invalid.
+    def parse(self):
+        with open(self.path, "rb") as f:
+            header = f.read(_HeaderSize).decode("utf-8", "replace")
+
+        for line in header.splitlines():
+            line = line.strip()
+            if not line.startswith("#"):
+                continue
+
+            (key, sep, val) = line.lstrip("# \t").partition(":")
+            if not sep or not key.startswith(_Prefix):
+                continue
+
+            key = key[len(_Prefix):]
+            vals = val.replace(",", " ").split()
+            self.declared = True
+
+            if key == "streams":
+                self.streams = None if "*" in vals else vals
+            elif key == "stage":
+                if vals not in ([BeforeMove], [AfterMove]):
+                    raise PostprocessorError("%s: invalid stage: %s" % (self.name, val.strip()))
+                self.stage = vals[0]
+            elif key == "concurrency":
+                try:
+                    self.concurrency = int(val)
+                except ValueError:
+                    raise PostprocessorError("%s: invalid concurrency: %s" % (self.name, val.strip()))
+                if self.concurrency < 0:
+                    raise PostprocessorError("%s: invalid concurrency: %s" % (self.name, val.strip()))
+            elif key == "after":
+                self.after = vals
+            else:
+                raise PostprocessorError("%s: unknown declaration: %s%s" % (self.name, _Prefix, key))
+
+    def handles(self, stream):
+        return self.streams is None or stream in self.streams
+
+# Returns the postprocessors in "postprocdir", in order of their names.  A
+# postprocessor with an invalid declaration is reported on stderr and run as
+# one without declarations.
+def load(postprocdir):
+    pps = []
+
+    if not postprocdir or not os.path.isdir(postprocdir):
+        return pps
+
+    for name in sorted(os.listdir(postprocdir)):
+        if name.startswith("."):
+            continue
+
+        pp = Postprocessor(os.path.join(postprocdir, name))
+        try:
+            pp.parse()
+        except PostprocessorError as err:
+            print("postprocessors: %s" % err, file=sys.stderr)
+            pp = Postprocessor(pp.path)
+        except (IOError, OSError):
+            pass
+
+        pps.append(pp)
+
+    # Undeclared postprocessors keep running sequentially.
+    prev = None
+    for pp in pps:
+        if not pp.declared:
+            if prev:
+                pp.after = [prev.name]
+            prev = pp
+
+    return pps
+
+def _run_one(pp, args, lockdir, preexec_fn):
+    slots = None
+    if pp.concurrency > 0 and lockdir:
+        slots = compress.Slots(lockdir, pp.concurrency, "postproc-%s" % pp.name)
+        fd = slots.acquire()
+
+    try:
+        start = time.time()
+        rc = subprocess.call(["nice", pp.path] + list(args), preexec_fn=preexec_fn)
+        return (pp.name, rc, time.time() - start)
+    finally:
+        if slots:
+            slots.release(fd)
+
+# Runs the postprocessors of "pps" that belong to "stage" and handle the log
+# stream of "args" (the arguments of archive-log, with the path of the
+# archived log first for the after-move stage).  "lockdir" is the directory
+# for the concurrency slots, and "preexec_fn" is passed on to subprocess.
+# Returns a list of (name, exit code, seconds), in order of completion.
+def run(pps, stage, args, lockdir=None, preexec_fn=None):
+    todo = dict((pp.name, pp) for pp in pps if pp.stage == stage and pp.handles(args[1]))
+
+    # Others that a postprocessor is to run after have either run already in
+    # the other stage, or don't handle this stream.
+    deps = dict((name, set(pp.after) & set(todo)) for (name, pp) in todo.items())
+
+    results = []
+    if not todo:
+        return results
+
+    done = set()
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=len(todo)) as pool:
+        while todo or running:
+            ready = sorted(name for name in todo if deps[name] <= done)
+
+            if not ready and not running:
+                # A dependency cycle; break it in order of names.
+                name = sorted(todo)[0]
+                print("postprocessors: dependency cycle, running %s first" % name, file=sys.stderr)
+                ready = [name]
+
+            for name in ready:
+                running[pool.submit(_run_one, todo.pop(name), args, lockdir, preexec_fn)] = name
+
+            (finished, _) = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                done.add(running.pop(future))
+                results.append(future.result())
+
+    return results
+
+# Returns True if the run times of postprocessors are to be recorded in the
+# stats log on this host.  Only on the host where zeekctl runs does "zeekctl
+# cron" rotate that file and read it; on other hosts (such as one running just
+# a logger) it would only grow.  That host is recognized by zeekctl's state
+# file, which is not copied to the other hosts.
+def timing_enabled(cfg):
+    if cfg.get("statslogenable") != "1" or not cfg.get("statslog"):
+        return False
+
+    return os.path.exists(cfg.get("statefile", ""))
+
+# Appends the results of run() to the stats log, one line per postprocessor
+# in the same format as the other entries:
+#
+#   <time> <node> postprocessor <name> <seconds>
+def log_timing(statslog, node, results):
+    t = time.time()
+
+    with open(statslog, "a") as out:
+        for (name, rc, secs) in results:
+            out.write("%s %s postprocessor %s %.3f\n" % (t, node, name, secs))
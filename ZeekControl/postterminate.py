@@ -0,0 +1,246 @@
+# Archiving of the logs left in a node's working directory after Zeek
+# terminates (used by post-terminate via the archive-remaining script).
+#
+# Before archiving the remaining logs, we wait for the logs that are still
+# being archived: archive-log (and the archiver daemon) keep a file
+# ".archive-log.*.tmp" containing the PID of the archiving process in the
+# directory until they're done.  Rather than polling, we wait for those files
+# to be removed with inotify, and for the processes to exit with pidfds (as
+# a process that was killed cannot remove its file), where available.
+
+from __future__ import print_function
+import os
+import re
+import errno
+import select
+import ctypes
+import ctypes.util
+import fnmatch
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# How long to wait between checks if inotify is available (just as a safety
+# net), or if not.
+_NotifyTimeout = 5.0
+_PollTimeout = 0.25
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_RotatedPattern = re.compile(r"^(.+)[.]([1-2][0-9]{3})-([0-1][0-9])-([0-3][0-9])-([0-2][0-9])-([0-5][0-9])-([0-5][0-9])$")
+_ZeekRotatedPattern = re.compile(r"^(.+)-([0-9]{2}-[0-1][0-9]-[0-3][0-9]_[0-2][0-9][.][0-5][0-9][.][0-5][0-9])$")
+
+# Watches a directory for changes with inotify.  "fd" is None if inotify is
+# not available.
+class _Watch:
+    def __init__(self, path):
+        self.fd = None
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+
+        if fd < 0:
+            return
+
+        mask = _IN_CREATE | _IN_DELETE | _IN_MOVED_FROM | _IN_MODIFY | _IN_CLOSE_WRITE
+        if libc.inotify_add_watch(fd, path.encode(), mask) < 0:
+            os.close(fd)
+            return
+
+        self.fd = fd
+
+    def drain(self):
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except OSError as err:
+            if err.errno != errno.EAGAIN:
+                raise
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+# Returns the names of the archive-log PID files in "path".
+def pending(path):
+    return sorted(f for f in os.listdir(path) if fnmatch.fnmatch(f, ".archive-log.*.tmp"))
+
+def _read_pid(fname):
+    try:
+        with open(fname, "r") as f:
+            return int(f.read().strip())
+    except (IOError, OSError, ValueError):
+        return None
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno == errno.EPERM
+
+    return True
+
+def _pidfd(pid):
+    if not hasattr(os, "pidfd_open"):
+        return None
+
+    try:
+        return os.pidfd_open(pid)
+    except OSError:
+        return None
+
+# Waits until all logs in "path" that are being archived are done.
+def wait_for_archivelog(path):
+    watch = _Watch(path)
+
+    try:
+        while True:
+            files = pending(path)
+            if not files:
+                return
+
+            pidfiles = {}
+            for f in files:
+                pid = _read_pid(os.path.join(path, f))
+
+                # If the PID file is empty, then check it again later.
+                if pid is None:
+                    continue
+
+                pidfiles.setdefault(pid, []).append(f)
+
+            pidfds = {}
+            for pid in pidfiles:
+                fd = _pidfd(pid)
+                if fd is not None:
+                    pidfds[fd] = pid
+
+            try:
+                poller = select.poll()
+                for fd in pidfds:
+                    poller.register(fd, select.POLLIN)
+
+                if watch.fd is not None:
+                    poller.register(watch.fd, select.POLLIN)
+
+                # A pidfd becomes readable when the process exits (or if it
+                # has exited already).
+                exited = set(pidfds[fd] for (fd, _) in poller.poll(0) if fd in pidfds)
+
+                if not exited:
+                    timeout = _NotifyTimeout if watch.fd is not None else _PollTimeout
+                    events = poller.poll(timeout * 1000)
+                    exited = set(pidfds[fd] for (fd, _) in events if fd in pidfds)
+
+                    if watch.fd is not None:
+                        watch.drain()
+
+                # Without a pidfd, check whether the process still exists.
+                exited |= set(pid for pid in pidfiles if pid not in pidfds.values() and not _alive(pid))
+            finally:
+                for fd in pidfds:
+                    os.close(fd)
+
+            # Remove the PID files of processes that exited without doing so.
+            for pid in exited:
+                for f in pidfiles[pid]:
+                    try:
+                        os.unlink(os.path.join(path, f))
+                    except OSError:
+                        pass
+    finally:
+        watch.close()
+
+# Returns the base name and start time (in the format YY-MM-DD_HH.MM.SS, or
+# None if unknown) of a log from the name of the file without extension.
+# Rotated logs that were not archived have a timestamp in their name.
+def parse_filename(name):
+    # Suffix ".YYYY-MM-DD-HH-MM-SS" (this format is specified in
+    # Log::default_rotation_date_format and is used by the ascii writer script
+    # to rename a log immediately after Zeek rotates it).
+    m = _RotatedPattern.match(name)
+    if m:
+        return (m.group(1), "%s-%s-%s_%s.%s.%s" % ((m.group(2)[2:],) + m.groups()[2:]))
+
+    # Suffix "-YY-MM-DD_HH.MM.SS" (this format is hard-coded in Zeek, and is
+    # the format used by Zeek when a log is rotated).
+    m = _ZeekRotatedPattern.match(name)
+    if m:
+        return (m.group(1), m.group(2))
+
+    return (name, None)
+
+def _first_line(fname, last=False):
+    try:
+        with open(fname, "r") as f:
+            lines = f.read().splitlines()
+    except IOError:
+        return None
+
+    if not lines:
+        return None
+
+    return lines[-1] if last else lines[0]
+
+# Returns the archive-log arguments for each log remaining in "path", which
+# Zeek stopped writing at "end" (in the format YY-MM-DD_HH.MM.SS).
+def remaining_logs(path, end):
+    startuptime = _first_line(os.path.join(path, ".startup"), last=True)
+    jobs = []
+
+    # Although stdout.log/stderr.log are not really Zeek logs, we archive
+    # them anyway, because they might contain useful info, especially if Zeek
+    # crashes.
+    for logname in sorted(os.listdir(path)):
+        if not logname.endswith(".log") or logname.startswith("."):
+            continue
+
+        (base, start) = parse_filename(logname[:-4])
+
+        if not start:
+            start = startuptime
+
+            # The time of the last rotation is always >= the startup time of
+            # Zeek, so it's usually a more accurate guess of this log's start
+            # time.  However, if archive-log archived a log with the same base
+            # name after post-terminate started, then it's later than the end
+            # time.
+            rotated = _first_line(os.path.join(path, ".rotated.%s" % base))
+            if rotated:
+                start = min(rotated, end)
+
+        if not start:
+            start = end
+
+        # Note: here we assume the log writer type is "ascii".
+        jobs.append([logname, base, start, end, "1", "ascii"])
+
+    return jobs
+
+# Archives the logs remaining in "path" with archive-log, running up to
+# "workers" at a time.  Returns True if all logs were archived.
+def archive_remaining(path, scriptsdir, end, workers):
+    archivelog = os.path.join(scriptsdir, "archive-log")
+
+    # Archive the logs right here, even if the archiver daemon is enabled, so
+    # that we know when they're done and whether that succeeded.
+    env = dict(os.environ, ARCHIVE_LOG_DIRECT="1")
+
+    def archive(args):
+        return subprocess.call([archivelog] + args, cwd=path, env=env) == 0
+
+    jobs = remaining_logs(path, end)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(archive, jobs))
+
+    return all(results)
@@ -9,7 +9,7 @@ class MyJsonEncoder(json.JSONEncoder):
             return obj.to_dict()
         if isinstance(obj, cmdresult.CmdResult):
             return obj.to_dict()
-        return json.JSONEncoder.default(self, obj)
+        return str(obj)
 
 def dumps(obj):
     return json.dumps(obj, cls=MyJsonEncoder)
@@ -8,7 +8,7 @@ import os
 import base64
 import zlib
 import logging
-from threading import Thread
+from threading import Thread, RLock
 from queue import Queue, Empty
 
 
@@ -287,29 +287,34 @@ class HostHandler(Thread):
         self.q.put((commands, shell, rq))
 
 
+# Commands may be sent from several threads at the same time (as zeekctld
+# does); each batch of commands gets its own response queue, and a host's
+# handler runs the batches one after another.
 class MultiMasterManager:
     def __init__(self, localaddrs=[]):
         self.masters = {}
-        self.response_queues = {}
         self.localaddrs = localaddrs
+        self.mutex = RLock()
 
     def setup(self, host, timeout):
-        if host not in self.masters:
-            self.masters[host] = HostHandler(host, self.localaddrs, timeout)
-            self.masters[host].start()
+        with self.mutex:
+            if host not in self.masters:
+                self.masters[host] = HostHandler(host, self.localaddrs, timeout)
+                self.masters[host].start()
 
+            return self.masters[host]
+
+    # Returns the queue that will receive the results.
     def send_commands(self, host, commands, timeout, shell=False):
-        self.setup(host, timeout)
         rq = Queue()
-        self.response_queues[host] = rq
-        self.masters[host].send_commands(commands, shell, rq)
+        self.setup(host, timeout).send_commands(commands, shell, rq)
+        return rq
 
-    def get_result(self, host, hosttimeout):
+    def get_result(self, host, rq, hosttimeout):
         # Add a few seconds to the host timeout in order to let the
         # command timeout happen first.
         hosttimeout += 5
 
-        rq = self.response_queues[host]
         try:
             return rq.get(timeout=hosttimeout)
         except Empty:
@@ -322,34 +327,38 @@ class MultiMasterManager:
         return self.exec_commands(host, [command], timeout)[0]
 
     def exec_commands(self, host, commands, timeout=60):
-        self.send_commands(host, commands, timeout)
-        return self.get_result(host, timeout)
+        rq = self.send_commands(host, commands, timeout)
+        return self.get_result(host, rq, timeout)
 
     def exec_multihost_commands(self, cmds, shell=False, timeout=60):
         hosts = collections.defaultdict(list)
         for host, cmd in cmds:
             hosts[host].append(cmd)
 
+        rqs = []
         for host, cmds in hosts.items():
-            self.send_commands(host, cmds, timeout, shell)
+            rqs.append((host, self.send_commands(host, cmds, timeout, shell)))
 
-        for host in hosts:
-            for res in self.get_result(host, timeout):
+        for host, rq in rqs:
+            for res in self.get_result(host, rq, timeout):
                 yield host, res
 
     def host_status(self):
-        for h, o in self.masters.items():
+        for h, o in list(self.masters.items()):
             if h not in self.localaddrs:
                 yield h, o.alive
 
     def shutdown(self, host):
-        self.masters[host].shutdown()
-        del self.masters[host]
+        with self.mutex:
+            handler = self.masters.pop(host, None)
+            if handler:
+                handler.shutdown()
 
     def shutdown_all(self):
-        for handler in self.masters.values():
-            handler.shutdown()
-        self.masters = {}
+        with self.mutex:
+            for handler in self.masters.values():
+                handler.shutdown()
+            self.masters = {}
 
     __del__ = shutdown_all
 
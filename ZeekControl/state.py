@@ -1,14 +1,18 @@
 import json
 import sqlite3
+import threading
 
 from ZeekControl.exceptions import RuntimeEnvironmentError
 
+# The database connection may be shared by several threads (zeekctld runs
+# read-only commands concurrently), so all access goes through a mutex.
 class SqliteState:
     def __init__(self, path):
         self.path = path
+        self.mutex = threading.Lock()
 
         try:
-            self.db = sqlite3.connect(self.path)
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
         except sqlite3.Error as err:
             raise RuntimeEnvironmentError("%s: %s\nCheck if the user running ZeekControl has both write and search permission to\nthe directory containing the database file and has both read and write\npermission to the database file itself." % (err, path))
 
@@ -29,21 +33,25 @@ class SqliteState:
         self.db.commit()
 
     def get(self, key):
-        self.c.execute("SELECT value FROM state WHERE key=?", [key])
-        records = self.c.fetchall()
+        with self.mutex:
+            self.c.execute("SELECT value FROM state WHERE key=?", [key])
+            records = self.c.fetchall()
         if records:
             return json.loads(records[0][0])
         return None
 
     def set(self, key, value):
         value = json.dumps(value)
-        try:
-            self.c.execute("REPLACE INTO state (key, value) VALUES (?,?)", [key, value])
-        except sqlite3.Error as err:
-            raise RuntimeEnvironmentError("%s: %s\nCheck if the user running ZeekControl has write access to the database file." % (err, self.path))
+        with self.mutex:
+            try:
+                self.c.execute("REPLACE INTO state (key, value) VALUES (?,?)", [key, value])
+            except sqlite3.Error as err:
+                raise RuntimeEnvironmentError("%s: %s\nCheck if the user running ZeekControl has write access to the database file." % (err, self.path))
 
-        self.db.commit()
+            self.db.commit()
 
     def items(self):
-        self.c.execute("SELECT key, value FROM state")
-        return [(k, json.loads(v)) for (k, v) in self.c.fetchall()]
+        with self.mutex:
+            self.c.execute("SELECT key, value FROM state")
+            records = self.c.fetchall()
+        return [(k, json.loads(v)) for (k, v) in records]
@@ -1,45 +1,70 @@
-#!/usr/bin/env python3
+#! /usr/bin/env python3
+#
+# A command-line client of the zeekctld API, for testing.
+#
+# test_cli.py [-a <address>] <method> [<arg> ...]   Runs a method and streams its output.
+# test_cli.py [-a <address>] bg <method> [<arg> ...]  Starts a job and prints its ID.
+# test_cli.py [-a <address>] log <id>               Streams the output of a job.
+# test_cli.py [-a <address>] get <path>             Prints the response to a GET request.
+#
+# <address> is the path of zeekctld's unix socket (the default is zeekctld.sock
+# in the current directory), or <host>:<port>.  Arguments are parsed as JSON
+# if possible, and passed as strings otherwise.
+
+from __future__ import print_function
 import sys
-import requests
-import time
-import pprint
 import json
+import getopt
+
+from ZeekControl.zeekctld import Client
+from ZeekControl.exceptions import ZeekControlError
 
-def log(id, last):
-    res = requests.get("http://localhost:8082/log/%d/%d" % (id, last)).json()
-    if not res['log']:
-        sys.stdout.write("waiting...\r")
-        sys.stdout.flush()
-        return last
-
-    for rec in res['log']:
-        print ' '.join(rec), '                '
-    return last+len(res['log'])
-
-def wait(id):
-    print "Waiting for job %d to finish" % id
-    last = 0
-    while True:
-        res = requests.get("http://localhost:8082/result/%d" % id).json()
-        last = log(id, last)
-        if res['result'] is not None:
-            return json.loads(res['result'])
-        time.sleep(.2)
-
-
-def run(action):
-    res = requests.get("http://localhost:8082/%s" % action).json()
-    print(wait(res['id']))
-
-def call(action):
-    out = requests.get("http://localhost:8082/%s" % action).text
+def output(stream, text):
+    print(text, file=sys.stderr if stream == "error" else sys.stdout)
+
+def parse_arg(arg):
     try:
-        return json.loads(out)
-    except:
-        return out
+        return json.loads(arg)
+    except ValueError:
+        return arg
 
-if __name__ == "__main__":
-    if sys.argv[1] == 'bg':
-        print call(sys.argv[2])
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], "a:")
+    opts = dict(opts)
+
+    if not args:
+        print("usage: %s [-a <address>] [bg|log|get] <method>|<id>|<path> [<arg> ...]" % sys.argv[0], file=sys.stderr)
+        return 1
+
+    client = Client(opts.get("-a", "zeekctld.sock"))
+
+    try:
+        if args[0] == "bg":
+            print(client.submit(args[1], [parse_arg(a) for a in args[2:]]))
+            return 0
+
+        if args[0] == "get":
+            print(json.dumps(client.get(args[1]), indent=4))
+            return 0
+
+        if args[0] == "log":
+            outcome = client.follow(int(args[1]), output)
+        else:
+            outcome = client.call(args[0], [parse_arg(a) for a in args[1:]], output=output)
+
+    except (ZeekControlError, IOError, OSError) as err:
+        print("Error: %s" % err, file=sys.stderr)
+        return 1
+
+    finally:
+        client.close()
+
+    if outcome["error"]:
+        print("Error: %s" % outcome["error"], file=sys.stderr)
     else:
-        run(sys.argv[1])
+        print(json.dumps(outcome["result"], indent=4))
+
+    return 0 if outcome["state"] == "done" else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
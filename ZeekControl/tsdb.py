@@ -0,0 +1,229 @@
+# A time-series store for the statistics that "cron" records in stats.log.
+#
+# For each node and metric (such as "parent-cpu" or "interface-mbps"), values
+# are kept at three resolutions: the raw samples, and rollups into 5-minute
+# and hourly buckets.  Each resolution is split into segment files that
+# cover a fixed span of time, so that a time range maps directly to a small
+# set of files, and expiring old data just removes whole files.  All records
+# in a file have the same size: raw records are (time, value), rollup
+# records are (bucket start, count, sum, min, max).  New samples are appended
+# to the raw segment, and update the last record of each rollup segment in
+# place (or append a new record when a new bucket begins).
+
+import os
+import struct
+
+# The resolutions as (name, bucket width, segment span, retention), with times
+# in seconds.  A bucket width of zero means raw samples, and a retention of
+# zero means that the data is never expired.
+Resolutions = [
+    ("raw", 0, 86400, 7 * 86400),
+    ("5m", 300, 30 * 86400, 180 * 86400),
+    ("1h", 3600, 366 * 86400, 0),
+]
+
+Aggregates = ("avg", "min", "max", "sum", "count", "last")
+
+_RawRecord = struct.Struct("<dd")
+_RollupRecord = struct.Struct("<ddddd")
+
+def resolution_names():
+    return [res[0] for res in Resolutions]
+
+# Returns the coarsest resolution that still has a reasonable number of
+# records for the given time range.
+def choose_resolution(start, end):
+    if end - start <= 86400:
+        return "raw"
+    if end - start <= 30 * 86400:
+        return "5m"
+    return "1h"
+
+# Aggregates a list of (time, count, sum, min, max) records, as returned by
+# TimeSeriesDB.query(), into a dictionary with one entry per aggregate
+# function.  Returns None if the list is empty.
+def aggregate(records):
+    if not records:
+        return None
+
+    count = sum(rec[1] for rec in records)
+    total = sum(rec[2] for rec in records)
+    last = records[-1]
+
+    return {
+        "avg": total / count,
+        "min": min(rec[3] for rec in records),
+        "max": max(rec[4] for rec in records),
+        "sum": total,
+        "count": int(count),
+        "last": last[2] / last[1],
+    }
+
+class TimeSeriesDB:
+    def __init__(self, path):
+        self.path = path
+
+    def _dir(self, node, metric):
+        return os.path.join(self.path, node, metric)
+
+    def _segment(self, node, metric, res, t):
+        span = res[2]
+        return os.path.join(self._dir(node, metric), "%s-%d.dat" % (res[0], int(t // span)))
+
+    # Returns a list of (segment number, file name) of all segments of a
+    # resolution for the given node and metric, in time order.
+    def _segments(self, node, metric, resname):
+        try:
+            files = os.listdir(self._dir(node, metric))
+        except OSError:
+            return []
+
+        segments = []
+        for fname in files:
+            name, _, rest = fname.partition("-")
+            if name != resname or not rest.endswith(".dat"):
+                continue
+
+            try:
+                segments.append((int(rest[:-4]), os.path.join(self._dir(node, metric), fname)))
+            except ValueError:
+                continue
+
+        return sorted(segments)
+
+    def nodes(self):
+        try:
+            return sorted(os.listdir(self.path))
+        except OSError:
+            return []
+
+    def metrics(self, node):
+        try:
+            return sorted(os.listdir(os.path.join(self.path, node)))
+        except OSError:
+            return []
+
+    # Adds the samples for one point in time, given as a list of
+    # (node, metric, value) tuples.
+    def add(self, t, samples):
+        for (node, metric, val) in samples:
+            mdir = self._dir(node, metric)
+            if not os.path.isdir(mdir):
+                os.makedirs(mdir)
+
+            val = float(val)
+
+            for res in Resolutions:
+                fname = self._segment(node, metric, res, t)
+                width = res[1]
+
+                if not width:
+                    with open(fname, "ab") as f:
+                        end = f.tell()
+                        if end % _RawRecord.size:
+                            f.truncate(end - end % _RawRecord.size)
+                        f.write(_RawRecord.pack(t, val))
+                    continue
+
+                self._update_rollup(fname, t - t % width, val)
+
+    def _update_rollup(self, fname, bucket, val):
+        size = _RollupRecord.size
+
+        try:
+            f = open(fname, "r+b")
+        except IOError:
+            f = open(fname, "w+b")
+
+        with f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            # Ignore a partial record left behind by an interrupted write.
+            end -= end % size
+
+            if end:
+                f.seek(end - size)
+                (start, count, total, vmin, vmax) = _RollupRecord.unpack(f.read(size))
+
+                if start == bucket:
+                    rec = (start, count + 1, total + val, min(vmin, val), max(vmax, val))
+                    f.seek(end - size)
+                    f.write(_RollupRecord.pack(*rec))
+                    return
+
+            f.seek(end)
+            f.truncate()
+            f.write(_RollupRecord.pack(bucket, 1, val, val, val))
+
+    # Returns the records for a node and metric in the time range [start,
+    # end) at the given resolution, as a list of (time, count, sum, min, max)
+    # tuples.  For raw samples, the count is 1 and the other fields are all
+    # the sample's value.
+    def query(self, node, metric, start, end, resname):
+        res = [r for r in Resolutions if r[0] == resname][0]
+        span = res[2]
+        first = int(start // span)
+        last = int(end // span)
+
+        if res[1]:
+            record = _RollupRecord
+        else:
+            record = _RawRecord
+
+        records = []
+        for (seg, fname) in self._segments(node, metric, resname):
+            if seg < first or seg > last:
+                continue
+
+            try:
+                with open(fname, "rb") as f:
+                    data = f.read()
+            except IOError:
+                continue
+
+            data = data[:len(data) - len(data) % record.size]
+
+            for i in range(0, len(data), record.size):
+                rec = record.unpack_from(data, i)
+                if not start <= rec[0] < end:
+                    continue
+
+                if not res[1]:
+                    rec = (rec[0], 1, rec[1], rec[1], rec[1])
+
+                records.append(rec)
+
+        return records
+
+    # Removes all segments that only contain data older than the retention
+    # time of their resolution.  Returns the number of files removed.
+    def expire(self, now):
+        removed = 0
+
+        for node in self.nodes():
+            for metric in self.metrics(node):
+                for (resname, width, span, retention) in Resolutions:
+                    if not retention:
+                        continue
+
+                    for (seg, fname) in self._segments(node, metric, resname):
+                        if (seg + 1) * span > now - retention:
+                            break
+
+                        try:
+                            os.unlink(fname)
+                            removed += 1
+                        except OSError:
+                            pass
+
+                try:
+                    os.rmdir(self._dir(node, metric))
+                except OSError:
+                    pass
+
+            try:
+                os.rmdir(os.path.join(self.path, node))
+            except OSError:
+                pass
+
+        return removed
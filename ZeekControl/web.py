@@ -1,59 +1,240 @@
-from ZeekControl import version
-from ZeekControl.ser import dumps
+# A small asynchronous HTTP/1.1 server for the zeekctld API, built on asyncio
+# so that it needs nothing beyond the Python standard library.
+#
+# Connections are kept alive between requests.  A handler returns either a
+# Response, or a Stream whose body it writes while the request is open (sent
+# with chunked transfer encoding, e.g. for server-sent events).
+
+from __future__ import print_function
 import os
-import bottle
+import re
 import json
+import socket
+import asyncio
+import logging
+
+from urllib.parse import urlsplit, parse_qsl, unquote
+
+# Limits on what a client may send.
+MaxHeaderSize = 64 * 1024
+MaxBodySize = 1024 * 1024
+
+_Reasons = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+class HTTPError(Exception):
+    def __init__(self, status, msg):
+        Exception.__init__(self, msg)
+        self.status = status
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        url = urlsplit(target)
+        self.method = method
+        self.path = unquote(url.path)
+        self.query = dict(parse_qsl(url.query))
+        self.headers = headers
+        self.body = body
+        self.params = {}
+
+    # Returns the body decoded from JSON (None if empty).  Raises HTTPError
+    # if it's not valid JSON.
+    def json(self):
+        if not self.body:
+            return None
+
+        try:
+            return json.loads(self.body.decode("utf-8"))
+        except ValueError as err:
+            raise HTTPError(400, "invalid JSON in request body: %s" % err)
+
+class Response:
+    def __init__(self, body, status=200, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = body.encode("utf-8")
+
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+
+# A response whose body is sent in chunks as the handler produces them.
+class Stream:
+    def __init__(self, writer, status=200, content_type="application/x-ndjson", keepalive=True, headers=()):
+        self.writer = writer
+        self.status = status
+        self.content_type = content_type
+        self.keepalive = keepalive
+        self.headers = list(headers)
+        self.started = False
+
+    async def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+
+        if not self.started:
+            self.writer.write(_head(self.status, self.content_type, [("Transfer-Encoding", "chunked"), ("Cache-Control", "no-cache")] + self.headers, self.keepalive))
+            self.started = True
+
+        if data:
+            self.writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+            await self.writer.drain()
+
+    async def finish(self):
+        if not self.started:
+            await self.write(b"")
+
+        self.writer.write(b"0\r\n\r\n")
+        await self.writer.drain()
+
+def _head(status, content_type, headers, keepalive):
+    lines = ["HTTP/1.1 %d %s" % (status, _Reasons.get(status, "")), "Content-Type: %s" % content_type]
+    lines += ["%s: %s" % h for h in headers]
+    if not keepalive:
+        lines.append("Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+class App:
+    def __init__(self):
+        self.routes = []
+
+    # Decorator registering a handler for "method" and the path "pattern",
+    # in which "<name>" matches a path component that's passed to the
+    # handler in request.params.  A handler is a coroutine called with the
+    # request and a function returning a Stream.
+    def route(self, method, pattern):
+        regex = re.compile("^%s$" % re.sub(r"<(\w+)>", r"(?P<\1>[^/]+)", pattern))
+
+        def decorator(func):
+            self.routes.append((method, regex, func))
+            return func
+
+        return decorator
+
+    def _find(self, req):
+        allowed = False
+
+        for (method, regex, func) in self.routes:
+            m = regex.match(req.path)
+            if not m:
+                continue
+
+            allowed = True
+            if method == req.method:
+                req.params = m.groupdict()
+                return func
+
+        if allowed:
+            raise HTTPError(405, "method not allowed")
+
+        raise HTTPError(404, "not found: %s" % req.path)
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(413, "request header too large")
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            (method, target, _) = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "invalid request line")
+
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                (key, _, val) = line.partition(":")
+                headers[key.strip().lower()] = val.strip()
+
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, "invalid Content-Length")
+
+        if length > MaxBodySize:
+            raise HTTPError(413, "request body too large")
+
+        body = await reader.readexactly(length) if length else b""
+        return Request(method, target, headers, body)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                stream = None
+                keepalive = False
+
+                try:
+                    req = await self._read_request(reader)
+                    if not req:
+                        break
+
+                    keepalive = req.headers.get("connection", "").lower() != "close"
+
+                    def make_stream(content_type="application/x-ndjson", headers=()):
+                        nonlocal stream
+                        stream = Stream(writer, content_type=content_type, keepalive=keepalive, headers=headers)
+                        return stream
+
+                    resp = await self._find(req)(req, make_stream)
+
+                except HTTPError as err:
+                    if stream and stream.started:
+                        break
+                    resp = Response(json.dumps({"error": str(err)}), err.status)
+
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                except Exception as err:
+                    logging.exception("error handling request")
+                    keepalive = False
+                    if stream and stream.started:
+                        break
+                    resp = Response(json.dumps({"error": "internal error: %s" % err}), 500)
+
+                if isinstance(resp, Stream):
+                    await resp.finish()
+                else:
+                    writer.write(_head(resp.status, resp.content_type, [("Content-Length", len(resp.body))], keepalive) + resp.body)
+                    await writer.drain()
+
+                if not keepalive:
+                    break
+
+        except (ConnectionError, OSError):
+            pass
+
+        finally:
+            writer.close()
+
+    # Starts serving on a TCP address and returns the asyncio server.
+    async def serve_tcp(self, host, port):
+        return await asyncio.start_server(self.handle, host, port, limit=MaxHeaderSize)
+
+    # Starts serving on a unix socket that only the current user can
+    # connect to, and returns the asyncio server.
+    async def serve_unix(self, path):
+        if os.path.exists(path):
+            # Don't take over the socket of a running daemon.
+            try:
+                s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                s.connect(path)
+                s.close()
+                raise OSError("socket %s is in use" % path)
+            except ConnectionRefusedError:
+                os.unlink(path)
 
-app = bottle.Bottle(autojson=False)
-app.install(bottle.JSONPlugin(json_dumps=lambda s: json.dumps(s, default=dumps)))
-
-@app.route('/start')
-def start():
-    i = app.daemon.call("start")
-    return {"id": i} 
-
-@app.route('/stop')
-def start():
-    i = app.daemon.call("stop")
-    return {"id": i} 
-
-@app.route('/restart')
-def restart():
-    i = app.daemon.call("restart")
-    return {"id": i} 
-
-
-@app.route('/nodes')
-def nodes():
-    s = app.daemon.sync_call("nodes")
-    print "\n\n\nReturning", s, "\n\n"
-    return {"result": s}
-
-@app.route('/exec/:cmd')
-def start(cmd):
-    i = app.daemon.call("execute", cmd)
-    return {"id": i} 
-
-@app.route('/result/:id')
-def result(id):
-    id = int(id)
-    return {"result": app.daemon.getresult(id)}
-
-@app.route('/log/:id')
-@app.route('/log/:id/:since')
-def result(id, since=0):
-    id = int(id)
-    since = int(since)
-    return {"log": app.daemon.getlog(id, since) or []}
-
-@app.route('/:cmd')
-def cmd(cmd):
-    i = app.daemon.call(cmd)
-    return {"id": i} 
-
-def run_app(client):
-    app.daemon = client
-    bottle.run(app, host='localhost', port=8082)
-
-if __name__ == "__main__":
-    main()
+        oldmask = os.umask(0o077)
+        try:
+            return await asyncio.start_unix_server(self.handle, path, limit=MaxHeaderSize)
+        finally:
+            os.umask(oldmask)
@@ -3,13 +3,18 @@
 from __future__ import print_function
 import os
 import sys
+import time
+import signal
 import logging
+import functools
 
 from ZeekControl import lock
 from ZeekControl import config
 from ZeekControl import cmdresult
 from ZeekControl import execute
 from ZeekControl import control
+from ZeekControl import cron
+from ZeekControl import tsdb
 from ZeekControl import version
 from ZeekControl import pluginreg
 from ZeekControl import node as node_mod
@@ -34,6 +39,7 @@ def expose(func):
     return func
 
 def lock_required(func):
+    @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
         self.lock()
         try:
@@ -44,6 +50,7 @@ def lock_required(func):
     return wrapper
 
 def lock_required_silent(func):
+    @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
         self.lock(showwait=False)
         try:
@@ -53,7 +60,39 @@ def lock_required_silent(func):
     wrapper.lock_required = True
     return wrapper
 
+# Commands that don't modify the installation, the nodes or the state database
+# (other than for recording what they found out, such as a crashed node) are
+# read-only.  They only need a shared lock and see a snapshot of the state, so
+# they can run concurrently with each other, and in zeekctld also with a
+# command holding the exclusive lock (except while that one reloads the
+# configuration, see reload_cfg()).
+def lock_shared(func):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with lock.reading():
+            self.lock(shared=True)
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self.unlock(shared=True)
+    wrapper.lock_required = True
+    wrapper.read_only = True
+    return wrapper
+
+# Marks a read-only command that doesn't need a lock at all.
+def read_only(func):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with lock.reading():
+            return func(self, *args, **kwargs)
+    wrapper.read_only = True
+    return wrapper
+
+def is_read_only(func):
+    return getattr(func, "read_only", False)
+
 def check_config(func):
+    @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
         if config.Config.is_cfg_changed():
             self.ui.warn('Configuration has changed. Run the "deploy" command.')
@@ -92,7 +131,7 @@ class ZeekCtl(object):
             logging.getLogger().addHandler(h)
 
         self.executor = execute.Executor(self.config)
-        self.plugins = pluginreg.PluginRegistry()
+        self.plugins = pluginreg.PluginRegistry(self.config.pluginmanifest)
         self.setup()
         self.controller = control.Controller(self.config, self.ui, self.executor, self.plugins)
 
@@ -109,13 +148,20 @@ class ZeekCtl(object):
         self.plugins.initPluginOptions()
         self.plugins.addNodeKeys()
         self.config.initPostPlugins()
-        self.plugins.initPlugins(self.ui)
+        self.plugins.initPlugins(self.ui, self.config.cfg_key())
         self.plugins.initPluginCmds()
         os.chdir(self.config.zeekbase)
         if self.config.get_state("cronenabled") is None:
             self.config.set_state("cronenabled", True)
 
+    # Reloads the configuration.  The options, nodes and plugins are replaced
+    # in several steps, so this waits for the read-only commands running in
+    # other threads (in zeekctld) to finish first, and holds off new ones.
     def reload_cfg(self):
+        with lock.exclude_readers():
+            self._reload_cfg()
+
+    def _reload_cfg(self):
         self.config.reload_cfg()
 
         if self.config.debug:
@@ -136,7 +182,7 @@ class ZeekCtl(object):
         self.executor.finish()
         self.plugins.initPluginOptions()
         self.config.initPostPlugins()
-        self.plugins.initPlugins(self.ui)
+        self.plugins.initPlugins(self.ui, self.config.cfg_key())
         self.plugins.initPluginCmds()
 
     def finish(self):
@@ -150,27 +196,27 @@ class ZeekCtl(object):
     # then only one node per host is chosen.  If "get_types" is True, then
     # only one node per node type (manager, proxy, etc.) is chosen.
     def node_args(self, args=None, get_hosts=False, get_types=False):
-        nodes = []
-
         if args:
+            nodes = []
+            seen = set()
             for arg in args.split():
                 nodelist = self.config.nodes(arg)
                 if not nodelist:
                     raise InvalidNodeError("unknown node '%s'" % arg)
 
-                nodes += nodelist
+                # Remove duplicate nodes
+                for node in nodelist:
+                    if node.name not in seen:
+                        seen.add(node.name)
+                        nodes.append(node)
 
-            # Remove duplicate nodes
-            newlist = list(set(nodes))
-            if len(newlist) != len(nodes):
-                nodes = newlist
+            # Sort the list so that it doesn't depend on initial order of
+            # arguments
+            nodes.sort(key=node_mod.sortnode)
         else:
-            # Get all nodes.
+            # Get all nodes (already sorted).
             nodes = self.config.nodes()
 
-        # Sort the list so that it doesn't depend on initial order of arguments
-        nodes.sort(key=node_mod.sortnode)
-
         if get_hosts:
             hosts = {}
             hostnodes = []
@@ -193,15 +239,23 @@ class ZeekCtl(object):
 
         return nodes
 
-    def lock(self, showwait=True):
-        lockstatus = lock.lock(self.ui, showwait)
+    def lock(self, showwait=True, shared=False):
+        lockstatus = lock.lock(self.ui, showwait, shared)
         if not lockstatus:
             raise LockError("Unable to get lock")
 
-        self.config.read_state()
+        if shared:
+            # Changes to the state are written back only as long as no other
+            # command of this process holds the exclusive lock.
+            self.config.snapshot_state(lambda: not lock.holds_exclusive())
+        else:
+            self.config.read_state()
+
+    def unlock(self, shared=False):
+        if shared:
+            self.config.release_state()
 
-    def unlock(self):
-        lock.unlock(self.ui)
+        lock.unlock(self.ui, shared)
 
     def node_names(self):
         return [ n.name for n in self.config.nodes() ]
@@ -210,6 +264,7 @@ class ZeekCtl(object):
         return node_mod.node_groups()
 
     @expose
+    @read_only
     @check_config
     def nodes(self):
         results = cmdresult.CmdResult()
@@ -225,6 +280,7 @@ class ZeekCtl(object):
         return results
 
     @expose
+    @read_only
     @check_config
     def get_config(self):
         results = cmdresult.CmdResult()
@@ -249,6 +305,18 @@ class ZeekCtl(object):
         self.plugins.cmdPost("install")
         return results
 
+    @expose
+    @check_config
+    @lock_required
+    def rollback(self):
+        if self.plugins.cmdPre("rollback"):
+            results = self.controller.rollback()
+        else:
+            results = cmdresult.CmdResult(ok=False)
+
+        self.plugins.cmdPost("rollback")
+        return results
+
     @expose
     @check_config
     @lock_required
@@ -319,35 +387,70 @@ class ZeekCtl(object):
             self.ui.info("Reloading zeekctl configuration ...")
             self.reload_cfg()
 
+        # The new install generation is built locally while the
+        # configuration is checked.  Everything else (including copying the
+        # generation to the other hosts) is done only once the check has
+        # passed, but still before the nodes are stopped, so that only the
+        # activation is left to do while they are down.
         self.ui.info("checking configurations ...")
-        results = self.check(check_node_types=True)
+        nodes = self.node_args(get_types=True)
+        nodes = self.plugins.cmdPreWithNodes("check", nodes)
+        wait_check = self.controller.start_check(nodes)
+
+        self.ui.info("installing ...")
+        if self.plugins.cmdPre("install"):
+            installresults, staged = self.controller.stage_install(False)
+        else:
+            installresults = cmdresult.CmdResult(ok=False)
+
+        results = wait_check()
+        self.plugins.cmdPostWithResults("check", results.get_node_data())
         if not results.ok:
             for (node, success, output) in results.get_node_output():
                 if not success:
                     self.ui.info("%s scripts failed." % node)
                     self.ui.info(output)
 
+            self.plugins.cmdPost("install")
             return results
 
-        self.ui.info("installing ...")
-        results = self.install()
-        if not results.ok:
-            return results
+        if not installresults.ok:
+            self.plugins.cmdPost("install")
+            return installresults
+
+        installresults, staged = self.controller.distribute_install(staged)
+        if not installresults.ok:
+            self.plugins.cmdPost("install")
+            return installresults
 
         self.ui.info("stopping ...")
+        stoptime = time.time()
         results = self.stop()
         if not results.ok:
+            self.plugins.cmdPost("install")
             return results
 
+        installresults = self.controller.activate_install(staged)
+        self.plugins.cmdPost("install")
+
+        # If the activation failed, the previous install generation is still
+        # (or again) the active one, so restart the nodes with it rather
+        # than leaving the cluster down.
+        if not installresults.ok:
+            self.ui.error("failed to activate the new installation, restarting nodes with the previous one")
+
         self.ui.info("starting ...")
         results = self.start()
+        self.ui.info("nodes were stopped for %.1f seconds" % (time.time() - stoptime))
 
         self.plugins.cmdPost("deploy")
+        if not installresults.ok:
+            return installresults
         return results
 
     @expose
     @check_config
-    @lock_required
+    @lock_shared
     def status(self, node_list=None):
         nodes = self.node_args(node_list)
 
@@ -357,7 +460,7 @@ class ZeekCtl(object):
         return results
 
     @expose
-    @lock_required
+    @lock_shared
     def top(self, node_list=None):
         nodes = self.node_args(node_list)
 
@@ -369,7 +472,7 @@ class ZeekCtl(object):
 
     @expose
     @check_config
-    @lock_required
+    @lock_shared
     def diag(self, node_list=None):
         nodes = self.node_args(node_list)
 
@@ -388,9 +491,45 @@ class ZeekCtl(object):
 
         return True
 
+    # Runs only the cron task "name".  The lock is only held for tasks which
+    # modify state shared with other commands.
+    @expose
+    def crontask(self, name):
+        if name not in cron.task_names():
+            raise CommandSyntaxError("unknown cron task: %s" % name)
+
+        # The cron daemon stops a task that exceeds its timeout with
+        # SIGTERM; exit through the finally clause below then, so that the
+        # lock is released.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+        if cron.is_mutating(name):
+            self.lock(showwait=False)
+        else:
+            self.config.read_state()
+
+        try:
+            if name == "plugins":
+                # Only runs the plugins' cron hooks.
+                self.plugins.cmdPre("cron", "", False)
+                self.plugins.cmdPost("cron", "", False)
+            else:
+                self.controller.cron_task(name)
+        finally:
+            if cron.is_mutating(name):
+                self.unlock()
+
+        return True
+
+    # Runs the cron tasks on their own schedules until terminated, each
+    # by running the command "cmd" with the task name appended (i.e.,
+    # "zeekctl cron --task").  This doesn't hold the lock itself.
+    def crondaemon(self, cmd):
+        return self.controller.cron_daemon(cmd)
+
     @expose
     @check_config
-    @lock_required
+    @lock_shared
     def cronenabled(self):
         results = False
         if self.plugins.cmdPre("cron", "?", False):
@@ -441,7 +580,7 @@ class ZeekCtl(object):
 
     @expose
     @check_config
-    @lock_required
+    @lock_shared
     def capstats(self, interval=10, node_list=None):
         nodes = self.node_args(node_list)
         nodes = self.plugins.cmdPreWithNodes("capstats", nodes, interval)
@@ -452,7 +591,7 @@ class ZeekCtl(object):
 
     @expose
     @check_config
-    @lock_required
+    @lock_shared
     def df(self, node_list=None):
         nodes = self.node_args(node_list, get_hosts=True)
         nodes = self.plugins.cmdPreWithNodes("df", nodes)
@@ -462,8 +601,29 @@ class ZeekCtl(object):
         return results
 
     @expose
+    @read_only
     @check_config
-    @lock_required
+    def stats(self, metric=None, interval=3600, resolution=None, node_list=None):
+        if resolution is not None and resolution not in tsdb.resolution_names():
+            raise CommandSyntaxError("unknown resolution: %s" % resolution)
+
+        nodes = self.node_args(node_list)
+        nodes = self.plugins.cmdPreWithNodes("stats", nodes)
+
+        end = time.time()
+        start = end - interval
+        series = resolution is not None
+        if not series:
+            resolution = tsdb.choose_resolution(start, end)
+
+        results = self.controller.stats(nodes, metric, start, end, resolution, series)
+        self.plugins.cmdPostWithNodes("stats", nodes)
+
+        return results
+
+    @expose
+    @check_config
+    @lock_shared
     def print_id(self, id, node_list=None):
         nodes = self.node_args(node_list)
         nodes = self.plugins.cmdPreWithNodes("print", nodes, id)
@@ -474,7 +634,7 @@ class ZeekCtl(object):
 
     @expose
     @check_config
-    @lock_required
+    @lock_shared
     def peerstatus(self, node_list=None):
         nodes = self.node_args(node_list)
         nodes = self.plugins.cmdPreWithNodes("peerstatus", nodes)
@@ -485,7 +645,7 @@ class ZeekCtl(object):
 
     @expose
     @check_config
-    @lock_required
+    @lock_shared
     def netstats(self, node_list=None):
         if not node_list:
             node_list = None
@@ -1,222 +1,699 @@
+# The ZeekControl daemon (zeekctld), which keeps a ZeekCtl instance loaded and
+# runs its API methods (those decorated with @expose) as jobs on behalf of
+# clients of an HTTP API.
+#
+# The daemon listens on the unix socket given by the ZeekCtldSocket option,
+# which only the user running it can connect to, and if ZeekCtldPort is set,
+# also on that TCP port of ZeekCtldAddress.  The API:
+#
+#   GET  /api                 The exposed methods, with their arguments and
+#                             whether they're read-only.
+#   POST /jobs/<method>       Starts a job; the request body is a JSON object
+#                             {"args": [...], "kwargs": {...}} (or empty).
+#                             Returns {"id": <job id>}.
+#   POST /call/<method>       Starts a job like /jobs, and streams its log
+#                             like /jobs/<id>/log.
+#   GET  /jobs                The jobs known.
+#   GET  /jobs/<id>           A job with its log and result.
+#   GET  /jobs/<id>/log       Streams the job's log as it's written, and
+#                             ends with the result once the job is done.
+#                             "?since=<n>" skips the first n log entries.
+#   POST /jobs/<id>/cancel    Cancels the job if it's still queued (a job
+#                             that is running cannot be interrupted).
+#                             Returns {"cancelled": true|false}.
+#   POST /command             Runs a zeekctl command line, given as the
+#                             arguments {"args": [...]} of zeekctl, as a job
+#                             and streams its log like /call.  The log has
+#                             what zeekctl prints to stdout as "info" entries
+#                             and what it prints to stderr as "error"
+#                             entries, and the result is whether the command
+#                             succeeded.  This is zeekctl's client mode.
+#
+# A log is streamed as one JSON object per line, i.e.
+# {"offset": <n>, "stream": "info"|"warn"|"error", "text": <text>} for each
+# log entry, and {"state": ..., "result": ..., "error": ...} at the end.
+# If the client accepts "text/event-stream", it's streamed as server-sent
+# events instead, with the log entries as "info", "warn" or "error" events
+# (the event IDs being the offsets), and the result as a "result" event.
+# The response has the job's ID in the "X-Zeekctld-Job" header.
+#
+# Jobs of methods that modify the installation run one after another.  Those
+# of read-only methods (see zeekctl.lock_shared) run on a separate pool of
+# ZeekCtldReadWorkers threads, so they neither wait for nor block them.
+#
+# The daemon keeps at most ZeekCtldJobs job records, and removes those of
+# finished jobs after ZeekCtldJobTTL seconds.
+#
+# Before running a job, the daemon reloads the configuration if zeekctl.cfg
+# or node.cfg has changed since it was loaded, like a new run of zeekctl would
+# read it anew.
+
 from __future__ import print_function
-from collections import defaultdict
-from threading import Thread, Lock
-from Queue import Queue
 import os
+import sys
+import json
 import time
-import random
+import re
+import signal
+import socket
+import asyncio
+import inspect
+import functools
+import logging
+import threading
 import traceback
+import collections
+import http.client
+from concurrent.futures import ThreadPoolExecutor
 
-from ZeekControl import config
+from ZeekControl import cli
+from ZeekControl import ser
+from ZeekControl import web
+from ZeekControl import options
 from ZeekControl import version
-from ZeekControl.zeekctl import ZeekCtl
-from ZeekControl import ser as json
+from ZeekControl.zeekctl import ZeekCtl, is_read_only
+from ZeekControl.exceptions import ZeekControlError
+
+# The number of log entries kept per job; older ones are dropped.
+MaxLogEntries = 10000
+
+# How often to remove expired job records (in seconds).
+EvictInterval = 60
+
+Queued = "queued"
+Running = "running"
+Done = "done"
+Failed = "failed"
+
+class Job:
+    def __init__(self, id, method, args, kwargs):
+        self.id = id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.state = Queued
+        self.created = time.time()
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.cancelled = False
+
+        # The concurrent.futures.Future of the job's run in a worker thread.
+        self.future = None
+
+        # Log entries (stream, text), and the number dropped from the start.
+        self.log = []
+        self.dropped = 0
+
+        self._changed = asyncio.Event()
+
+    def done(self):
+        return self.state in (Done, Failed)
+
+    # The following methods must be called in the event loop's thread.
+
+    def append(self, stream, text):
+        self.log.append((stream, text))
+        if len(self.log) > MaxLogEntries:
+            del self.log[0]
+            self.dropped += 1
+
+        self._notify()
+
+    def set_state(self, state, result=None, error=None):
+        self.state = state
+        self.result = result
+        self.error = error
+        if self.done():
+            self.finished = time.time()
+
+        self._notify()
+
+    # Returns the log entries from offset "since" on, as a list of
+    # (offset, stream, text).
+    def entries(self, since=0):
+        start = max(since, self.dropped)
+        return [(start + i, stream, text) for (i, (stream, text)) in enumerate(self.log[start - self.dropped:])]
+
+    # Returns an asyncio.Event that is set on the next change of the job's
+    # log or state.
+    def changed(self):
+        return self._changed
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "method": self.method,
+            "args": self.args,
+            "kwargs": self.kwargs,
+            "state": self.state,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+    def outcome(self):
+        return {"id": self.id, "state": self.state, "result": self.result, "error": self.error}
+
+# The job records, bounded in number and age.
+class Jobs:
+    def __init__(self, maxjobs, ttl):
+        self.maxjobs = maxjobs
+        self.ttl = ttl
+        self.jobs = collections.OrderedDict()
+        self.next_id = 1
+
+    def add(self, method, args, kwargs):
+        self.evict(room=1)
+
+        job = Job(self.next_id, method, args, kwargs)
+        self.next_id += 1
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, id):
+        return self.jobs.get(id)
+
+    def __iter__(self):
+        return iter(list(self.jobs.values()))
+
+    # Removes the records of finished jobs that have expired, and then the
+    # oldest finished ones while there are too many (leaving room for "room"
+    # more).  Records of jobs that are queued or running are kept.
+    def evict(self, now=None, room=0):
+        now = now or time.time()
+
+        for job in list(self.jobs.values()):
+            if job.done() and job.finished + self.ttl <= now:
+                del self.jobs[job.id]
+
+        excess = len(self.jobs) + room - self.maxjobs
+        for job in list(self.jobs.values()):
+            if excess <= 0:
+                break
+            if job.done():
+                del self.jobs[job.id]
+                excess -= 1
+
+# The user interface given to ZeekCtl, which appends the output to the log
+# of the job running in the calling thread.  Output outside of jobs only
+# goes to the daemon's log.  While a thread runs a command line, its output
+# is passed on to the command loop instead (see set_delegate()), which
+# formats it like zeekctl does.
+class JobUI:
+    def __init__(self):
+        self.loop = None
+        self._local = threading.local()
+
+    def set_job(self, job):
+        self._local.job = job
+        self._local.delegate = None
+
+    def set_delegate(self, ui):
+        self._local.delegate = ui
+
+    def _output(self, stream, text):
+        job = getattr(self._local, "job", None)
+        if job and self.loop:
+            self.loop.call_soon_threadsafe(job.append, stream, text)
+        else:
+            logging.info("%s: %s", stream, text)
+
+    def _write(self, stream, text):
+        delegate = getattr(self._local, "delegate", None)
+        if delegate:
+            getattr(delegate, stream)(text)
+        else:
+            self._output(stream, text)
+
+    def info(self, text):
+        self._write("info", text)
+
+    def warn(self, text):
+        self._write("warn", text)
+
+    def error(self, text):
+        self._write("error", text)
+
+# The command loop for running the command lines that zeekctl forwards in its
+# client mode.  It writes what zeekctl would print to stdout and stderr to the
+# log of the current job as "info" and "error" entries, respectively.
+class JobCmdLoop(cli.ZeekCtlCmdLoop):
+    def __init__(self, zeekctl, ui, cmd):
+        self.jobui = ui
+        ui.set_delegate(self)
+        cli.ZeekCtlCmdLoop.__init__(self, cmd=cmd, zeekctl=zeekctl)
+
+    def output(self, text, stderr=False):
+        self.jobui._output("error" if stderr else "info", text)
+
+# Returns a dict mapping the names of the methods of "cls" (ZeekCtl) that the
+# API exposes to dicts with the names of their arguments ("args") and whether
+# they're read-only ("read_only").
+def exposed_methods(cls=ZeekCtl):
+    methods = {}
+
+    for name in dir(cls):
+        func = getattr(cls, name)
+        if getattr(func, "api_exposed", False):
+            methods[name] = {
+                "args": list(inspect.signature(func).parameters)[1:],
+                "read_only": is_read_only(func),
+            }
+
+    return methods
+
+def _json(obj):
+    return json.loads(ser.dumps(obj))
+
+# Returns the path of zeekctld's unix socket (the ZeekCtldSocket option) as set
+# in the zeekctl config file, without loading the whole configuration.
+def socket_path(cfgfile=version.CFGFILE, zeekbase=version.ZEEKBASE):
+    values = {"zeekbase": zeekbase}
+    for opt in options.options:
+        if opt.name in ("SpoolDir", "ZeekCtldSocket"):
+            values[opt.name.lower()] = opt.default
+
+    try:
+        with open(cfgfile, "r") as f:
+            for line in f:
+                (key, sep, val) = line.partition("=")
+                key = key.strip().lower()
+                if sep and key in values:
+                    values[key] = val.strip()
+    except IOError:
+        pass
 
-from ZeekControl import web
+    path = values["zeekctldsocket"]
+    for i in range(len(values)):
+        path = re.sub(r"\$\{(\w+)\}", lambda m: values.get(m.group(1).lower(), ""), path)
+
+    return path
+
+class Daemon:
+    def __init__(self, zeekctl, ui):
+        self.zeekctl = zeekctl
+        self.ui = ui
+        self.config = zeekctl.config
+        self.methods = exposed_methods(type(zeekctl))
+        self.jobs = Jobs(self.config.zeekctldjobs, self.config.zeekctldjobttl)
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.readpool = ThreadPoolExecutor(max_workers=max(self.config.zeekctldreadworkers, 1))
+        self.app = web.App()
+        self._routes()
+        self._loop = None
+        self._stop = None
+        self._futures = set()
+        self._cfglock = threading.Lock()
+        self._cfghashes = self._config_hashes()
+
+    def _routes(self):
+        route = self.app.route
+
+        @route("GET", "/api")
+        async def api(req, stream):
+            return web.Response(json.dumps({"version": version.VERSION, "methods": self.methods}))
+
+        @route("GET", "/jobs")
+        async def jobs(req, stream):
+            return web.Response(json.dumps({"jobs": [job.summary() for job in self.jobs]}))
+
+        @route("POST", "/jobs/<method>")
+        async def submit(req, stream):
+            job = self.submit(req.params["method"], req.json())
+            return web.Response(json.dumps({"id": job.id}), 202)
+
+        @route("POST", "/call/<method>")
+        async def call(req, stream):
+            job = self.submit(req.params["method"], req.json())
+            return await self.stream_log(req, stream, job)
+
+        @route("GET", "/jobs/<id>")
+        async def get(req, stream):
+            job = self._job(req)
+            d = job.summary()
+            d.update(job.outcome())
+            d["log"] = [{"offset": n, "stream": s, "text": t} for (n, s, t) in job.entries()]
+            return web.Response(json.dumps(d))
+
+        @route("GET", "/jobs/<id>/log")
+        async def log(req, stream):
+            return await self.stream_log(req, stream, self._job(req))
+
+        @route("POST", "/jobs/<id>/cancel")
+        async def cancel(req, stream):
+            return web.Response(json.dumps({"cancelled": self.cancel(self._job(req))}))
+
+        @route("POST", "/command")
+        async def command(req, stream):
+            job = self.submit_command(req.json())
+            return await self.stream_log(req, stream, job)
+
+    def _job(self, req):
+        try:
+            job = self.jobs.get(int(req.params["id"]))
+        except ValueError:
+            job = None
+
+        if not job:
+            raise web.HTTPError(404, "no such job: %s" % req.params["id"])
+
+        return job
+
+    # Creates a job for a request to run "method" with the arguments in
+    # "body", and queues it.
+    def submit(self, method, body):
+        if method not in self.methods:
+            raise web.HTTPError(404, "unknown method: %s" % method)
+
+        body = body or {}
+        if not isinstance(body, dict):
+            raise web.HTTPError(400, "request body must be a JSON object")
+
+        args = body.get("args", [])
+        kwargs = body.get("kwargs", {})
+        if not isinstance(args, list) or not isinstance(kwargs, dict):
+            raise web.HTTPError(400, "invalid arguments")
+
+        try:
+            inspect.signature(getattr(type(self.zeekctl), method)).bind(None, *args, **kwargs)
+        except TypeError as err:
+            raise web.HTTPError(400, "invalid arguments for %s: %s" % (method, err))
+
+        job = self.jobs.add(method, args, kwargs)
+        func = functools.partial(getattr(self.zeekctl, method), *args, **kwargs)
+        self._start(job, func, self.methods[method]["read_only"])
+        return job
+
+    # Creates a job for a request to run a zeekctl command line, and queues
+    # it.  Commands run on the read-only pool if their method is read-only.
+    def submit_command(self, body):
+        args = body.get("args") if isinstance(body, dict) else None
+        if not args or not isinstance(args, list) or not all(isinstance(a, str) for a in args):
+            raise web.HTTPError(400, "request body must be a JSON object with a list of arguments")
+
+        if args[0] in cli.LocalCommands or args[0].startswith("-"):
+            raise web.HTTPError(400, "the %s command cannot run in zeekctld" % args[0])
+
+        method = self.methods.get(cli.command_method(args[0]), {})
+        job = self.jobs.add("command", args, {})
+        self._start(job, functools.partial(self._command, args), method.get("read_only", False))
+        return job
+
+    def _start(self, job, func, read_only):
+        pool = self.readpool if read_only else self.pool
+        cfuture = pool.submit(self._run, job, func)
+        job.future = cfuture
+        self._futures.add(cfuture)
+        cfuture.add_done_callback(self._futures.discard)
+        future = asyncio.wrap_future(cfuture, loop=self._loop)
+        future.add_done_callback(lambda f: self._finished(job, f))
+
+    def _finished(self, job, future):
+        if future.cancelled():
+            if job.cancelled:
+                job.set_state(Failed, error="job was cancelled")
+            else:
+                job.set_state(Failed, error="zeekctld was shut down before the job ran")
+        else:
+            job.set_state(*future.result())
 
-STOP_RUNNING = object()
+    # Cancels a job that is still queued.  Returns whether it was cancelled.
+    def cancel(self, job):
+        if job.future is None or not job.future.cancel():
+            return False
 
-class TermUI:
-    def __init__(self):
-        pass
+        job.cancelled = True
+        return True
 
-    def info(self, msg):
-        print(msg)
-    warn = info
+    # Returns the hashes of the contents of zeekctl.cfg and node.cfg, or None
+    # if they cannot be read.
+    def _config_hashes(self):
+        try:
+            return (self.config._get_zeekctlcfg_hash(filehash=True), self.config._get_nodecfg_hash(filehash=True))
+        except IOError:
+            return None
+
+    # Reloads the configuration if zeekctl.cfg or node.cfg has changed since
+    # it was loaded.  Reloading waits for the read-only jobs that are running
+    # to finish (see ZeekCtl.reload_cfg).
+    def _check_config(self):
+        with self._cfglock:
+            hashes = self._config_hashes()
+            if hashes is None or hashes == self._cfghashes:
+                return
 
-    def error(self, msg):
-        print("ERROR", msg)
+            self.zeekctl.reload_cfg()
+            self._cfghashes = hashes
+
+    # Runs a job's function in a worker thread, and returns a tuple (state,
+    # result, error).
+    def _run(self, job, func):
+        self.ui.loop.call_soon_threadsafe(job.set_state, Running)
+        self.ui.set_job(job)
+
+        try:
+            self._check_config()
+            return (Done, _json(func()), None)
+        except ZeekControlError as err:
+            return (Failed, None, str(err))
+        except Exception as err:
+            logging.exception("job %d (%s) failed", job.id, job.method)
+            self.ui.error(traceback.format_exc())
+            return (Failed, None, "%s: %s" % (type(err).__name__, err))
+        finally:
+            self.ui.set_job(None)
+
+    # Runs a command line like zeekctl does, and returns whether the command
+    # succeeded.
+    def _command(self, args):
+        line = " ".join(args)
+        loop = JobCmdLoop(self.zeekctl, self.ui, args[0] if len(args) == 1 else "")
+        loop.precmd(line)
+        success = loop.onecmd(line)
+        loop.postcmd(False, line)
+        return bool(success)
+
+    async def stream_log(self, req, stream, job):
+        sse = "text/event-stream" in req.headers.get("accept", "")
+
+        try:
+            if sse and "last-event-id" in req.headers:
+                since = int(req.headers["last-event-id"]) + 1
+            else:
+                since = int(req.query.get("since", 0))
+        except ValueError:
+            raise web.HTTPError(400, "invalid log offset")
+
+        out = stream("text/event-stream" if sse else "application/x-ndjson", [("X-Zeekctld-Job", str(job.id))])
+
+        # Send the header right away, so the client has the job's ID even
+        # while the job is queued.
+        await out.write("")
 
-class Logs:
-    def __init__(self):
-        self.store = defaultdict(list)
-
-    def append(self, id, stream, txt):
-        self.store[id].append((stream, txt))
-
-    def get(self, id, since=0):
-        msgs = self.store.get(id) or []
-        return msgs[since:]
-
-class Common:
-    def dump(self, *args):
-        return json.dumps(*args)
-    def load(self, msg):
-        return json.loads(msg)
-
-class ZeekCtrldWorker(Thread, Common):
-    def __init__(self, command_queue):
-        self.q = Queue()
-        Thread.__init__(self)
-        self.daemon = True
-        self.command_queue = command_queue
-        self._id = None
-
-    def send(self, id, cmd, *args):
-        self.q.put((id, cmd, args))
-
-    def run(self):
-        #FIXME: deepcopy breaks here if i set ui=self
-        self.zeekctl = ZeekCtl(ui=TermUI())
-        self.zeekctl.ui = self
-        self.zeekctl.controller.ui = self
-        self.zeekctl.executor.ui = self
         while True:
-            if self.iteration():
-                return
+            # Check the state first so that no entries are missed if the
+            # job finishes while sending them.
+            done = job.done()
+            changed = job.changed()
 
-    def noop(self, *args, **kwargs):
-        return True
+            data = []
+            for (offset, s, text) in job.entries(since):
+                if sse:
+                    data.append("id: %d\nevent: %s\ndata: %s\n\n" % (offset, s, json.dumps(text)))
+                else:
+                    data.append(json.dumps({"offset": offset, "stream": s, "text": text}) + "\n")
+                since = offset + 1
 
-    def iteration(self):
-        id, cmd, args = self.q.get()
-        self._id = id
-
-        if cmd is STOP_RUNNING:
-            return True
-
-        func = getattr(self.zeekctl, cmd, self.noop)
-
-        def respond(r):
-            self.call("result", id, r)
-
-        if not hasattr(func, 'api_exposed'):
-            return respond("invalid function")
-
-        try :
-            res = func(*args)
-        except Exception as e:
-            res = traceback.format_exc()
-        respond(res)
-
-    def call(self, func, *args):
-        self.command_queue.put((None, func, args))
-
-    def info(self, msg):
-        return self.call("info", self._id, msg)
-
-    def error(self, msg):
-        return self.call("err", self._id, msg)
-    warn = error
-
-class ZeekCtld(Thread, Common):
-    def __init__(self, command_queue, logs):
-        Thread.__init__(self)
-        self.daemon = True
-        self.logs = logs
-        self.command_queue = command_queue
-        self.worker = ZeekCtrldWorker(self.command_queue)
-
-        self.results = {}
-        self.running = True
-
-        self.id_gen = iter(range(10000000)).next
-
-        self.init()
-
-    def init(self):
-        self.worker.start()
-
-    def recv(self):
-        msg = self.command_queue.get()
-        print("Received", msg)
-        return msg
-
-    def run(self):
-        return self._run()
-
-    def handle_result(self, id, result):
-        print("Got result id=%r result=%r" % (id, result))
-        self.results[id] = result
-        return "ok"
-
-    def handle_out(self, id, txt):
-        print("Got %s id=%r result=%r" % ('out', id, txt))
-        self.logs.append(id, 'out', txt)
-        return "ok"
-
-    def handle_info(self, id, txt):
-        print("Got %s id=%r result=%r" % ('info', id, txt))
-        self.logs.append(id, 'info', txt)
-        return "ok"
-
-    def handle_err(self, id, txt):
-        print("Got %s id=%r result=%r" % ('err', id, txt))
-        self.logs.append(id, 'err', txt)
-        return "ok"
-
-    def handle_getresult(self, id):
-        result = self.results.get(id)
-        if result:
-            del self.results[id]
-        print("sending result=%r for id=%r" % (result, id))
-        return result
-
-    def handle_getlog(self, id, since):
-        result = self.logs.get(id, since)
-        print("sending log=%r for id=%r" % (result, id))
-        return result
-
-    def _run(self):
-        while self.running:
-            (rq, cmd, args) = self.recv()
-            func = getattr(self, 'handle_' + cmd, None)
-            if func:
-                res = func(*args)
-                if rq:
-                    rq.put(res)
-            else:
-                t_id = self.send_to_worker(cmd, *args)
-                rq.put(t_id)
-
-    def send_to_worker(self, cmd, *args):
-        t_id = self.id_gen()
-        self.worker.send(t_id, cmd, *args)
-        print("started id=%r cmd=%r args=%r" % (t_id, cmd, args))
-        return t_id
-
-class Client(Common):
-    def __init__(self, command_queue):
-        self.command_queue = command_queue
-
-    def call(self, func, *args):
-        rq = Queue()
-        self.command_queue.put((rq, func, args))
-        return rq.get()
-
-    def sync_call(self, func, *args):
-        id = self.call(func, *args)
-        print("got id", id)
+            if data:
+                await out.write("".join(data))
+
+            if done:
+                break
+
+            await changed.wait()
+
+        if sse:
+            await out.write("event: result\ndata: %s\n\n" % json.dumps(job.outcome()))
+        else:
+            await out.write(json.dumps(job.outcome()) + "\n")
+
+        return out
+
+    async def _evict(self):
         while True:
-            res = self.getresult(id)
-            if res:
-                return res
-            time.sleep(0.1)
+            await asyncio.sleep(EvictInterval)
+            self.jobs.evict()
+
+    # Serves requests on the event loop "loop" until stop() is called (or, if
+    # "signals" is True, until SIGINT or SIGTERM is received).
+    async def run(self, loop, signals=True):
+        self.ui.loop = loop
+        self._loop = loop
+        self._stop = stop = asyncio.Event()
+
+        if signals:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, stop.set)
+
+        sockpath = self.config.zeekctldsocket
+        servers = [await self.app.serve_unix(sockpath)]
+        logging.info("zeekctld listening on %s", sockpath)
+
+        if self.config.zeekctldport:
+            servers.append(await self.app.serve_tcp(self.config.zeekctldaddress, self.config.zeekctldport))
+            logging.info("zeekctld listening on %s:%d", self.config.zeekctldaddress, self.config.zeekctldport)
+
+        evict = asyncio.ensure_future(self._evict(), loop=loop)
+
+        try:
+            await stop.wait()
+        finally:
+            logging.info("zeekctld shutting down")
+            evict.cancel()
+            for server in servers:
+                server.close()
+
+            try:
+                os.unlink(sockpath)
+            except OSError:
+                pass
+
+            # Let the running jobs finish, but not the queued ones (cancel()
+            # fails for jobs that are already running).
+            for future in list(self._futures):
+                future.cancel()
+
+            for pool in (self.pool, self.readpool):
+                await loop.run_in_executor(None, pool.shutdown)
+
+    # Makes run() return; may be called from any thread.
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._stop.set)
+
+# A client of the API.  "address" is the path of a unix socket, or a string
+# "<host>:<port>".  The connection is kept open between calls.
+class Client:
+    def __init__(self, address, timeout=None):
+        if address.startswith("/"):
+            self.conn = _UnixHTTPConnection(address, timeout)
+        else:
+            (host, _, port) = address.rpartition(":")
+            self.conn = http.client.HTTPConnection(host, int(port), timeout=timeout)
+
+    # Connects to the daemon (otherwise, that happens with the first request).
+    def connect(self):
+        self.conn.connect()
+
+    def close(self):
+        self.conn.close()
+
+    def _request(self, method, path, body=None):
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        self.conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+        return self.conn.getresponse()
+
+    def _check(self, resp):
+        if resp.status >= 400:
+            try:
+                msg = json.loads(resp.read().decode("utf-8"))["error"]
+            except (ValueError, KeyError):
+                msg = resp.reason
+            raise ZeekControlError("zeekctld: %s" % msg)
+
+    def get(self, path):
+        resp = self._request("GET", path)
+        self._check(resp)
+        return json.loads(resp.read().decode("utf-8"))
+
+    # Starts a job running "method", and returns its ID.
+    def submit(self, method, args=(), kwargs=None):
+        resp = self._request("POST", "/jobs/%s" % method, {"args": list(args), "kwargs": kwargs or {}})
+        self._check(resp)
+        return json.loads(resp.read().decode("utf-8"))["id"]
+
+    # Cancels the job "id" if it's still queued, and returns whether it was
+    # cancelled.
+    def cancel(self, id):
+        resp = self._request("POST", "/jobs/%d/cancel" % id)
+        self._check(resp)
+        return json.loads(resp.read().decode("utf-8"))["cancelled"]
+
+    # Runs "method" and calls "output(stream, text)" for each log entry as
+    # it's written.  Returns the job's final state as a dict with the keys
+    # "state", "result" and "error".
+    def call(self, method, args=(), kwargs=None, output=None):
+        resp = self._request("POST", "/call/%s" % method, {"args": list(args), "kwargs": kwargs or {}})
+        self._check(resp)
+        return self.read_log(resp, output)
+
+    # Streams the log of the job "id" like call().
+    def follow(self, id, output=None, since=0):
+        resp = self._request("GET", "/jobs/%d/log?since=%d" % (id, since))
+        self._check(resp)
+        return self.read_log(resp, output)
+
+    # Starts running a zeekctl command line (a list of arguments), and
+    # returns the response to pass to read_log().  The job's ID is in the
+    # response's "X-Zeekctld-Job" header.  Raises ZeekControlError if the
+    # daemon doesn't run the command.
+    def command(self, args):
+        resp = self._request("POST", "/command", {"args": list(args)})
+        self._check(resp)
+        return resp
+
+    # Calls "output(stream, text)" for each log entry of the response "resp",
+    # and returns the job's final state like call().
+    def read_log(self, resp, output=None):
+        outcome = None
+
+        for line in resp:
+            rec = json.loads(line.decode("utf-8"))
+            if "stream" in rec:
+                if output:
+                    output(rec["stream"], rec["text"])
+            else:
+                outcome = rec
+
+        if outcome is None:
+            raise ZeekControlError("zeekctld: connection closed before the job finished")
 
-    def result(self, id, result):
-        return self.call("result", id, result)
+        return outcome
 
-    def getresult(self, id):
-        return self.call("getresult", id)
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        http.client.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.path = path
 
-    def getlog(self, id, since=0):
-        return self.call("getlog", id, since)
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
 
-def main(basedir='/zeek'):
-    logs = Logs()
+def main():
+    logging.basicConfig(format="%(asctime)s zeekctld: %(message)s", level=logging.INFO)
 
-    command_queue = Queue()
-    d = ZeekCtld(command_queue, logs)
+    ui = JobUI()
 
-    d.start()
+    try:
+        zeekctl = ZeekCtl(ui=ui)
+    except ZeekControlError as err:
+        print("Error: %s" % err, file=sys.stderr)
+        return 1
 
-    c = Client(command_queue)
+    loop = asyncio.get_event_loop()
 
-    ww = Thread(target=web.run_app, args=[c])
-    ww.start()
-    print("I Got:", c.sync_call('status'))
-    for x in range(20):
-        time.sleep(1)
+    try:
+        loop.run_until_complete(Daemon(zeekctl, ui).run(loop))
+    except OSError as err:
+        print("Error: %s" % err, file=sys.stderr)
+        return 1
+    finally:
+        loop.close()
+        zeekctl.finish()
 
-if __name__ == "__main__":
-    main()
+    return 0
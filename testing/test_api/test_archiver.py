@@ -0,0 +1,114 @@
+from __future__ import print_function
+import os
+import threading
+
+import pytest
+
+from ZeekControl import archiver
+from ZeekControl import logcatalog
+
+def make_config(tmpdir, **kwargs):
+    scriptsdir = tmpdir.mkdir("scripts")
+    scriptsdir.join("make-archive-name").write("#! /bin/sh\n")
+
+    cfg = {
+        "scriptsdir": str(scriptsdir),
+        "makearchivename": str(scriptsdir.join("make-archive-name")),
+        "logdir": str(tmpdir.join("logs")),
+        "postprocdir": str(tmpdir.join("postprocessors")),
+        "archivecatalogdir": str(tmpdir.join("catalog")),
+        "compresslogs": "0",
+        "compresslogsinflight": "0",
+        "compresscmd": "gzip",
+        "compressextension": "gz",
+    }
+    cfg.update(kwargs)
+    return cfg
+
+def test_default_archive_name():
+    assert archiver.expand_timestamp("15-01-20_15.23.42") == "2015-01-20-15-23-42"
+
+    name = archiver.default_archive_name("conn.log", "ascii", "2015-01-20-15-23-42", "2015-01-20-16-00-00")
+    assert name == "2015-01-20/conn.15:23:42-16:00:00.log"
+
+    name = archiver.default_archive_name("conn.log", "ascii", "2015-01-20-15-23-42", "")
+    assert name == "2015-01-20/conn.15:23:42-current.log"
+
+def test_archive_name_function(tmpdir):
+    f = tmpdir.join("naming.py")
+    f.write("def name(fname, writer, start, end):\n    return '%s/%s' % (writer, fname)\n")
+
+    cfg = {"archivenamefunction": "%s:name" % f}
+    assert archiver.archive_name(cfg, "conn.log", "ascii", "2015-01-20-15-23-42", "") == "ascii/conn.log"
+
+    cfg = {"archivenamefunction": "ZeekControl.archiver:default_archive_name"}
+    name = archiver.archive_name(cfg, "conn.log", "ascii", "2015-01-20-15-23-42", "2015-01-20-16-00-00")
+    assert name == "2015-01-20/conn.15:23:42-16:00:00.log"
+
+    for spec in ("default_archive_name", "%s:missing" % f, "no.such.module:name"):
+        with pytest.raises(archiver.ArchiveError):
+            archiver.archive_name({"archivenamefunction": spec}, "conn.log", "ascii", "2015-01-20-15-23-42", "")
+
+def test_read_config(tmpdir):
+    f = tmpdir.join("zeekctl-config.sh")
+    f.write('logdir="/zeek/logs"\nzeekargs="-f \\"tcp\\""\n')
+    assert archiver.read_config(str(f)) == {"logdir": "/zeek/logs", "zeekargs": '-f "tcp"'}
+
+def test_check_args():
+    args = ["conn.log", "conn", "15-01-20_15.23.42", "15-01-20_16.00.00", "0", "ascii"]
+    assert archiver.check_args(args) is None
+    assert archiver.check_args(args[:5]) is not None
+    assert archiver.check_args(args[:2] + ["2015-01-20"] + args[3:]) is not None
+
+def test_archive(tmpdir):
+    cfg = make_config(tmpdir)
+    nodedir = tmpdir.mkdir("node")
+    nodedir.join("conn.log").write("abc")
+
+    dirfd = os.open(str(nodedir), os.O_RDONLY)
+    try:
+        archiver.archive(cfg, dirfd, ["conn.log", "conn", "15-01-20_15.23.42", "15-01-20_16.00.00", "0", "ascii"])
+    finally:
+        os.close(dirfd)
+
+    dest = tmpdir.join("logs", "2015-01-20", "conn.15:23:42-16:00:00.log")
+    assert dest.read() == "abc"
+    assert not nodedir.join("conn.log").exists()
+    assert nodedir.join(".rotated.conn").exists()
+
+    entries = [e for day in logcatalog.days(cfg["archivecatalogdir"]) for e in logcatalog.read_day(cfg["archivecatalogdir"], day)]
+    assert [(e.base, e.size, e.path) for e in entries] == [("conn", 3, str(dest))]
+
+def test_enqueue(tmpdir):
+    cfg = make_config(tmpdir)
+    configfile = tmpdir.join("zeekctl-config.sh")
+    configfile.write("".join('%s="%s"\n' % item for item in cfg.items()))
+
+    sockpath = str(tmpdir.join("archiver.sock"))
+    server = archiver.Archiver(str(configfile), sockpath, 2)
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+
+    nodedir = tmpdir.mkdir("node")
+    nodedir.join("dns.log").write("abcd")
+
+    try:
+        while not os.path.exists(sockpath):
+            pass
+
+        cwd = os.getcwd()
+        os.chdir(str(nodedir))
+        try:
+            assert archiver.enqueue(sockpath, ["dns.log", "dns", "15-01-20_15.23.42", "15-01-20_16.00.00", "0", "ascii"]) is None
+            assert archiver.enqueue(sockpath, ["dns.log", "dns"]) is not None
+        finally:
+            os.chdir(cwd)
+    finally:
+        server.stop()
+        thread.join()
+
+    # The queued log has been archived, and post-terminate has nothing to
+    # wait for.
+    assert tmpdir.join("logs", "2015-01-20", "dns.15:23:42-16:00:00.log").read() == "abcd"
+    assert not nodedir.listdir(lambda p: p.basename.startswith(".archive-log."))
+    assert not os.path.exists(sockpath)
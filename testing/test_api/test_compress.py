@@ -0,0 +1,58 @@
+from __future__ import print_function
+import gzip
+import zlib
+
+import pytest
+
+from ZeekControl import compress
+
+def make_log(tmpdir, lines):
+    log = tmpdir.join("conn.log")
+    log.write("".join("%d\tconnection\t10.0.0.%d\n" % (i, i % 256) for i in range(lines)))
+    return log
+
+def test_parallel_gzip(tmpdir, monkeypatch):
+    monkeypatch.setattr(compress, "BlockSize", 4096)
+    log = make_log(tmpdir, 5000)
+    dest = tmpdir.join("conn.log.gz")
+
+    (size, csize, secs) = compress.compress_file(str(log), str(dest), "gz", 4, str(tmpdir.join("locks")))
+
+    assert size == len(log.read())
+    assert csize == len(dest.read_binary())
+
+    # Standard tools read the concatenated members as one file.
+    with gzip.open(str(dest), "rb") as f:
+        assert f.read() == log.read_binary()
+
+    # There is one gzip member per block.
+    data = dest.read_binary()
+    members = 0
+    while data:
+        d = zlib.decompressobj(31)
+        d.decompress(data)
+        data = d.unused_data
+        members += 1
+    assert members == (size + 4095) // 4096
+
+def test_unsupported_codec(tmpdir):
+    log = make_log(tmpdir, 10)
+    with pytest.raises(ValueError):
+        compress.compress_file(str(log), str(tmpdir.join("conn.log.bz2")), "bz2", 2, str(tmpdir))
+
+def test_slots(tmpdir):
+    slots = compress.Slots(str(tmpdir), 2)
+    fd1 = slots.acquire()
+    fd2 = slots.acquire()
+    assert fd1 != fd2
+    slots.release(fd1)
+    fd3 = slots.acquire()
+    slots.release(fd2)
+    slots.release(fd3)
+
+def test_log_throughput(tmpdir):
+    statsdir = tmpdir.join("stats")
+    compress.log_throughput(str(statsdir), "conn", "gz", (2000000, 500000, 2.0))
+
+    fields = statsdir.join("compress.log").read().split()
+    assert fields[1:] == ["conn", "gz", "2000000", "500000", "2.000", "1.00"]
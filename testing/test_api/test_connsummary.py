@@ -0,0 +1,98 @@
+from __future__ import print_function
+import gzip
+import json
+
+from ZeekControl import connsummary
+
+Header = """#separator \\x09
+#set_separator\t,
+#empty_field\t(empty)
+#unset_field\t-
+#path\tconn
+#fields\tts\tuid\tid.orig_h\tid.orig_p\tid.resp_h\tid.resp_p\tproto\tservice\tduration\torig_bytes\tresp_bytes
+#types\ttime\tstring\taddr\tport\taddr\tport\tenum\tstring\tinterval\tcount\tcount
+"""
+
+Conns = [
+    (1388442260.1, "10.0.0.1", "192.0.2.1", 80, "tcp", 100, 1000),
+    (1388442261.1, "10.0.0.2", "192.0.2.1", 443, "tcp", 200, 2000),
+    (1388442262.1, "192.0.2.9", "10.0.0.1", 22, "tcp", 50, None),
+    (1388442263.1, "10.0.0.1", "10.0.0.2", 53, "udp", None, None),
+]
+
+def write_ascii(f):
+    f.write(Header)
+    for (ts, src, dst, port, proto, ob, rb) in Conns:
+        f.write("%s\tC\t%s\t5000\t%s\t%d\t%s\t-\t-\t%s\t%s\n" % (ts, src, dst, port, proto, "-" if ob is None else ob, "-" if rb is None else rb))
+    f.write("#close\t2013-12-30-22-30-00\n")
+
+def write_json(f):
+    for (ts, src, dst, port, proto, ob, rb) in Conns:
+        rec = {"ts": ts, "uid": "C", "id.orig_h": src, "id.orig_p": 5000, "id.resp_h": dst, "id.resp_p": port, "proto": proto}
+        if ob is not None:
+            rec["orig_bytes"] = ob
+        if rb is not None:
+            rec["resp_bytes"] = rb
+        f.write(json.dumps(rec) + "\n")
+
+def summary_of(fname, localnets=None):
+    summary = connsummary.Summary(localnets)
+    with connsummary.open_log(fname) as f:
+        summary.read(f)
+    return summary
+
+def test_ascii(tmpdir):
+    log = tmpdir.join("conn.log")
+    with open(str(log), "w") as f:
+        write_ascii(f)
+
+    summary = summary_of(str(log))
+    assert summary.total.conns == 4
+    assert summary.total.bytes == 3350
+    assert summary.total.sources.top(2) == [("10.0.0.2", 2200, 1), ("10.0.0.1", 1100, 2)]
+    assert summary.total.services.top(1) == [("443/tcp", 2200, 1)]
+
+    report = connsummary.summarize(str(log))
+    assert report.startswith(">== Total === ")
+    assert "Top 10 Destinations" in report
+
+def test_json_gzipped(tmpdir):
+    log = tmpdir.join("conn.log.gz")
+    with gzip.open(str(log), "wt") as f:
+        write_json(f)
+
+    nets = tmpdir.join("networks.cfg")
+    nets.write("# local networks\n10.0.0.0/8    Private IP space\n")
+    localnets = connsummary.read_localnets(str(nets))
+
+    summary = summary_of(str(log), localnets)
+    assert summary.total.conns == 4
+    assert summary.total.bytes == 3350
+    assert (summary.incoming.conns, summary.outgoing.conns, summary.local.conns) == (1, 2, 1)
+    assert summary.outgoing.destinations.top(10) == [("192.0.2.1", 3300, 2)]
+
+    ascii = tmpdir.join("conn.log")
+    with open(str(ascii), "w") as f:
+        write_ascii(f)
+
+    # Both formats produce the same report.
+    assert connsummary.summarize(str(log), localnets) == connsummary.summarize(str(ascii), localnets)
+
+def test_sketch():
+    sketch = connsummary.TopSketch(size=10)
+
+    # A few heavy hitters among many light values, in chunks.
+    for chunk in range(20):
+        weights = dict(("10.1.%d.%d" % (chunk, i), 1) for i in range(100))
+        weights["10.0.0.1"] = 1000
+        weights["10.0.0.2"] = 500
+        sketch.merge(weights, dict((k, 1) for k in weights))
+
+    assert len(sketch.weights) == 10
+    assert sketch.top(2) == [("10.0.0.1", 20000, 20), ("10.0.0.2", 10000, 20)]
+    assert sketch.error == 1
+
+def test_fmt_count():
+    assert connsummary.fmt_count(999) == "999"
+    assert connsummary.fmt_count(1400) == "1.4k"
+    assert connsummary.fmt_count(21900000) == "21.9m"
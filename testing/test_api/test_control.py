@@ -0,0 +1,20 @@
+from __future__ import print_function
+
+from ZeekControl import control
+
+class Node:
+    name = "local"
+
+def test_remove_node_prefix():
+    params = ["-U", ".status", "-p", "zeekctl", "-p", "local", "-p", "local", "local", "zeekctl"]
+    assert control._remove_node_prefix(params, Node()) == ["-U", ".status", "-p", "zeekctl", "-p", "local", "local", "zeekctl"]
+    assert control._remove_node_prefix(["local"], Node()) == ["local"]
+
+def test_uses_cluster_node(tmpdir):
+    script = tmpdir.join("local.zeek")
+    script.write('@if ( Cluster::node == "worker-1" )\nredef ignore_checksums = T;\n@endif\n')
+    assert control._uses_cluster_node(str(script))
+
+    script.write("@load misc/loaded-scripts\n")
+    assert not control._uses_cluster_node(str(script))
+    assert not control._uses_cluster_node(str(tmpdir.join("missing.zeek")))
@@ -0,0 +1,68 @@
+from __future__ import print_function
+import json
+import subprocess
+import pytest
+
+from ZeekControl import cron
+from ZeekControl.exceptions import ConfigurationError
+
+class CmdOut:
+    def __init__(self):
+        self.errors = []
+
+    def info(self, msg):
+        pass
+
+    def error(self, msg):
+        self.errors.append(msg)
+
+def test_make_schedule():
+    schedule = dict((task[0], task) for task in cron.make_schedule("watch:10 expire_logs:60:0:30"))
+    assert schedule["watch"] == ("watch", 10, 5, 600, True)
+    assert schedule["expire_logs"] == ("expire_logs", 60, 0, 30, False)
+    assert len(schedule) == len(cron.DefaultSchedule)
+
+    for spec in ("nosuchtask:10", "watch", "watch:0", "watch:x", "watch:1:2:3:4"):
+        with pytest.raises(ConfigurationError):
+            cron.make_schedule(spec)
+
+# Returns true if the process is running (and not just a zombie).
+def is_running(pid):
+    output = subprocess.Popen(["ps", "-o", "stat=", "-p", str(pid)], stdout=subprocess.PIPE).communicate()[0]
+    return output.strip() not in (b"", b"Z")
+
+def test_scheduler(tmpdir, monkeypatch):
+    monkeypatch.setattr(cron, "KillDelay", 0.2)
+    pidfile = str(tmpdir.join("grandchild.pid"))
+
+    # The command gets the task name as its only argument, i.e. "$0".  The
+    # "hang" task starts a process that ignores SIGTERM.
+    hang = 'sh -c "trap \'\' TERM; sleep 30" & echo $! > %s; wait' % pidfile
+    cmd = ["sh", "-c", 'case $0 in slow) sleep 1 ;; hang) %s ;; fail) exit 1 ;; esac' % hang]
+    schedule = [
+        ("fast", 0.2, 0, 10, False),
+        ("slow", 0.2, 0, 10, False),
+        ("hang", 10, 0, 0.5, False),
+        ("fail", 10, 0, 10, False),
+    ]
+
+    statsfile = str(tmpdir.join("cron-tasks.json"))
+    cmdout = CmdOut()
+    scheduler = cron.CronScheduler(cmdout, schedule, cmd, statsfile)
+    scheduler.run(duration=1.5)
+
+    with open(statsfile) as f:
+        stats = json.load(f)
+
+    assert stats["fast"]["runs"] >= 3
+    assert stats["fast"]["skips"] == 0
+    assert stats["slow"]["skips"] > 0
+    assert stats["slow"]["last_duration"] >= 1
+    assert stats["hang"]["timeouts"] == 1
+    assert stats["fail"]["failures"] == 1
+    assert len(cmdout.errors) == 1
+    assert cmdout.errors[0].startswith("cron task hang timed out")
+
+    # The process started by the task has been killed as well.
+    with open(pidfile) as f:
+        assert not is_running(int(f.read()))
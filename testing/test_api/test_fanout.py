@@ -0,0 +1,65 @@
+from __future__ import print_function
+
+from ZeekControl import execute
+from ZeekControl.node import Node
+
+class CmdOut:
+    def info(self, msg):
+        pass
+
+def make_nodes(num):
+    nodes = []
+    for i in range(num):
+        n = Node(None, "host-%02d" % i)
+        n.host = n.name
+        nodes.append(n)
+    return nodes
+
+def test_fanout_direct():
+    nodes = make_nodes(5)
+    pushed = []
+    push = lambda ns: pushed.extend(ns) or [(n, True) for n in ns]
+    relay = None
+
+    results = execute.fanout(nodes, 0, push, relay, CmdOut())
+    assert pushed == nodes
+    assert all(success for (n, success) in results)
+
+def test_fanout_tree():
+    nodes = make_nodes(7)
+    pushed = []
+    relayed = []
+
+    def push(ns):
+        pushed.extend(n.name for n in ns)
+        return [(n, True) for n in ns]
+
+    def relay(pairs):
+        relayed.extend((n.name, r.name) for (n, r) in pairs)
+        return [(n, True) for (n, r) in pairs]
+
+    results = execute.fanout(nodes, 2, push, relay, CmdOut())
+    assert [n for (n, success) in results] == nodes
+    assert pushed == ["host-00", "host-01"]
+    assert relayed == [("host-02", "host-00"), ("host-03", "host-00"),
+                       ("host-04", "host-01"), ("host-05", "host-01"),
+                       ("host-06", "host-02")]
+    assert [n.name for n in execute.fanout_relays(nodes, 2)] == ["host-00", "host-01", "host-02"]
+
+def test_fanout_fallback():
+    nodes = make_nodes(6)
+    pushed = []
+
+    def push(ns):
+        pushed.extend(n.name for n in ns)
+        return [(n, n.name != "host-01") for n in ns]
+
+    def relay(pairs):
+        return [(n, n.name != "host-02") for (n, r) in pairs]
+
+    results = execute.fanout(nodes, 2, push, relay, CmdOut())
+
+    # host-01 failed, so its children are sent to directly, as is host-02
+    # whose relay failed.
+    assert sorted(pushed) == ["host-00", "host-01", "host-02", "host-04", "host-05"]
+    assert [n.name for (n, success) in results if not success] == ["host-01"]
@@ -0,0 +1,190 @@
+from __future__ import print_function
+import os
+import io
+import tarfile
+import subprocess
+
+from ZeekControl import install
+
+class CmdOut:
+    def __init__(self):
+        self.msgs = []
+
+    def info(self, msg):
+        self.msgs.append(msg)
+
+    def error(self, msg):
+        raise AssertionError(msg)
+
+def write(path, data):
+    with open(str(path), "w") as f:
+        f.write(data)
+
+def test_write_file_unchanged(tmpdir):
+    fname = str(tmpdir.join("a.zeek"))
+    assert install.write_file(fname, "x", CmdOut())
+    os.utime(fname, (1, 1))
+
+    assert install.write_file(fname, "x", CmdOut())
+    assert os.stat(fname).st_mtime == 1
+
+    assert install.write_file(fname, "y", CmdOut())
+    assert open(fname).read() == "y"
+    assert os.listdir(str(tmpdir)) == ["a.zeek"]
+
+def test_install_site_policies(tmpdir):
+    src1 = tmpdir.mkdir("src1")
+    src2 = tmpdir.mkdir("src2")
+    dst = tmpdir.mkdir("dst")
+
+    write(src1.join("local.zeek"), "@load foo\n")
+    write(src2.join("local.zeek"), "ignored\n")
+    src1.mkdir("sub")
+    write(src1.join("sub", "a.zeek"), "a\n")
+    write(src1.join("sub", "b.zeek"), "b\n")
+    os.symlink("local.zeek", str(src1.join("link.zeek")))
+
+    srcdirs = [str(src1), str(src2)]
+    assert install.install_site_policies(srcdirs, str(dst), CmdOut())
+    assert install.make_manifest(str(dst)) == install.make_manifest(str(src1))
+    assert dst.join("local.zeek").read() == "@load foo\n"
+    assert os.readlink(str(dst.join("link.zeek"))) == "local.zeek"
+
+    manifest = install.make_manifest(str(dst))
+    os.utime(str(dst.join("sub", "a.zeek")), (1, 1))
+
+    # Nothing changed, nothing is rewritten.
+    cmdout = CmdOut()
+    assert install.install_site_policies(srcdirs, str(dst), cmdout)
+    assert os.stat(str(dst.join("sub", "a.zeek"))).st_mtime == 1
+    assert cmdout.msgs == []
+    assert install.make_manifest(str(dst)) == manifest
+
+    write(src1.join("sub", "a.zeek"), "changed\n")
+    os.unlink(str(src1.join("sub", "b.zeek")))
+
+    cmdout = CmdOut()
+    assert install.install_site_policies(srcdirs, str(dst), cmdout)
+    assert dst.join("sub", "a.zeek").read() == "changed\n"
+    assert not dst.join("sub", "b.zeek").exists()
+    assert cmdout.msgs == ["removing 1 obsolete site policy files ..."]
+    assert install.make_manifest(str(dst)) == install.make_manifest(str(src1))
+
+def test_install_site_policies_dir_replaced(tmpdir):
+    src = tmpdir.mkdir("src")
+    dst = tmpdir.mkdir("dst")
+
+    src.mkdir("x")
+    write(src.join("x", "a.zeek"), "a\n")
+    assert install.install_site_policies([str(src)], str(dst), CmdOut())
+
+    src.join("x").remove()
+    write(src.join("x"), "now a file\n")
+    assert install.install_site_policies([str(src)], str(dst), CmdOut())
+    assert dst.join("x").read() == "now a file\n"
+
+def test_manifest_delta(tmpdir):
+    tree = tmpdir.mkdir("tree")
+    write(tree.join("a"), "a\n")
+    tree.mkdir("d")
+    write(tree.join("d", "b"), "b\n")
+
+    root = str(tree).lstrip("/")
+    old = install.make_sync_manifest([str(tree)])
+    assert old[root] == "dir"
+    assert old[root + "/d"] == "dir"
+
+    write(tree.join("a"), "changed\n")
+    tree.join("d").remove()
+    write(tree.join("d"), "now a file\n")
+    new = install.make_sync_manifest([str(tree)])
+
+    changed, removed = install.manifest_delta(old, new)
+    assert changed == [root + "/a", root + "/d"]
+    assert removed == [root + "/d/b", root + "/d"]
+    assert install.manifest_delta(new, new) == ([], [])
+
+    digest = install.manifest_digest(new)
+    mdir = str(tmpdir.join("manifests"))
+    assert install.save_manifest(mdir, digest, new, CmdOut())
+    assert install.load_manifest(mdir, digest) == new
+    install.expire_manifests(mdir, [])
+    assert install.load_manifest(mdir, digest) is None
+
+def test_apply_delta_retargeted_symlink(tmpdir):
+    # A symlink to a directory now points to another directory.
+    tmpdir.mkdir("old")
+    tmpdir.mkdir("new")
+    link = tmpdir.join("current")
+    os.symlink("old", str(link))
+
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w:gz") as tar:
+        info = tarfile.TarInfo(str(link).lstrip("/"))
+        info.type = tarfile.SYMTYPE
+        info.linkname = "new"
+        tar.addfile(info)
+
+    helper = os.path.join(os.path.dirname(__file__), "..", "..", "bin", "helpers", "apply-delta")
+    proc = subprocess.Popen(["bash", helper, str(tmpdir.join("stage"))], stdin=subprocess.PIPE)
+    proc.communicate(archive.getvalue())
+
+    assert proc.returncode == 0
+    assert os.readlink(str(link)) == "new"
+    assert tmpdir.join("old").listdir() == []
+    assert not tmpdir.join("current.zeekctl-tmp").check(link=1)
+
+def test_digest_cache(tmpdir):
+    write(tmpdir.join("a"), "a\n")
+    cache = {}
+    first = install.make_sync_manifest([str(tmpdir)], cache)
+    assert str(tmpdir.join("a")) in cache
+
+    # A stale cache entry must not be used.
+    write(tmpdir.join("a"), "bb\n")
+    second = install.make_sync_manifest([str(tmpdir)], cache)
+    assert second != first
+    assert second == install.make_sync_manifest([str(tmpdir)])
+
+    tmpdir.join("a").remove()
+    install.make_sync_manifest([str(tmpdir)], cache)
+    assert cache == {}
+
+def test_generations(tmpdir):
+    gendir = str(tmpdir.join("generations"))
+    link = str(tmpdir.join("current"))
+
+    # A directory from an install without generations is cloned and replaced.
+    tmpdir.mkdir("current").mkdir("site")
+    write(tmpdir.join("current", "site", "local.zeek"), "a\n")
+    assert install.active_generation(link, gendir) is None
+
+    gen1 = install.new_generation(gendir, link, CmdOut())
+    assert gen1 == 1
+    assert install.activate_generation(link, os.path.join(gendir, "1"), CmdOut())
+    assert install.active_generation(link, gendir) == 1
+    assert tmpdir.join("current", "site", "local.zeek").read() == "a\n"
+
+    # Changing a file in a new generation leaves the old one untouched.
+    gen2 = install.new_generation(gendir, os.path.join(gendir, "1"), CmdOut())
+    assert gen2 == 2
+    assert install.write_file(os.path.join(gendir, "2", "site", "local.zeek"), "b\n", CmdOut())
+    assert install.activate_generation(link, os.path.join(gendir, "2"), CmdOut())
+    assert tmpdir.join("current", "site", "local.zeek").read() == "b\n"
+    assert open(os.path.join(gendir, "1", "site", "local.zeek")).read() == "a\n"
+
+    install.new_generation(gendir, os.path.join(gendir, "2"), CmdOut())
+    assert install.generations(gendir) == [1, 2, 3]
+
+    # The active generation is never removed.
+    assert install.expire_generations(gendir, 1, 2, CmdOut())
+    assert install.generations(gendir) == [2, 3]
+    assert install.active_generation(link, gendir) == 2
+
+    # Other spellings of the generations directory refer to the same one.
+    os.symlink(gendir, str(tmpdir.join("gens")))
+    assert install.active_generation(link, gendir + "/") == 2
+    assert install.active_generation(link, str(tmpdir.join("gens"))) == 2
+    assert install.activate_generation(link, "generations/3", CmdOut())
+    assert install.active_generation(link, gendir) == 3
+    assert install.active_generation(link, str(tmpdir.join("elsewhere"))) is None
@@ -0,0 +1,84 @@
+from __future__ import print_function
+import os
+
+from ZeekControl import iothrottle
+
+def write_diskstats(f, device, ticks):
+    dev = os.stat(str(f.dirpath())).st_dev
+    f.write("   %d       %d %s 100 0 200 300 400 0 500 600 0 %d 700\n" % (os.major(dev), os.minor(dev), device, ticks))
+
+def test_device(tmpdir):
+    diskstats = tmpdir.join("diskstats")
+    write_diskstats(diskstats, "sdz1", 1000)
+
+    assert iothrottle.device_of(str(tmpdir), str(diskstats)) == "sdz1"
+    assert iothrottle.io_ticks("sdz1", str(diskstats)) == 1000
+    assert iothrottle.io_ticks("sdy", str(diskstats)) is None
+
+def test_utilization(tmpdir, monkeypatch):
+    diskstats = tmpdir.join("diskstats")
+    write_diskstats(diskstats, "sdz1", 1000)
+
+    now = [100.0]
+    monkeypatch.setattr(iothrottle.time, "time", lambda: now[0])
+
+    throttle = iothrottle.Throttle(maxutil=50, path=str(tmpdir), diskstats=str(diskstats))
+    assert throttle.utilization() == 0.0
+
+    # 800ms of I/O during the last second.
+    now[0] += 1.0
+    write_diskstats(diskstats, "sdz1", 1800)
+    assert throttle.utilization() == 80.0
+
+    # The sample is kept for the rest of the interval.
+    write_diskstats(diskstats, "sdz1", 1800)
+    now[0] += 0.5
+    assert throttle.utilization() == 80.0
+
+def test_rate(monkeypatch):
+    now = [100.0]
+    slept = []
+
+    def sleep(secs):
+        slept.append(secs)
+        now[0] += secs
+
+    monkeypatch.setattr(iothrottle.time, "time", lambda: now[0])
+    monkeypatch.setattr(iothrottle.time, "sleep", sleep)
+
+    throttle = iothrottle.Throttle(rate=1000)
+    throttle.consume(500)
+    throttle.consume(500)
+    throttle.consume(1000)
+
+    assert slept == [0.5, 0.5]
+    assert throttle.due == 102.0
+
+def test_pause(tmpdir, monkeypatch):
+    diskstats = tmpdir.join("diskstats")
+    write_diskstats(diskstats, "sdz1", 0)
+
+    now = [100.0]
+    ticks = [0]
+
+    def sleep(secs):
+        # The disk is busy for three more seconds.
+        now[0] += secs
+        ticks[0] += 1000 if now[0] <= 103 else 0
+        write_diskstats(diskstats, "sdz1", ticks[0])
+
+    monkeypatch.setattr(iothrottle.time, "time", lambda: now[0])
+    monkeypatch.setattr(iothrottle.time, "sleep", sleep)
+
+    throttle = iothrottle.Throttle(maxutil=50, path=str(tmpdir), diskstats=str(diskstats))
+    throttle.utilization()
+    sleep(1.0)
+
+    throttle.consume(100)
+    assert now[0] == 104.0
+
+def test_from_config():
+    assert iothrottle.from_config({"archiveiorate": "0", "archiveiomaxutil": "0"}) is None
+    assert iothrottle.from_config({"archiveiorate": "2"}).rate == 2 * 1024 * 1024
+    assert iothrottle.ionice_args("idle") == ["-c", "3"]
+    assert iothrottle.ionice_args("realtime") is None
@@ -0,0 +1,189 @@
+from __future__ import print_function
+import os
+import time
+import threading
+
+import pytest
+
+from ZeekControl import config
+from ZeekControl import lock
+
+class UI:
+    def __init__(self):
+        self.messages = []
+
+    def info(self, txt):
+        self.messages.append(txt)
+    error = warn = info
+
+class Config:
+    def __init__(self, lockfile):
+        self.lockfile = lockfile
+        self.helperdir = "/nonexistent"
+
+# A process other than the current one, which the lock takes as running.
+OtherPID = 99999
+
+@pytest.fixture
+def lockfile(tmpdir, monkeypatch):
+    lockfile = str(tmpdir.join("lock"))
+    monkeypatch.setattr(config, "Config", Config(lockfile), raising=False)
+    monkeypatch.setattr(lock, "_is_running", lambda pid: int(pid) in (os.getpid(), OtherPID))
+    yield lockfile
+    assert lock.lockCount == {"shared": 0, "exclusive": 0}
+
+def test_shared(lockfile):
+    ui = UI()
+    sharedfile = "%s.shared.%d" % (lockfile, os.getpid())
+
+    assert lock.lock(ui, shared=True)
+    assert lock.lock(ui, shared=True)
+    assert os.path.exists(sharedfile)
+    assert not lock.holds_exclusive()
+
+    # The process may take the exclusive lock while holding a shared one.
+    assert lock.lock(ui)
+    assert lock.holds_exclusive()
+    lock.unlock(ui)
+
+    lock.unlock(ui, shared=True)
+    assert os.path.exists(sharedfile)
+    lock.unlock(ui, shared=True)
+    assert not os.path.exists(sharedfile)
+    assert not os.path.exists(lockfile)
+    assert ui.messages == []
+
+def test_exclusive_waits_for_shared(lockfile, monkeypatch):
+    ui = UI()
+    sharedfile = "%s.shared.%d" % (lockfile, OtherPID)
+    with open(sharedfile, "w") as f:
+        f.write("%d\n" % OtherPID)
+
+    # A stale shared lock is removed right away.
+    with open("%s.shared.1" % lockfile, "w") as f:
+        f.write("1\n")
+
+    # The other process releases its shared lock after a while.
+    sleeps = []
+    def sleep(secs):
+        sleeps.append(secs)
+        if len(sleeps) == 3:
+            os.unlink(sharedfile)
+
+    monkeypatch.setattr(lock.time, "sleep", sleep)
+
+    assert lock.lock(ui)
+    assert len(sleeps) == 3
+    assert ui.messages == ["removing stale shared lock", "waiting for shared lock (owned by PID %d) ..." % OtherPID]
+    lock.unlock(ui)
+
+def test_shared_waits_for_exclusive(lockfile, monkeypatch):
+    ui = UI()
+    with open(lockfile, "w") as f:
+        f.write("%d\n" % OtherPID)
+
+    monkeypatch.setattr(lock.time, "sleep", lambda secs: None)
+
+    assert not lock.lock(ui, shared=True, showwait=False)
+    assert not os.path.exists("%s.shared.%d" % (lockfile, os.getpid()))
+
+    # The lock is granted once the other process is gone.
+    monkeypatch.setattr(lock, "_is_running", lambda pid: int(pid) == os.getpid())
+    assert lock.lock(ui, shared=True)
+    assert ui.messages == ["removing stale lock"]
+    lock.unlock(ui, shared=True)
+
+def test_nested_shared_waits_for_exclusive(lockfile, monkeypatch):
+    ui = UI()
+    sharedfile = "%s.shared.%d" % (lockfile, os.getpid())
+    assert lock.lock(ui, shared=True)
+
+    # Another process now waits for the exclusive lock, and gets and releases
+    # it after the shared lock is released.
+    with open(lockfile, "w") as f:
+        f.write("%d\n" % OtherPID)
+
+    sleeps = []
+    def sleep(secs):
+        sleeps.append(secs)
+        if len(sleeps) == 2:
+            lock.unlock(ui, shared=True)
+            assert not os.path.exists(sharedfile)
+            os.unlink(lockfile)
+
+    monkeypatch.setattr(lock.time, "sleep", sleep)
+
+    assert lock.lock(ui, shared=True)
+    assert len(sleeps) == 2
+    assert os.path.exists(sharedfile)
+    assert ui.messages == ["waiting for lock (owned by PID %d) ..." % OtherPID]
+    lock.unlock(ui, shared=True)
+    assert not os.path.exists(sharedfile)
+
+def test_unlock_while_waiting(lockfile, monkeypatch):
+    ui = UI()
+    sharedfile = "%s.shared.%d" % (lockfile, OtherPID)
+    with open(sharedfile, "w") as f:
+        f.write("%d\n" % OtherPID)
+
+    waiting = threading.Event()
+    proceed = threading.Event()
+    def sleep(secs):
+        waiting.set()
+        assert proceed.wait(5)
+
+    monkeypatch.setattr(lock.time, "sleep", sleep)
+
+    assert lock.lock(ui, shared=True)
+
+    # While a thread waits for the other process to release its shared lock,
+    # the others can still release theirs.
+    locked = []
+    thread = threading.Thread(target=lambda: locked.append(lock.lock(ui, showwait=False)))
+    thread.start()
+    assert waiting.wait(5)
+    lock.unlock(ui, shared=True)
+
+    os.unlink(sharedfile)
+    proceed.set()
+    thread.join()
+    assert locked == [True]
+    assert lock.holds_exclusive()
+    lock.unlock(ui)
+
+def test_exclude_readers():
+    reading = threading.Event()
+    done = threading.Event()
+    events = []
+
+    def reader():
+        with lock.reading():
+            reading.set()
+            done.wait()
+            events.append("read")
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    reading.wait()
+
+    # The current thread may read while it excludes the others.
+    def release():
+        time.sleep(0.1)
+        done.set()
+
+    threading.Thread(target=release).start()
+    with lock.exclude_readers():
+        events.append("excluded")
+        with lock.reading():
+            pass
+
+        # Other threads wait until the readers are no longer excluded.
+        second = threading.Thread(target=reader)
+        second.start()
+        time.sleep(0.1)
+        events.append("released")
+
+    second.join()
+    thread.join()
+    assert events == ["read", "excluded", "released", "read"]
+    assert not lock.readers
@@ -0,0 +1,136 @@
+from __future__ import print_function
+import os
+import time
+import threading
+
+from ZeekControl import logcatalog
+
+DAY = 86400
+
+def archive(tmpdir, catalogdir, t, name, size):
+    archivedir = tmpdir.join("logs", logcatalog.day_of(t))
+    archivedir.ensure(dir=True)
+    path = archivedir.join(name)
+    path.write("x" * size)
+    entry = logcatalog.Entry(t, "-", "-", size, "none", name.split(".")[0], str(path))
+    logcatalog.add(catalogdir, entry)
+    return path
+
+def test_expire_age(tmpdir):
+    catalogdir = str(tmpdir.join("catalog"))
+    logdir = str(tmpdir.join("logs"))
+    now = 1000 * DAY + 12 * 3600
+
+    old = archive(tmpdir, catalogdir, now - 3 * DAY, "conn.log", 10)
+    kept = archive(tmpdir, catalogdir, now - 3 * DAY + 60, "dns.log", 10)
+    new = archive(tmpdir, catalogdir, now - 60, "conn.log", 10)
+
+    assert logcatalog.expire(catalogdir, logdir, now, 2 * DAY, 0, ["dns*"]) == (1, 10)
+    assert not old.exists()
+    assert kept.exists()
+    assert new.exists()
+
+    entries = [e.path for day in logcatalog.days(catalogdir) for e in logcatalog.read_day(catalogdir, day)]
+    assert entries == [str(kept), str(new)]
+
+    # Nothing more to do.
+    assert logcatalog.expire(catalogdir, logdir, now, 2 * DAY, 0, ["dns*"]) == (0, 0)
+
+def test_expire_size(tmpdir):
+    catalogdir = str(tmpdir.join("catalog"))
+    logdir = str(tmpdir.join("logs"))
+    now = 1000 * DAY
+
+    logs = [archive(tmpdir, catalogdir, now - (5 - i) * DAY, "conn.%d.log" % i, 100) for i in range(5)]
+
+    # The oldest logs are removed first, until the total fits.
+    assert logcatalog.expire(catalogdir, logdir, now, 0, 250, []) == (3, 300)
+    assert [log.exists() for log in logs] == [False, False, False, True, True]
+
+    # Empty archive directories are removed as well.
+    assert not os.path.exists(os.path.dirname(str(logs[0])))
+    assert len(logcatalog.days(catalogdir)) == 2
+
+def test_build(tmpdir):
+    logdir = tmpdir.mkdir("logs")
+    logdir.mkdir("2013-12-30").join("conn.22:24:20-22:30:00.log.gz").write("abc")
+    logdir.mkdir("stats").join("stats.log").write("not archived")
+    catalogdir = str(tmpdir.join("catalog"))
+
+    # Logs archived after upgrading are cataloged already.
+    now = 1000 * DAY
+    new = archive(tmpdir, catalogdir, now, "dns.log", 5)
+
+    assert logcatalog.build(catalogdir, str(logdir)) == 2
+
+    entries = [e for day in logcatalog.days(catalogdir) for e in logcatalog.read_day(catalogdir, day)]
+    assert [(e.base, e.compression, e.size) for e in entries] == [("dns", "none", 5), ("conn", "gz", 3)]
+    assert entries[0].path == str(new)
+
+def test_parse_entry():
+    entry = logcatalog.Entry(1234, "2013-12-30-22-24-20", "2013-12-30-22-30-00", 26, "gz", "conn", "/logs/conn.log.gz")
+    line = logcatalog.format_entry(entry)
+    assert line.count("\t") == 6
+    assert logcatalog.parse_entry(line) == entry
+    assert logcatalog.parse_entry("garbage\n") is None
+
+def test_expire_concurrent_add(tmpdir, monkeypatch):
+    catalogdir = str(tmpdir.join("catalog"))
+    logdir = str(tmpdir.join("logs"))
+    now = 1000 * DAY + 12 * 3600
+
+    old = archive(tmpdir, catalogdir, now - 3 * 3600, "conn.log", 10)
+    kept = archive(tmpdir, catalogdir, now - 60, "dns.log", 10)
+    logcatalog.build(catalogdir, logdir)
+
+    # A log is archived while expire is removing the old one.
+    remove = logcatalog._remove
+    added = []
+    def remove_and_add(path, logdir):
+        added.append(archive(tmpdir, catalogdir, now - 30, "http.log", 10))
+        return remove(path, logdir)
+
+    monkeypatch.setattr(logcatalog, "_remove", remove_and_add)
+
+    assert logcatalog.expire(catalogdir, logdir, now, 3600, 0, []) == (1, 10)
+    assert not old.exists()
+
+    # The entry added meanwhile is kept, after the older ones.
+    entries = [e.path for e in logcatalog.read_day(catalogdir, logcatalog.day_of(now))]
+    assert entries == [str(kept), str(added[0])]
+
+def test_add_waits_for_lock(tmpdir):
+    catalogdir = str(tmpdir.join("catalog"))
+    now = 1000 * DAY
+    thread = threading.Thread(target=archive, args=(tmpdir, catalogdir, now, "conn.log", 10))
+
+    with logcatalog._locked(catalogdir):
+        thread.start()
+        time.sleep(0.1)
+        assert logcatalog.read_day(catalogdir, logcatalog.day_of(now)) == []
+
+    thread.join()
+    assert len(logcatalog.read_day(catalogdir, logcatalog.day_of(now))) == 1
+
+def test_expire_rebuilds(tmpdir):
+    catalogdir = str(tmpdir.join("catalog"))
+    logdir = str(tmpdir.join("logs"))
+    now = 1000 * DAY
+
+    archive(tmpdir, catalogdir, now - 3 * DAY, "conn.log", 10)
+    logcatalog.build(catalogdir, logdir)
+    marker = os.path.join(catalogdir, logcatalog._BuiltMarker)
+    os.utime(marker, (now, now))
+
+    # A log archived without being added to the catalog.
+    uncataloged = tmpdir.join("logs", logcatalog.day_of(now - 3 * DAY), "dns.log")
+    uncataloged.write("x" * 10)
+    os.utime(str(uncataloged), (now - 3 * DAY, now - 3 * DAY))
+
+    assert logcatalog.expire(catalogdir, logdir, now, 2 * DAY, 0, []) == (1, 10)
+    assert uncataloged.exists()
+
+    # Once the catalog is rebuilt, the log is found.
+    later = now + logcatalog.RebuildInterval + 1
+    assert logcatalog.expire(catalogdir, logdir, later, 2 * DAY, 0, []) == (1, 10)
+    assert not uncataloged.exists()
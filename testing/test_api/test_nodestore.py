@@ -0,0 +1,76 @@
+from __future__ import print_function
+import pytest
+
+from ZeekControl.config import NodeStore
+from ZeekControl.exceptions import ConfigurationError
+from ZeekControl.node import Node
+
+def make_node(name, type, host, count, addr="10.0.0.1"):
+    n = Node(None, name)
+    n.type = type
+    n.host = host
+    n.addr = addr
+    n.count = count
+    return n
+
+def make_store():
+    s = NodeStore()
+    s.add_node(make_node("manager", "manager", "mgr", 1, "10.0.0.1"))
+    s.add_node(make_node("proxy-1", "proxy", "mgr", 1, "10.0.0.1"))
+    s.add_node(make_node("worker-1-2", "worker", "w1", 2, "10.0.0.2"))
+    s.add_node(make_node("worker-1-1", "worker", "w1", 1, "10.0.0.2"))
+    s.add_node(make_node("worker-2", "worker", "w2", 3, "10.0.0.3"))
+    return s
+
+def test_nodestore_sorted():
+    s = make_store()
+
+    names = [n.name for n in s.nodes()]
+    assert names == ["manager", "proxy-1", "worker-1-1", "worker-1-2", "worker-2"]
+
+    names = [n.name for n in s.nodes("workers")]
+    assert names == ["worker-1-1", "worker-1-2", "worker-2"]
+
+    assert [n.name for n in s.nodes("worker-2")] == ["worker-2"]
+    assert s.nodes("Worker-2") == []
+    assert s.nodes("nosuchnode") == []
+
+def test_nodestore_views_are_copies():
+    s = make_store()
+
+    nodes = s.nodes()
+    nodes.pop()
+    assert len(s.nodes()) == 5
+
+def test_nodestore_duplicate():
+    s = make_store()
+
+    with pytest.raises(ConfigurationError):
+        s.add_node(make_node("WORKER-2", "worker", "w3", 4))
+
+def test_nodestore_indexes():
+    s = make_store()
+
+    assert s.get("MANAGER").name == "manager"
+    assert "proxy-1" in s
+    assert [n.name for n in s.by_host("w1")] == ["worker-1-1", "worker-1-2"]
+    assert [n.name for n in s.by_addr("10.0.0.1")] == ["manager", "proxy-1"]
+    assert len(s.by_type("worker")) == 3
+
+def test_nodestore_hosts():
+    s = make_store()
+
+    assert [n.name for n in s.hosts()] == ["manager", "worker-1-1", "worker-2"]
+    assert [n.name for n in s.hosts(exclude_addrs=["10.0.0.1"])] == ["worker-1-1", "worker-2"]
+    assert [n.name for n in s.hosts("workers")] == ["worker-1-1", "worker-2"]
+
+def test_node_plugin_keys():
+    Node.addKey("test_key")
+    n = make_node("worker-1", "worker", "w1", 1)
+    assert n.test_key == ""
+
+    m = n.copy()
+    m.env_vars = {"A": "1"}
+    assert n.env_vars == ""
+    assert dict(m.items())["test_key"] == ""
+    assert "addr=10.0.0.1" in m.describe()
@@ -0,0 +1,156 @@
+from __future__ import print_function
+import os
+import sys
+
+from ZeekControl import pluginreg
+
+PLUGIN = '''
+import ZeekControl.plugin
+
+class %(cls)s(ZeekControl.plugin.Plugin):
+    def __init__(self):
+        super(%(cls)s, self).__init__(apiversion=1)
+
+    def name(self):
+        return "%(name)s"
+
+    def pluginVersion(self):
+        return 1
+
+    def options(self):
+        return [("enabled", "bool", False, "Enable the plugin.")]
+
+    def commands(self):
+        return [("hello", "", "Say hello")]
+
+    def cmd_custom(self, cmd, args, cmdout):
+        return "hello " + args
+'''
+
+class CmdOut:
+    def __init__(self):
+        self.warnings = []
+
+    def warn(self, msg):
+        self.warnings.append(msg)
+
+def write_plugin(tmpdir, cls, name):
+    with open(os.path.join(str(tmpdir), "%s.py" % name), "w") as f:
+        f.write(PLUGIN % {"cls": cls, "name": name})
+
+def load(tmpdir, manifest):
+    cmdout = CmdOut()
+    reg = pluginreg.PluginRegistry(manifest)
+    reg.addDir(str(tmpdir))
+    reg.loadPlugins(cmdout, None)
+    reg.initPlugins(cmdout)
+    reg.initPluginCmds()
+    assert cmdout.warnings == []
+    return reg
+
+def test_plugin_manifest(tmpdir):
+    write_plugin(tmpdir, "LazyTest", "lazytest")
+    manifest = str(tmpdir.join("manifest.json"))
+
+    reg = load(tmpdir, manifest)
+    assert os.path.exists(manifest)
+    assert not isinstance(reg._plugins[0], pluginreg._LazyPlugin)
+
+    sys.modules.pop("lazytest", None)
+    reg = load(tmpdir, manifest)
+    p = reg._plugins[0]
+    assert isinstance(p, pluginreg._LazyPlugin)
+    assert p.activated
+    assert p.options() == [("enabled", "bool", False, "Enable the plugin.")]
+    assert reg.allCustomCommands() == [("lazytest.hello", "", "Say hello")]
+    assert reg.cmdPre("nodes")
+    assert "lazytest" not in sys.modules
+
+    assert reg.runCustomCommand("lazytest.hello", "world", CmdOut()) == "hello world"
+    assert "lazytest" in sys.modules
+    assert not isinstance(reg._plugins[0], pluginreg._LazyPlugin)
+    assert reg._plugins[0].activated
+
+def test_plugin_manifest_invalidated(tmpdir):
+    write_plugin(tmpdir, "LazyTest2", "lazytest2")
+    manifest = str(tmpdir.join("manifest.json"))
+    load(tmpdir, manifest)
+
+    with open(str(tmpdir.join("lazytest2.py")), "a") as f:
+        f.write("\n# changed\n")
+
+    sys.modules.pop("lazytest2", None)
+    reg = load(tmpdir, manifest)
+    assert not isinstance(reg._plugins[0], pluginreg._LazyPlugin)
+
+def test_plugin_no_manifest(tmpdir):
+    write_plugin(tmpdir, "LazyTest3", "lazytest3")
+
+    reg = load(tmpdir, None)
+    reg = load(tmpdir, None)
+    assert not isinstance(reg._plugins[0], pluginreg._LazyPlugin)
+    assert not tmpdir.listdir(lambda f: f.ext == ".json")
+
+def test_plugin_manifest_inactive(tmpdir):
+    write_plugin(tmpdir, "LazyTest4", "lazytest4")
+    with open(str(tmpdir.join("lazytest4.py")), "a") as f:
+        f.write("\n    def init(self):\n        return False\n")
+        f.write("\n    def pureInit(self):\n        return True\n")
+
+    manifest = str(tmpdir.join("manifest.json"))
+    cmdout = CmdOut()
+
+    def load_with_key(key):
+        sys.modules.pop("lazytest4", None)
+        reg = pluginreg.PluginRegistry(manifest)
+        reg.addDir(str(tmpdir))
+        reg.loadPlugins(cmdout, None)
+        reg.initPlugins(cmdout, key)
+        return reg
+
+    load_with_key("cfg1")
+
+    # init() isn't called again for the same configuration.
+    reg = load_with_key("cfg1")
+    assert not reg._plugins[0].activated
+    assert "lazytest4" not in sys.modules
+
+    reg = load_with_key("cfg2")
+    assert not reg._plugins[0].activated
+    assert "lazytest4" in sys.modules
+    assert cmdout.warnings == []
+
+def test_plugin_manifest_impure_init(tmpdir):
+    write_plugin(tmpdir, "LazyTest6", "lazytest6")
+    with open(str(tmpdir.join("lazytest6.py")), "a") as f:
+        f.write("\n    def init(self):\n        self.error(\"invalid configuration\")\n        return False\n")
+
+    manifest = str(tmpdir.join("manifest.json"))
+    cmdout = CmdOut()
+
+    for i in range(2):
+        sys.modules.pop("lazytest6", None)
+        reg = pluginreg.PluginRegistry(manifest)
+        reg.addDir(str(tmpdir))
+        reg.loadPlugins(cmdout, None)
+        reg.initPlugins(cmdout, "cfg1")
+
+        # init() is called every time, so that its error is reported again.
+        assert not reg._plugins[0].activated
+        assert "lazytest6" in sys.modules
+
+def test_plugin_manifest_warnings(tmpdir):
+    write_plugin(tmpdir, "LazyTest5", "lazytest5")
+    with open(str(tmpdir.join("lazytest5.py")), "a") as f:
+        f.write("\n    def prefix(self):\n        return \"lazy.test\"\n")
+
+    manifest = str(tmpdir.join("manifest.json"))
+    cmdout = CmdOut()
+    reg = pluginreg.PluginRegistry(manifest)
+    reg.addDir(str(tmpdir))
+    reg.loadPlugins(cmdout, None)
+
+    # The plugin is still loaded, but not cached, so the warning repeats.
+    assert len(reg._plugins) == 1
+    assert len(cmdout.warnings) == 1
+    assert not reg._manifest
@@ -0,0 +1,81 @@
+from __future__ import print_function
+import time
+
+from ZeekControl import postproc
+
+Args = ["conn.log", "conn", "15-01-20_15.23.42", "15-01-20_16.00.00", "0", "ascii"]
+
+def make_pp(ppdir, name, header="", body=""):
+    f = ppdir.join(name)
+    f.write("#! /bin/sh\n%s\n%s\necho %s $1 >> trace\n" % (header, body, name))
+    f.chmod(0o755)
+
+def test_parse(tmpdir):
+    ppdir = tmpdir.mkdir("postprocessors")
+    make_pp(ppdir, "a", "# postprocessor-streams: conn, dns\n# postprocessor-stage: after-move\n# postprocessor-concurrency: 2\n# postprocessor-after: b")
+    make_pp(ppdir, "b")
+    make_pp(ppdir, "c")
+    make_pp(ppdir, "d", "# postprocessor-stage: sometime")
+
+    pps = dict((pp.name, pp) for pp in postproc.load(str(ppdir)))
+
+    a = pps["a"]
+    assert (a.streams, a.stage, a.concurrency, a.after) == (["conn", "dns"], postproc.AfterMove, 2, ["b"])
+    assert a.handles("dns") and not a.handles("http")
+
+    # Undeclared ones (including invalid ones) run in order of their names.
+    assert (pps["b"].after, pps["c"].after, pps["d"].after) == ([], ["b"], ["c"])
+    assert pps["d"].stage == postproc.BeforeMove
+
+def test_run(tmpdir, monkeypatch):
+    ppdir = tmpdir.mkdir("postprocessors")
+    make_pp(ppdir, "slow1", "# postprocessor-streams: conn", "sleep 0.5")
+    make_pp(ppdir, "slow2", "# postprocessor-streams: conn", "sleep 0.5")
+    make_pp(ppdir, "then", "# postprocessor-after: slow1 slow2")
+    make_pp(ppdir, "dnsonly", "# postprocessor-streams: dns")
+    make_pp(ppdir, "moved", "# postprocessor-stage: after-move")
+
+    pps = postproc.load(str(ppdir))
+    monkeypatch.chdir(str(tmpdir))
+
+    start = time.time()
+    results = postproc.run(pps, postproc.BeforeMove, Args, str(tmpdir.join("locks")))
+    secs = time.time() - start
+
+    # The two independent ones ran in parallel, and the dependent one after.
+    assert secs < 0.9
+    assert [name for (name, rc, t) in results][-1] == "then"
+    assert sorted(name for (name, rc, t) in results) == ["slow1", "slow2", "then"]
+    assert all(rc == 0 for (name, rc, t) in results)
+
+    results = postproc.run(pps, postproc.AfterMove, ["/logs/conn.log"] + Args[1:])
+    assert [name for (name, rc, t) in results] == ["moved"]
+    assert tmpdir.join("trace").readlines()[-1] == "moved /logs/conn.log\n"
+
+    statslog = tmpdir.join("stats.log")
+    postproc.log_timing(str(statslog), "logger", results)
+    fields = statslog.read().split()
+    assert fields[1:4] == ["logger", "postprocessor", "moved"]
+
+def test_cycle(tmpdir, monkeypatch):
+    ppdir = tmpdir.mkdir("postprocessors")
+    make_pp(ppdir, "x", "# postprocessor-after: y")
+    make_pp(ppdir, "y", "# postprocessor-after: x")
+
+    monkeypatch.chdir(str(tmpdir))
+    results = postproc.run(postproc.load(str(ppdir)), postproc.BeforeMove, Args)
+    assert [name for (name, rc, t) in results] == ["x", "y"]
+
+def test_timing_enabled(tmpdir):
+    statefile = tmpdir.join("state.db")
+    cfg = {"statslogenable": "1", "statslog": str(tmpdir.join("stats.log")), "statefile": str(statefile)}
+
+    # Without zeekctl's state file, this is a host on which nothing collects
+    # the stats log.
+    assert not postproc.timing_enabled(cfg)
+
+    statefile.write("")
+    assert postproc.timing_enabled(cfg)
+
+    cfg["statslogenable"] = "0"
+    assert not postproc.timing_enabled(cfg)
@@ -0,0 +1,71 @@
+from __future__ import print_function
+import os
+import time
+import threading
+import subprocess
+
+from ZeekControl import postterminate
+
+def test_parse_filename():
+    assert postterminate.parse_filename("conn.2015-01-20-15-23-42") == ("conn", "15-01-20_15.23.42")
+    assert postterminate.parse_filename("conn-15-01-20_15.23.42") == ("conn", "15-01-20_15.23.42")
+    assert postterminate.parse_filename("conn") == ("conn", None)
+    assert postterminate.parse_filename("stdout") == ("stdout", None)
+
+def test_remaining_logs(tmpdir):
+    tmpdir.join(".startup").write("1421767422\n15-01-20_15.23.42\n")
+    tmpdir.join(".rotated.dns").write("15-01-20_16.00.00\n")
+    tmpdir.join(".rotated.http").write("15-01-20_18.00.00\n")
+
+    for name in ("conn.log", "dns.log", "http.log", "weird.2015-01-20-16-10-00.log", "notes.txt"):
+        tmpdir.join(name).write("")
+
+    jobs = postterminate.remaining_logs(str(tmpdir), "15-01-20_17.00.00")
+
+    assert jobs == [
+        ["conn.log", "conn", "15-01-20_15.23.42", "15-01-20_17.00.00", "1", "ascii"],
+        ["dns.log", "dns", "15-01-20_16.00.00", "15-01-20_17.00.00", "1", "ascii"],
+        ["http.log", "http", "15-01-20_17.00.00", "15-01-20_17.00.00", "1", "ascii"],
+        ["weird.2015-01-20-16-10-00.log", "weird", "15-01-20_16.10.00", "15-01-20_17.00.00", "1", "ascii"],
+    ]
+
+def test_wait_for_archivelog(tmpdir):
+    # A process that has exited without removing its PID file.
+    proc = subprocess.Popen(["true"])
+    proc.wait()
+    tmpdir.join(".archive-log.running.%d.tmp" % proc.pid).write("%d\n" % proc.pid)
+
+    # A process that is still archiving.
+    proc = subprocess.Popen(["sleep", "0.5"])
+    tmpdir.join(".archive-log.running.%d.tmp" % proc.pid).write("%d\n" % proc.pid)
+
+    # A log queued by a process that keeps running.
+    queued = tmpdir.join(".archive-log.queued.1.tmp")
+    queued.write("%d\n" % os.getpid())
+    timer = threading.Timer(0.3, queued.remove)
+    timer.start()
+
+    start = time.time()
+    postterminate.wait_for_archivelog(str(tmpdir))
+    proc.wait()
+    timer.join()
+
+    assert postterminate.pending(str(tmpdir)) == []
+    assert time.time() - start < 3
+
+def test_archive_remaining(tmpdir):
+    scriptsdir = tmpdir.mkdir("scripts")
+    archivelog = scriptsdir.join("archive-log")
+    archivelog.write("#! /bin/sh\n[ \"$ARCHIVE_LOG_DIRECT\" = 1 ] || exit 1\n[ $2 != bad ] && mv $1 archived.$2\n")
+    archivelog.chmod(0o755)
+
+    nodedir = tmpdir.mkdir("node")
+    nodedir.join(".startup").write("1421767422\n15-01-20_15.23.42\n")
+    for name in ("conn.log", "dns.log", "files.log"):
+        nodedir.join(name).write("")
+
+    assert postterminate.archive_remaining(str(nodedir), str(scriptsdir), "15-01-20_17.00.00", 2)
+    assert sorted(os.listdir(str(nodedir))) == [".startup", "archived.conn", "archived.dns", "archived.files"]
+
+    nodedir.join("bad.log").write("")
+    assert not postterminate.archive_remaining(str(nodedir), str(scriptsdir), "15-01-20_17.00.00", 2)
@@ -0,0 +1,71 @@
+from __future__ import print_function
+import os
+
+from ZeekControl import tsdb
+
+def test_rollups(tmpdir):
+    db = tsdb.TimeSeriesDB(str(tmpdir))
+    t = 1000 * 3600.0
+
+    for i in range(12):
+        db.add(t + i * 60, [("worker-1", "parent-cpu", i), ("worker-1", "interface-mbps", 2 * i)])
+
+    assert db.nodes() == ["worker-1"]
+    assert db.metrics("worker-1") == ["interface-mbps", "parent-cpu"]
+
+    raw = db.query("worker-1", "parent-cpu", t, t + 3600, "raw")
+    assert len(raw) == 12
+    assert raw[3] == (t + 180, 1, 3.0, 3.0, 3.0)
+
+    # Samples 0-4, 5-9, and 10-11 fall into three 5-minute buckets.
+    rollup = db.query("worker-1", "parent-cpu", t, t + 3600, "5m")
+    assert rollup == [(t, 5, 10.0, 0.0, 4.0), (t + 300, 5, 35.0, 5.0, 9.0), (t + 600, 2, 21.0, 10.0, 11.0)]
+
+    hourly = db.query("worker-1", "parent-cpu", t, t + 3600, "1h")
+    assert hourly == [(t, 12, 66.0, 0.0, 11.0)]
+
+    # All resolutions aggregate to the same result.
+    for records in (raw, rollup, hourly):
+        agg = tsdb.aggregate(records)
+        assert (agg["count"], agg["avg"], agg["min"], agg["max"]) == (12, 5.5, 0.0, 11.0)
+
+    assert tsdb.aggregate(raw)["last"] == 11.0
+    assert tsdb.aggregate(db.query("worker-1", "parent-cpu", t + 300, t + 600, "raw"))["count"] == 5
+    assert tsdb.aggregate(db.query("worker-1", "nope", t, t + 3600, "raw")) is None
+
+def test_partial_record(tmpdir):
+    db = tsdb.TimeSeriesDB(str(tmpdir))
+    t = 1000 * 3600.0
+    db.add(t, [("n", "m", 1)])
+
+    mdir = tmpdir.join("n", "m")
+    for fname in mdir.listdir():
+        with open(str(fname), "ab") as f:
+            f.write(b"xyz")
+
+    db.add(t + 1, [("n", "m", 3)])
+    assert len(db.query("n", "m", t, t + 10, "raw")) == 2
+    assert db.query("n", "m", t, t + 10, "5m") == [(t, 2, 4.0, 1.0, 3.0)]
+
+def test_expire(tmpdir):
+    db = tsdb.TimeSeriesDB(str(tmpdir))
+    day = 86400.0
+    t = 1000 * day
+
+    db.add(t, [("n", "m", 1)])
+    db.add(t + 10 * day, [("n", "m", 2)])
+
+    assert db.expire(t + 10 * day) == 1
+    assert db.query("n", "m", 0, t + 11 * day, "raw") == [(t + 10 * day, 1, 2.0, 2.0, 2.0)]
+    assert len(db.query("n", "m", 0, t + 11 * day, "1h")) == 2
+
+    # Directories without data left are removed.
+    for f in tmpdir.join("n", "m").listdir():
+        f.remove()
+    db.expire(t + 10 * day)
+    assert not os.path.exists(str(tmpdir.join("n")))
+
+def test_choose_resolution():
+    assert tsdb.choose_resolution(0, 3600) == "raw"
+    assert tsdb.choose_resolution(0, 7 * 86400) == "5m"
+    assert tsdb.choose_resolution(0, 90 * 86400) == "1h"
@@ -0,0 +1,280 @@
+from __future__ import print_function
+import os
+import hashlib
+import time
+import asyncio
+import threading
+import http.client
+
+import pytest
+
+from ZeekControl import cmdresult
+from ZeekControl import lock
+from ZeekControl import zeekctld
+from ZeekControl.zeekctl import expose, read_only
+from ZeekControl.exceptions import ZeekControlError
+
+class Config:
+    def __init__(self, sockpath, cfgfile, nodecfg):
+        self.zeekctldsocket = sockpath
+        self.zeekctldport = 0
+        self.zeekctldaddress = "127.0.0.1"
+        self.zeekctldjobs = 3
+        self.zeekctldjobttl = 3600
+        self.zeekctldreadworkers = 2
+        self.cfgfile = cfgfile
+        self.nodecfg = nodecfg
+        self.reload_cfg()
+
+    def reload_cfg(self):
+        with open(self.nodecfg) as f:
+            self.nodes = [line.strip("[]\n") for line in f if line.startswith("[")]
+
+    def _get_zeekctlcfg_hash(self, filehash=False):
+        with open(self.cfgfile, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def _get_nodecfg_hash(self, filehash=False):
+        with open(self.nodecfg, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+class FakeZeekCtl:
+    def __init__(self, ui, config):
+        self.ui = ui
+        self.config = config
+        self.release = threading.Event()
+
+    def reload_cfg(self):
+        with lock.exclude_readers():
+            self.config.reload_cfg()
+
+    @expose
+    def status(self, node_list=None):
+        self.ui.info("status of %s" % (node_list or " ".join(self.config.nodes)))
+        self.ui.error("something failed")
+        return cmdresult.CmdResult(ok=False)
+
+    @expose
+    def broken(self):
+        raise ZeekControlError("broken")
+
+    @expose
+    def blocking(self):
+        self.release.wait(10)
+        return True
+
+    @expose
+    @read_only
+    def peek(self):
+        return "peeked"
+
+    @expose
+    def execute(self, cmd):
+        if cmd == "broken":
+            raise ZeekControlError("broken")
+        return cmdresult.CmdResult(ok=False)
+
+    def warn_zeekctl_install(self):
+        self.ui.warn("zeekctl install needed")
+
+    def hidden(self):
+        return True
+
+@pytest.fixture
+def daemon(tmpdir):
+    sockpath = str(tmpdir.join("zeekctld.sock"))
+    tmpdir.join("zeekctl.cfg").write("")
+    tmpdir.join("node.cfg").write("[worker-1]\n")
+    ui = zeekctld.JobUI()
+    zeekctl = FakeZeekCtl(ui, Config(sockpath, str(tmpdir.join("zeekctl.cfg")), str(tmpdir.join("node.cfg"))))
+    d = zeekctld.Daemon(zeekctl, ui)
+    loop = asyncio.new_event_loop()
+
+    thread = threading.Thread(target=loop.run_until_complete, args=(d.run(loop, signals=False),))
+    thread.start()
+
+    while not os.path.exists(sockpath):
+        time.sleep(0.01)
+
+    yield d
+
+    zeekctl.release.set()
+    d.stop()
+    thread.join()
+    loop.close()
+    assert not os.path.exists(sockpath)
+
+def test_call(daemon):
+    client = zeekctld.Client(daemon.config.zeekctldsocket)
+    output = []
+
+    outcome = client.call("status", ["worker-1"], output=lambda stream, text: output.append((stream, text)))
+    assert output == [("info", "status of worker-1"), ("error", "something failed")]
+    assert outcome["state"] == zeekctld.Done
+    assert outcome["result"]["ok"] is False
+
+    # The connection is kept open for further requests.
+    sock = client.conn.sock
+    outcome = client.call("broken")
+    assert (outcome["state"], outcome["error"]) == (zeekctld.Failed, "broken")
+    assert client.conn.sock is sock
+
+    methods = client.get("/api")["methods"]
+    assert sorted(methods) == ["blocking", "broken", "execute", "peek", "status"]
+    assert methods["status"] == {"args": ["node_list"], "read_only": False}
+    assert methods["peek"]["read_only"] is True
+
+    for (method, args) in (("hidden", []), ("status", [1, 2, 3])):
+        with pytest.raises(ZeekControlError):
+            client.call(method, args)
+
+    client.close()
+
+def test_jobs(daemon):
+    client = zeekctld.Client(daemon.config.zeekctldsocket)
+
+    # Jobs run one after another, so this one waits for the blocking one.
+    blocking = client.submit("blocking")
+    queued = client.submit("status", kwargs={"node_list": "manager"})
+    assert client.get("/jobs/%d" % queued)["state"] == zeekctld.Queued
+
+    daemon.zeekctl.release.set()
+    output = []
+    assert client.follow(queued, lambda stream, text: output.append(text))["state"] == zeekctld.Done
+    assert output == ["status of manager", "something failed"]
+    assert client.get("/jobs/%d" % blocking)["result"] is True
+
+    # Read-only jobs don't wait for the others.
+    daemon.zeekctl.release.clear()
+    blocking = client.submit("blocking")
+    assert client.call("peek")["result"] == "peeked"
+    assert client.get("/jobs/%d" % blocking)["state"] != zeekctld.Done
+    daemon.zeekctl.release.set()
+    client.follow(blocking)
+
+    # Only the most recent records are kept.
+    for i in range(3):
+        client.follow(client.submit("status"))
+    assert len(client.get("/jobs")["jobs"]) == 3
+
+    with pytest.raises(ZeekControlError):
+        client.get("/jobs/%d" % blocking)
+
+    client.close()
+
+def test_sse(daemon):
+    client = zeekctld.Client(daemon.config.zeekctldsocket)
+    id = client.submit("status")
+    client.follow(id)
+    client.close()
+
+    conn = zeekctld._UnixHTTPConnection(daemon.config.zeekctldsocket)
+    conn.request("GET", "/jobs/%d/log" % id, headers={"Accept": "text/event-stream", "Last-Event-ID": "0"})
+    resp = conn.getresponse()
+    assert resp.getheader("Content-Type") == "text/event-stream"
+
+    events = resp.read().decode("utf-8").split("\n\n")
+    assert events[0] == 'id: 1\nevent: error\ndata: "something failed"'
+    assert events[1].startswith("event: result\n")
+    conn.close()
+
+def test_evict():
+    jobs = zeekctld.Jobs(2, 60)
+
+    async def add():
+        return [jobs.add("status", [], {}) for i in range(3)]
+
+    loop = asyncio.new_event_loop()
+    (a, b, c) = loop.run_until_complete(add())
+    loop.close()
+
+    # Records of unfinished jobs are kept.
+    assert [j.id for j in jobs] == [1, 2, 3]
+
+    a.state = b.state = zeekctld.Done
+    a.finished = 100
+    b.finished = 200
+    jobs.evict(now=150)
+    assert [j.id for j in jobs] == [2, 3]
+
+    jobs.evict(now=300)
+    assert [j.id for j in jobs] == [3]
+
+def test_command(daemon):
+    client = zeekctld.Client(daemon.config.zeekctldsocket)
+    output = []
+
+    # The output is formatted like zeekctl does.
+    outcome = client.read_log(client.command(["status", "worker-1"]), lambda stream, text: output.append((stream, text)))
+    assert outcome["result"] is True
+    assert output[:3] == [("info", "Warning: zeekctl install needed"), ("info", "status of worker-1"), ("error", "Error: something failed")]
+    assert output[3][1].split() == ["Name", "Type", "Host", "Status", "Pid", "Started"]
+
+    assert client.read_log(client.command(["exec", "ls"]))["result"] is False
+    outcome = client.read_log(client.command(["exec", "broken"]))
+    assert (outcome["state"], outcome["error"]) == (zeekctld.Failed, "broken")
+
+    for args in (["cron"], ["--version"], []):
+        with pytest.raises(ZeekControlError):
+            client.command(args)
+
+    client.close()
+
+def test_cancel(daemon):
+    client = zeekctld.Client(daemon.config.zeekctldsocket)
+    other = zeekctld.Client(daemon.config.zeekctldsocket)
+
+    blocking = client.submit("blocking")
+    while client.get("/jobs/%d" % blocking)["state"] != zeekctld.Running:
+        time.sleep(0.01)
+
+    resp = other.command(["exec", "ls"])
+    queued = int(resp.getheader("X-Zeekctld-Job"))
+    assert queued == blocking + 1
+
+    # Only the queued job can be cancelled.
+    assert client.cancel(queued)
+    assert not client.cancel(blocking)
+
+    outcome = other.read_log(resp)
+    assert (outcome["state"], outcome["error"]) == (zeekctld.Failed, "job was cancelled")
+
+    daemon.zeekctl.release.set()
+    assert client.follow(blocking)["state"] == zeekctld.Done
+
+    with pytest.raises(ZeekControlError):
+        client.cancel(99)
+
+    client.close()
+    other.close()
+
+def test_command_reloads_config(daemon):
+    client = zeekctld.Client(daemon.config.zeekctldsocket)
+
+    def status():
+        output = []
+        client.read_log(client.command(["status"]), lambda stream, text: output.append(text))
+        return output[1]
+
+    assert status() == "status of worker-1"
+
+    # The next command sees the changed node.cfg, as it would without the
+    # daemon.
+    with open(daemon.config.nodecfg, "a") as f:
+        f.write("[worker-2]\n")
+
+    assert status() == "status of worker-1 worker-2"
+    assert status() == "status of worker-1 worker-2"
+    client.close()
+
+def test_socket_path(tmpdir):
+    cfgfile = str(tmpdir.join("zeekctl.cfg"))
+    assert zeekctld.socket_path(cfgfile, "/zeek") == "/zeek/spool/zeekctld.sock"
+
+    with open(cfgfile, "w") as f:
+        f.write("# SpoolDir = /nowhere\nspooldir = ${ZeekBase}/var/spool\n")
+    assert zeekctld.socket_path(cfgfile, "/zeek") == "/zeek/var/spool/zeekctld.sock"
+
+    with open(cfgfile, "a") as f:
+        f.write("ZeekCtldSocket = /run/zeekctld.sock\n")
+    assert zeekctld.socket_path(cfgfile, "/zeek") == "/run/zeekctld.sock"